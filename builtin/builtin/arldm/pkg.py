@@ -5,7 +5,6 @@ Arldm is ....
 from jarvis_cd.basic.pkg import Application
 from jarvis_util import *
 import os, pathlib
-import time
 import yaml
 from scspkg.pkg import Package
 import sys # for stdout, stderr
@@ -298,14 +297,10 @@ class Arldm(Application):
         
         prep_cmd = ' '.join(cmd)
         
-        start = time.time()
-        Exec(prep_cmd, LocalExecInfo(
-            env=self.mod_env,
-            cwd=self.config['arldm_path']))
-        
-        end = time.time()
-        diff = end - start
-        self.log(f'TIME: {diff} seconds') # color=Color.GREEN
+        with self.span('prep_hdf5', log=True):
+            Exec(prep_cmd, LocalExecInfo(
+                env=self.mod_env,
+                cwd=self.config['arldm_path']))
         
         # check if hdf5_file exists
         if pathlib.Path(self.config['hdf5_file']).exists():
@@ -337,21 +332,16 @@ class Arldm(Application):
         
         conda_cmd = ' '.join(cmd)
         
-        start = time.time()
-
         self.jutil.debug_local_exec = True
-        Exec(conda_cmd,
-             LocalExecInfo(env=self.mod_env,
-                           do_dbg=self.config['do_dbg'],
-                           dbg_port=self.config['dbg_port'],
-                           pipe_stdout=self.config['stdout'],
-                           pipe_stderr=self.config['stderr'],
-                           cwd=self.config['arldm_path']))
+        with self.span('train', log=True):
+            Exec(conda_cmd,
+                 LocalExecInfo(env=self.mod_env,
+                               do_dbg=self.config['do_dbg'],
+                               dbg_port=self.config['dbg_port'],
+                               pipe_stdout=self.config['stdout'],
+                               pipe_stderr=self.config['stderr'],
+                               cwd=self.config['arldm_path']))
         self.jutil.debug_local_exec = False
-        
-        end = time.time()
-        diff = end - start
-        self.log(f'TIME: {diff} seconds') # color=Color.GREEN
     
     def _sample(self):
         """
@@ -441,20 +431,15 @@ class Arldm(Application):
         
         self.log(f"ARLDM start")
         
-        start = time.time()
-        
-        if self.config['prep_hdf5']:
-            self._prep_hdf5_file()
-        
-        if self.config['mode'] == 'train':
-            self._train()
-        
-        if self.config['mode'] == 'sample':
-            self._sample()
-        
-        end = time.time()
-        diff = end - start
-        self.log(f'TOTAL RUN TIME: {diff} seconds')
+        with self.span('total', log=True):
+            if self.config['prep_hdf5']:
+                self._prep_hdf5_file()
+
+            if self.config['mode'] == 'train':
+                self._train()
+
+            if self.config['mode'] == 'sample':
+                self._sample()
 
 
     def stop(self):
@@ -6,7 +6,6 @@ from jarvis_cd.basic.pkg import Application
 from jarvis_util import *
 import os
 import pathlib
-import time
 
 
 class DataStagein(Application):
@@ -138,42 +137,40 @@ class DataStagein(Application):
         if not pathlib.Path(dest_data_path).exists():
             pathlib.Path(dest_data_path).mkdir(parents=True, exist_ok=True)
         
-        start = time.time()
-        
-        for data_path in user_data_list:
-            if not os.path.exists(data_path):
-                raise FileNotFoundError(f"Data path {data_path} does not exist")
-            else:
-                # check if data_path is a directory
-                if os.path.isdir(data_path):
-                    # Check if the path is empty (e.g. does not contain any files)
-                    if len(os.listdir(data_path)) == 0:
-                        raise ValueError(f"Data path {data_path} is empty")
+        total_items = 0
+        with self.span('copy', log=True):
+            for data_path in user_data_list:
+                if not os.path.exists(data_path):
+                    raise FileNotFoundError(f"Data path {data_path} does not exist")
                 else:
-                    # Check if the file is not empty
-                    if os.stat(data_path).st_size == 0:
-                        raise ValueError(f"Data file {data_path} is empty")
-            
-            # Check if two directory contains the same files
-            dest_files = os.listdir(dest_data_path)
-            if os.path.isdir(data_path) and set(dest_files) == set(os.listdir(data_path)):
-                # data_files = os.listdir(data_path)
-                # if set(dest_files) == set(data_files):
-                print(f"Data path {data_path} already exists in {dest_data_path}")
-                continue
-            
-            # Move data to destination path
-            cmd = f"cp -r {data_path} {dest_data_path}"
-            print(f"Copying data from {data_path} to {dest_data_path}")
-            Exec(cmd,LocalExecInfo(env=self.mod_env,))
-            
-            copied_items = 1
-            if os.path.isdir(data_path): copied_items = len(os.listdir(data_path))
-            print(f"Copied {copied_items} items ... ")
-        
-        end = time.time()
-        diff = end - start
-        self.log(f'data_stagein TIME: {diff} seconds')
+                    # check if data_path is a directory
+                    if os.path.isdir(data_path):
+                        # Check if the path is empty (e.g. does not contain any files)
+                        if len(os.listdir(data_path)) == 0:
+                            raise ValueError(f"Data path {data_path} is empty")
+                    else:
+                        # Check if the file is not empty
+                        if os.stat(data_path).st_size == 0:
+                            raise ValueError(f"Data file {data_path} is empty")
+
+                # Check if two directory contains the same files
+                dest_files = os.listdir(dest_data_path)
+                if os.path.isdir(data_path) and set(dest_files) == set(os.listdir(data_path)):
+                    # data_files = os.listdir(data_path)
+                    # if set(dest_files) == set(data_files):
+                    print(f"Data path {data_path} already exists in {dest_data_path}")
+                    continue
+
+                # Move data to destination path
+                cmd = f"cp -r {data_path} {dest_data_path}"
+                print(f"Copying data from {data_path} to {dest_data_path}")
+                Exec(cmd,LocalExecInfo(env=self.mod_env,))
+
+                copied_items = 1
+                if os.path.isdir(data_path): copied_items = len(os.listdir(data_path))
+                print(f"Copied {copied_items} items ... ")
+                total_items += copied_items
+        self.metric('copied_items', total_items)
             
         print("Data stagein complete")
 
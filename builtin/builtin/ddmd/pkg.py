@@ -6,7 +6,6 @@ from jarvis_cd.basic.pkg import Application
 from jarvis_util import *
 import os
 import yaml
-import time
 import pathlib, glob, shutil
 
 class Ddmd(Application):
@@ -579,57 +578,45 @@ class Ddmd(Application):
         
         iter_cnt = self.config['iter_count']
         
-        total_start = time.time()
-        
-        for i in range(iter_cnt):
-                            
-            if self.config['skip_sim'] == False:
-                start = time.time()
-                self.openmm_list = self._run_openmm()
-                # wait for all self.openmm_list to finish
-                for task in self.openmm_list:
-                    if task is not None:
-                        task.wait()
-                
-                end = time.time()
-            
-                print(f"OpenMM[{(self.config['stage_idx'])}] : " + str(end - start) + " seconds")
-            else:
-                print("Skipping OpenMM stage")
-            
-            if self.config['short_pipe'] == False:
-                start = time.time()
-                self._run_aggregate()
-                end = time.time()
-                print(f"Aggregate[{(self.config['stage_idx'])}] : " + str(end - start) + " seconds")
-                
-            
-            self.config['stage_idx']+=1
-            
-            train_start = time.time()
-            self.train = self._run_train()
-            if self.config['short_pipe'] == False:
-                self.train.wait()
-                end = time.time()
-                print(f"Train[{(self.config['stage_idx'])}] : " + str(end - train_start) + " seconds")
-            else:
-                print("Shortened Pipeline: Train stage not waited")
-            
-            self.config['stage_idx']+=1
-            
-            start = time.time()
-            self.inference = self._run_inference()
-            end = time.time()
-            
-            if self.config['short_pipe'] == False:
-                print(f"Inference stage[{(self.config['stage_idx'])}] : " + str(end - start) + " seconds")
-            else:
-                self.train.wait()
-                end = time.time()
-                print(f"Train[{(self.config['stage_idx']-1)}] and Inference[{(self.config['stage_idx'])}] : " + str(end - train_start) + " seconds")
+        with self.span('total', log=True):
+            for i in range(iter_cnt):
+
+                if self.config['skip_sim'] == False:
+                    with self.span('openmm', log=True,
+                                   stage=self.config['stage_idx']):
+                        self.openmm_list = self._run_openmm()
+                        # wait for all self.openmm_list to finish
+                        for task in self.openmm_list:
+                            if task is not None:
+                                task.wait()
+                else:
+                    print("Skipping OpenMM stage")
+
+                if self.config['short_pipe'] == False:
+                    with self.span('aggregate', log=True,
+                                   stage=self.config['stage_idx']):
+                        self._run_aggregate()
+
+                self.config['stage_idx']+=1
 
-        total_end = time.time()
-        print(f"Total time: {total_end - total_start} seconds")
+                if self.config['short_pipe'] == False:
+                    with self.span('train', log=True,
+                                   stage=self.config['stage_idx']):
+                        self.train = self._run_train()
+                        self.train.wait()
+                    self.config['stage_idx']+=1
+                    with self.span('inference', log=True,
+                                   stage=self.config['stage_idx']):
+                        self.inference = self._run_inference()
+                else:
+                    # Training overlaps with inference
+                    with self.span('train_inference', log=True,
+                                   stage=self.config['stage_idx'] + 1):
+                        self.train = self._run_train()
+                        print("Shortened Pipeline: Train stage not waited")
+                        self.config['stage_idx']+=1
+                        self.inference = self._run_inference()
+                        self.train.wait()
     
     
     def kill(self):
@@ -5,7 +5,6 @@ substances.
 """
 from jarvis_cd.basic.pkg import Application, Color
 from jarvis_util import *
-import time
 import pathlib
 
 
@@ -159,15 +158,12 @@ class GrayScott(Application):
         :return: None
         """
         # print(self.env['HERMES_CLIENT_CONF'])
-        start = time.time()
-        Exec(f'gray-scott {self.settings_json_path}',
-             MpiExecInfo(nprocs=self.config['nprocs'],
-                         ppn=self.config['ppn'],
-                         hostfile=self.jarvis.hostfile,
-                         env=self.mod_env))
-        end = time.time()
-        diff = end - start
-        self.log(f'TIME: {diff} seconds', color=Color.GREEN)
+        with self.span('run', log=True):
+            Exec(f'gray-scott {self.settings_json_path}',
+                 MpiExecInfo(nprocs=self.config['nprocs'],
+                             ppn=self.config['ppn'],
+                             hostfile=self.jarvis.hostfile,
+                             env=self.mod_env))
 
     def stop(self):
         """
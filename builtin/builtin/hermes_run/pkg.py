@@ -4,6 +4,7 @@ hrun is ....
 """
 
 from jarvis_cd.basic.pkg import Service, Color
+from jarvis_cd.basic.probe import PortProbe
 from jarvis_util import *
 
 
@@ -415,6 +416,7 @@ class HermesRun(Service):
             raise Exception(f'Failed to find hermes_run provider {provider}')
         net_info = net_info.rows[0]
         protocol = net_info['provider']
+        self.config['protocol'] = str(protocol)
         domain = net_info['domain']
         hostfile_path = self.hostfile.path
         if self.hostfile.path is None:
@@ -474,8 +476,21 @@ class HermesRun(Service):
                                              hide_output=self.config['hide_output'],
                                              pipe_stdout=self.config['stdout'],
                                              pipe_stderr=self.config['stderr']))
-        time.sleep(self.config['sleep'])
-        self.log('Done sleeping')
+        self.wait_ready()
+
+    def ready_probes(self):
+        """
+        With the tcp and sockets providers, the runtime is ready once every
+        node listens on the RPC port. Other providers (e.g., verbs) do not
+        listen on a TCP port, so the runtime sleeps instead.
+
+        :return: List of Probe
+        """
+        # E.g., tcp;ofi_rxm
+        protocol = str(self.config.get('protocol')).split(';')[0]
+        if protocol not in ['tcp', 'sockets']:
+            return []
+        return [PortProbe(self.hostfile.hosts, self.config['port'])]
 
     def stop(self):
         """
@@ -520,9 +535,8 @@ class HermesRun(Service):
         :return: None
         """
         self.get_hostfile()
-        for path in self.config['borg_paths']:
-            self.log(f'Removing {path}', Color.YELLOW)
-            Rm(path, PsshExecInfo(hostfile=self.hostfile))
+        self.log(f'Removing {self.config["borg_paths"]}', Color.YELLOW)
+        Rm(self.config['borg_paths'], PsshExecInfo(hostfile=self.hostfile))
 
     def status(self):
         """
@@ -214,15 +214,35 @@ class Orangefs(Service, OrangefsCustomKern, OrangefsAres):
     def clean(self):
         self._load_config()
 
-        Rm([self.config['mount'], self.config['client_log']],
-           PsshExecInfo(hosts=self.client_hosts,
-                        env=self.env))
-        Rm([self.config['storage'], self.config['log']],
-           PsshExecInfo(hosts=self.server_hosts,
-                        env=self.env))
-        Rm(self.config['metadata'],
-           PsshExecInfo(hosts=self.md_hosts,
-                        env=self.env))
+        # The clients, servers, and metadata servers are cleaned at once
+        rms = [
+            Rm([self.config['mount'], self.config['client_log']],
+               PsshExecInfo(hosts=self.client_hosts,
+                            env=self.env,
+                            exec_async=True)),
+            Rm([self.config['storage'], self.config['log']],
+               PsshExecInfo(hosts=self.server_hosts,
+                            env=self.env,
+                            exec_async=True)),
+            Rm(self.config['metadata'],
+               PsshExecInfo(hosts=self.md_hosts,
+                            env=self.env,
+                            exec_async=True)),
+        ]
+        for rm in rms:
+            rm.wait()
+
+    def warm_reset(self):
+        """
+        Remove the files of the last run, so the servers can be kept
+        running for the next run of a sweep.
+
+        :return: None
+        """
+        self._load_config()
+        Exec(f'rm -rf {self.config["mount"]}/*',
+             PsshExecInfo(hosts=self.client_hosts.subset(1),
+                          env=self.env))
 
     def status(self):
         self._load_config()
@@ -4,7 +4,6 @@ Pyflextrkr is ....
 """
 from jarvis_cd.basic.pkg import Application, Color
 from jarvis_util import *
-import time
 import pathlib
 
 import yaml
@@ -345,19 +344,14 @@ class Pyflextrkr(Application):
         
         self.log(f"Pyflextrkr run_cmd: {self.config['run_cmd']}")
         
-        start = time.time()
-        
-        Exec(self.config['run_cmd'],
-             LocalExecInfo(env=self.mod_env,
-                           do_dbg=self.config['do_dbg'],
-                           dbg_port=self.config['dbg_port'],
-                           pipe_stdout=self.config['stdout'],
-                           pipe_stderr=self.config['stderr'],
-                           ))
-        
-        end = time.time()
-        diff = end - start
-        self.log(f'Pyflextrkr TIME: {diff} seconds') # color=Color.GREEN
+        with self.span('run', log=True):
+            Exec(self.config['run_cmd'],
+                 LocalExecInfo(env=self.mod_env,
+                               do_dbg=self.config['do_dbg'],
+                               dbg_port=self.config['dbg_port'],
+                               pipe_stdout=self.config['stdout'],
+                               pipe_stderr=self.config['stderr'],
+                               ))
         
 
     def stop(self):
@@ -3,6 +3,7 @@ This module provides classes and methods to launch the Ior application.
 Ior is ....
 """
 from jarvis_cd.basic.pkg import Service
+from jarvis_cd.basic.probe import FileProbe
 from jarvis_util import *
 from jarvis_util.introspect.monitor import Monitor
 
@@ -10,6 +11,8 @@ class Pymonitor(Service):
     """
     This class provides methods to launch the Ior application.
     """
+    # The monitor does not need any other pkg to be running
+    depends_on = []
     def _init(self):
         """
         Initialize paths
@@ -72,12 +75,17 @@ class Pymonitor(Service):
         hostfile = self.jarvis.hostfile
         if self.config['num_nodes'] > 0:
             hostfile = hostfile.subset(self.config['num_nodes'])
+        # Remove the logs of the last run, so they do not pass the probe
+        Rm(self.config['dir'])
+        Mkdir(self.config['dir'])
         Monitor(self.config['frequency'],
                 self.config['dir'],
                 PsshExecInfo(env=self.env,
                             hostfile=hostfile,
                             exec_async=True))
-        time.sleep(self.config['sleep'])
+        # The monitor is running once every host wrote its first log
+        self.wait_ready([FileProbe(os.path.join(self.config['dir'], '*'),
+                                   count=len(hostfile))])
 
     def stop(self):
         """
@@ -3,6 +3,7 @@ This module provides classes and methods to launch Redis.
 Redis cluster is used if the hostfile has many hosts
 """
 from jarvis_cd.basic.pkg import Application
+from jarvis_cd.basic.probe import PortProbe, CmdProbe
 from jarvis_util import *
 
 
@@ -81,8 +82,7 @@ class Redis(Application):
                           do_dbg=self.config['do_dbg'],
                           dbg_port=self.config['dbg_port'],
                           exec_async=True))
-        self.log(f'Sleeping for {self.config["sleep"]} seconds', color=Color.YELLOW)
-        time.sleep(self.config['sleep'])
+        self.wait_ready([PortProbe(hostfile.hosts, self.config['port'])])
 
         # Create redis clients
         if len(hostfile) > 1:
@@ -113,8 +113,10 @@ class Redis(Application):
                                hostfile=hostfile,
                                do_dbg=self.config['do_dbg'],
                                dbg_port=self.config['dbg_port']))
-            self.log(f'Sleeping for {self.config["sleep"]} seconds', color=Color.YELLOW)
-            time.sleep(self.config['sleep'])
+            self.wait_ready([CmdProbe(
+                f'redis-cli -p {self.config["port"]} -h {hostfile.hosts[0]} '
+                f'cluster info',
+                pattern='cluster_state:ok', env=self.mod_env)])
 
     def stop(self):
         """
@@ -4,6 +4,7 @@ SparkCluster is ....
 """
 
 from jarvis_cd.basic.pkg import Service
+from jarvis_cd.basic.probe import PortProbe
 from jarvis_util import *
 
 
@@ -64,13 +65,23 @@ class SparkCluster(Service):
         Exec(f'{self.config["SPARK_SCRIPTS"]}/sbin/start-master.sh',
              PsshExecInfo(env=self.env,
                           hosts=self.jarvis.hostfile.subset(1)))
-        time.sleep(1)
+        self.wait_ready([PortProbe([self.env['SPARK_MASTER_HOST']],
+                                   self.env['SPARK_MASTER_PORT'])])
         # Start the worker nodes
         Exec(f'{self.config["SPARK_SCRIPTS"]}/sbin/start-worker.sh '
              f'{self.env["SPARK_MASTER_HOST"]}:{self.env["SPARK_MASTER_PORT"]}',
              PsshExecInfo(env=self.mod_env,
                           hosts=self.jarvis.hostfile.subset(self.config['num_nodes'])))
-        time.sleep(self.config['sleep'])
+        self.wait_ready()
+
+    def ready_probes(self):
+        """
+        The cluster is ready once every worker listens on its port
+
+        :return: List of Probe
+        """
+        workers = self.jarvis.hostfile.subset(self.config['num_nodes'])
+        return [PortProbe(workers.hosts, self.env['SPARK_WORKER_PORT'])]
 
     def stop(self):
         """
@@ -98,6 +109,15 @@ class SparkCluster(Service):
         """
         pass
 
+    def warm_reset(self):
+        """
+        The cluster keeps no data between jobs, so it can be kept running
+        for the next run of a sweep as is.
+
+        :return: None
+        """
+        pass
+
     def status(self):
         """
         Check whether or not an application is running. E.g., are OrangeFS
@@ -0,0 +1,322 @@
+"""
+This module contains the jarvis daemon and its client. The daemon keeps
+the JarvisManager, the resource graph, the pkg index, and recently used
+pipelines in memory. The jarvis CLI forwards its arguments to the daemon
+over a Unix domain socket, along with its cwd, environment, and stdio.
+
+Each command runs in a child forked from the daemon, so it starts with
+everything the daemon has loaded, writes its output directly to the
+client's terminal, and persists its changes to CONFIG_DIR like any other
+jarvis process.
+
+The client must stay cheap to import: only the standard library is
+imported at module level.
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+LOCAL_CONFIG_DIR = os.path.join(Path.home(), '.jarvis')
+DAEMON_SOCK_PATH = os.path.join(LOCAL_CONFIG_DIR, 'daemon.sock')
+DAEMON_PID_PATH = os.path.join(LOCAL_CONFIG_DIR, 'daemon.pid')
+DAEMON_LOG_PATH = os.path.join(LOCAL_CONFIG_DIR, 'daemon.log')
+# The stdin, stdout, and stderr of the client
+STDIO_FDS = [0, 1, 2]
+HEADER = struct.Struct('!I')
+
+
+def daemon_pid():
+    """
+    Get the pid of the running daemon
+
+    :return: int or None
+    """
+    try:
+        with open(DAEMON_PID_PATH, 'r', encoding='utf-8') as fp:
+            pid = int(fp.read().strip())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+    return pid
+
+
+def forward(argv):
+    """
+    Run a jarvis command in the daemon.
+
+    :param argv: The command line arguments (without the binary name)
+    :return: The exit code of the command, or None if no daemon is
+    running and the command should run in this process.
+    """
+    if os.getenv('JARVIS_NO_DAEMON') or not os.path.exists(DAEMON_SOCK_PATH):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(DAEMON_SOCK_PATH)
+        payload = json.dumps({
+            'argv': list(argv),
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+        }).encode('utf-8')
+        socket.send_fds(sock, [HEADER.pack(len(payload))], STDIO_FDS)
+        sock.sendall(payload)
+    except OSError:
+        sock.close()
+        return None
+    pid = None
+    with sock, sock.makefile('r', encoding='utf-8') as reader:
+        while True:
+            try:
+                line = reader.readline()
+            except KeyboardInterrupt:
+                # The command does not share our process group
+                if pid is not None:
+                    os.kill(pid, signal.SIGINT)
+                continue
+            if not line:
+                # The daemon died while running the command
+                return 1
+            reply = json.loads(line)
+            if 'pid' in reply:
+                pid = reply['pid']
+            if 'exit_code' in reply:
+                return reply['exit_code']
+
+
+class JarvisDaemon:
+    """
+    Serve jarvis commands over a Unix domain socket
+    """
+
+    def __init__(self, args_cls, max_pipelines=8):
+        """
+        Initialize the daemon
+
+        :param args_cls: The ArgParse class of the jarvis CLI
+        :param max_pipelines: The number of recently used pipelines to
+        keep loaded
+        """
+        from jarvis_cd.basic.jarvis_manager import JarvisManager
+        self.args_cls = args_cls
+        self.max_pipelines = max_pipelines
+        self.jarvis = JarvisManager.get_instance()
+        self.jarvis.enable_state_cache()
+        # Recently used pipelines (pipeline_id -> Pipeline)
+        self.pipelines = OrderedDict()
+        # The stamp of the jarvis config files when they were loaded
+        self.conf_stamp = self._conf_stamp()
+        # The mtime of each pkg module when it was imported
+        self.module_mtimes = {}
+        self.sock = None
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _conf_stamp(self):
+        jarvis = self.jarvis
+        return [self._file_stamp(jarvis.jarvis_conf_path),
+                self._file_stamp(jarvis.jarvis_repos_path),
+                self._file_stamp(jarvis.resource_graph_path)]
+
+    def _drop_stale_modules(self):
+        """
+        Forget pkg modules whose source changed since they were imported,
+        so the next command imports the new code.
+
+        :return: True if any module was dropped
+        """
+        repo_dirs = tuple(repo['path'] for repo in self.jarvis.repos)
+        dropped = False
+        for name, mod in list(sys.modules.items()):
+            path = getattr(mod, '__file__', None)
+            if path is None or not path.startswith(repo_dirs):
+                continue
+            mtime = self._file_stamp(path)
+            if self.module_mtimes.setdefault(name, mtime) != mtime:
+                del sys.modules[name]
+                del self.module_mtimes[name]
+                dropped = True
+        return dropped
+
+    def refresh(self):
+        """
+        Reload whatever changed on disk and load the current pipeline
+
+        :return: None
+        """
+        from jarvis_cd.basic.pkg import Pipeline
+        jarvis = self.jarvis
+        conf_stamp = self._conf_stamp()
+        if conf_stamp != self.conf_stamp:
+            jarvis.load()
+            self.pipelines.clear()
+            self.conf_stamp = conf_stamp
+        if self._drop_stale_modules():
+            self.pipelines.clear()
+        if jarvis.jarvis_conf is None:
+            return
+        jarvis.resource_graph
+        jarvis.pkg_index
+        pipeline_id = jarvis.cur_pipeline
+        if pipeline_id is None:
+            return
+        store = jarvis.open_state_store(pipeline_id)
+        if not store.exists(pipeline_id):
+            self.pipelines.pop(pipeline_id, None)
+            return
+        pipeline = self.pipelines.get(pipeline_id)
+        if pipeline is None or pipeline.get_store() is not store:
+            pipeline = Pipeline().load(pipeline_id)
+            # Import the code of every pkg in the pipeline
+            pipeline.sub_pkgs
+        self.pipelines[pipeline_id] = pipeline
+        self.pipelines.move_to_end(pipeline_id)
+        while len(self.pipelines) > self.max_pipelines:
+            self.pipelines.popitem(last=False)
+
+    def serve(self):
+        """
+        Accept commands until the daemon is stopped
+
+        :return: None
+        """
+        os.makedirs(LOCAL_CONFIG_DIR, exist_ok=True)
+        if os.path.exists(DAEMON_SOCK_PATH):
+            os.remove(DAEMON_SOCK_PATH)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(DAEMON_SOCK_PATH)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen()
+        self.sock.settimeout(1)
+        with open(DAEMON_PID_PATH, 'w', encoding='utf-8') as fp:
+            fp.write(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+        try:
+            self._refresh_quietly()
+            while True:
+                self._reap()
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    self._refresh_quietly()
+                    self._handle(conn)
+        finally:
+            self.sock.close()
+            for path in [DAEMON_SOCK_PATH, DAEMON_PID_PATH]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _on_sigterm(self, signum, frame):
+        sys.exit(0)
+
+    def _refresh_quietly(self):
+        # A broken pipeline must not take the daemon down
+        try:
+            self.refresh()
+        except Exception:
+            traceback.print_exc()
+
+    @staticmethod
+    def _reap():
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+    def _handle(self, conn):
+        """
+        Receive a command and run it in a forked child
+
+        :param conn: The connection to the client
+        :return: None
+        """
+        conn.settimeout(None)
+        if hasattr(socket, 'SO_PEERCRED'):
+            creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                    struct.calcsize('3i'))
+            _, uid, _ = struct.unpack('3i', creds)
+            if uid != os.getuid():
+                return
+        header, fds, _, _ = socket.recv_fds(conn, HEADER.size,
+                                            len(STDIO_FDS))
+        if len(header) != HEADER.size or len(fds) != len(STDIO_FDS):
+            for fd in fds:
+                os.close(fd)
+            return
+        size, = HEADER.unpack(header)
+        payload = b''
+        while len(payload) < size:
+            chunk = conn.recv(size - len(payload))
+            if not chunk:
+                break
+            payload += chunk
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = self._run(conn, fds, json.loads(payload))
+            finally:
+                os._exit(exit_code)
+        for fd in fds:
+            os.close(fd)
+
+    def _run(self, conn, fds, request):
+        """
+        Run a command in the forked child
+
+        :return: The exit code of the command
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.sock.close()
+        for fd, stdio_fd in zip(fds, STDIO_FDS):
+            os.dup2(fd, stdio_fd)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = ['jarvis'] + request['argv']
+        conn.sendall((json.dumps({'pid': os.getpid()}) + '\n').encode())
+        try:
+            self.args_cls(request['argv']).process_args()
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except KeyboardInterrupt:
+            exit_code = 130
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        reply = json.dumps({'exit_code': exit_code}) + '\n'
+        try:
+            conn.sendall(reply.encode())
+        except OSError:
+            pass
+        return exit_code
@@ -0,0 +1,284 @@
+"""
+This module expands the grid of a pipeline iterator into a design matrix
+before the sweep starts: one row per point, one column per loop group,
+holding the position of the point in the values of the group. Points
+which break a constraint of the iterator, and points with the same
+parameters as an earlier point, are pruned. NumPy is used when it is
+installed; otherwise, the matrix is a list of tuples. NumPy is only
+imported once a design is expanded, so the jarvis CLI starts quickly.
+
+Constraints are Python expressions over pkg.var names, e.g.:
+
+constraints:
+  - ior.nprocs <= ior.ppn * len(hostfile)
+  - (hermes_run.dworkers + hermes_run.oworkers) <= cores
+
+Vars which are not swept have the value in the pkg's config. With NumPy,
+each constraint is evaluated once over every point; use & and | rather
+than and and or, so the expression works on arrays.
+"""
+
+from types import SimpleNamespace
+import builtins
+import functools
+import math
+
+
+@functools.lru_cache(maxsize=None)
+def get_numpy():
+    """
+    Import NumPy
+
+    :return: The numpy module, or None if it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class DesignMatrix:
+    """
+    The points of a sweep, in the order they run
+    """
+
+    def __init__(self, groups, constraints=None, fixed=None, env=None):
+        """
+        Initialize the design
+
+        :param groups: The vars of each loop group, as a list of
+        (pkg.var, values) tuples
+        :param constraints: Expressions which every point must satisfy
+        :param fixed: The config of each pkg, by pkg id
+        :param env: Other names the constraints may use (e.g., hostfile)
+        """
+        self.groups = groups
+        self.dims = [len(group[0][1]) if len(group) else 1
+                     for group in groups]
+        self.constraints = [(expr, compile(str(expr), str(expr), 'eval'))
+                            for expr in constraints or []]
+        self.fixed = fixed or {}
+        self.env = env or {}
+        self.rows = []
+        self.total = 0
+        self.num_duplicates = 0
+        self.num_invalid = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return tuple(int(pos) for pos in self.rows[i])
+
+    def expand(self, order=None, gray=False):
+        """
+        Generate every point of the grid, then prune the duplicate and
+        invalid ones
+
+        :param order: The loop groups, slowest-changing first. Defaults
+        to the order of groups.
+        :param gray: Whether to run the grid as a reflected Gray code, so
+        exactly one group changes between consecutive points
+        :return: self
+        """
+        if order is None:
+            order = list(range(len(self.groups)))
+        np = get_numpy()
+        self.total = math.prod(self.dims)
+        if self.total == 0:
+            self.rows = []
+        elif np is not None:
+            self.rows = self._expand_np(order, gray)
+        else:
+            self.rows = self._expand_py(order, gray)
+        count = len(self.rows)
+        self.rows = self.dedup(self.rows)
+        self.num_duplicates = count - len(self.rows)
+        count = len(self.rows)
+        self.rows = self.prune(self.rows)
+        self.num_invalid = count - len(self.rows)
+        return self
+
+    def _expand_np(self, order, gray):
+        np = get_numpy()
+        steps = np.arange(self.total)
+        columns = [None] * len(self.dims)
+        block = self.total
+        for i in order:
+            dim = self.dims[i]
+            block //= dim
+            quotient = steps // block
+            pos = quotient % dim
+            if gray:
+                pos = np.where((quotient // dim) % 2 == 0, pos, dim - 1 - pos)
+            columns[i] = pos
+        if len(columns) == 0:
+            return np.zeros((self.total, 0), dtype=int)
+        return np.stack(columns, axis=1)
+
+    def _expand_py(self, order, gray):
+        rows = []
+        for step in range(self.total):
+            row = [0] * len(self.dims)
+            block = self.total
+            for i in order:
+                dim = self.dims[i]
+                block //= dim
+                quotient = step // block
+                pos = quotient % dim
+                if gray and (quotient // dim) % 2:
+                    pos = dim - 1 - pos
+                row[i] = pos
+            rows.append(tuple(row))
+        return rows
+
+    def dedup(self, rows):
+        """
+        Remove the points with the same parameters as an earlier point,
+        which happens when a loop group lists the same values twice
+
+        :param rows: The points
+        :return: The points, without duplicates
+        """
+        # The first position of each group with the same values
+        canon = []
+        for group, dim in zip(self.groups, self.dims):
+            first = {}
+            canon.append([first.setdefault(
+                repr([values[pos] for name, values in group]), pos)
+                for pos in range(dim)])
+        if all(canon_dim == list(range(len(canon_dim)))
+               for canon_dim in canon):
+            return rows
+        np = get_numpy()
+        if np is not None:
+            mapped = np.stack([np.asarray(canon_dim)[rows[:, i]]
+                               for i, canon_dim in enumerate(canon)], axis=1)
+            _, first = np.unique(mapped, axis=0, return_index=True)
+            return rows[np.sort(first)]
+        seen = set()
+        unique = []
+        for row in rows:
+            key = tuple(canon[i][pos] for i, pos in enumerate(row))
+            if key not in seen:
+                seen.add(key)
+                unique.append(row)
+        return unique
+
+    def namespace(self, rows=None, point=None):
+        """
+        The names the constraints may use: each pkg, with its vars as
+        attributes, and env. Swept vars are arrays over rows, or the
+        value at a single point.
+
+        :param rows: The points (a NumPy array)
+        :param point: A single point
+        :return: dict
+        """
+        pkgs = {pkg_id: dict(config) for pkg_id, config in self.fixed.items()}
+        for i, group in enumerate(self.groups):
+            for name, values in group:
+                pkg_id, var_name = name.split('.')
+                if point is not None:
+                    value = values[point[i]]
+                else:
+                    value = as_array(values)[rows[:, i]]
+                pkgs.setdefault(pkg_id, {})[var_name] = value
+        namespace = dict(self.env)
+        for pkg_id, config in pkgs.items():
+            if pkg_id in self.env:
+                # e.g., hostfile.nnodes, where len(hostfile) still works
+                namespace[pkg_id] = Overlay(self.env[pkg_id], config)
+            else:
+                namespace[pkg_id] = SimpleNamespace(**config)
+        return namespace
+
+    def prune(self, rows):
+        """
+        Remove the points which break a constraint
+
+        :param rows: The points
+        :return: The valid points
+        """
+        if len(self.constraints) == 0 or len(rows) == 0:
+            return rows
+        np = get_numpy()
+        if np is not None:
+            try:
+                namespace = self.namespace(rows=rows)
+                mask = np.ones(len(rows), dtype=bool)
+                for expr, code in self.constraints:
+                    valid = eval(code, {'__builtins__': builtins}, namespace)
+                    mask &= np.broadcast_to(np.asarray(valid, dtype=bool),
+                                            mask.shape)
+                return rows[mask]
+            except Exception:
+                # Not every expression works on arrays (e.g., and, or,
+                # min); evaluate them one point at a time instead.
+                pass
+        valid = [i for i, row in enumerate(rows)
+                 if self.is_valid(tuple(int(pos) for pos in row))]
+        if np is not None:
+            return rows[np.asarray(valid, dtype=int)]
+        return [rows[i] for i in valid]
+
+    def is_valid(self, point):
+        """
+        Whether a point satisfies every constraint
+
+        :param point: The position of each loop group
+        :return: bool
+        """
+        namespace = self.namespace(point=point)
+        for expr, code in self.constraints:
+            try:
+                if not eval(code, {'__builtins__': builtins}, namespace):
+                    return False
+            except Exception as e:
+                raise Exception(f'The constraint {expr} failed: {e}')
+        return True
+
+    def summary(self):
+        """
+        Describe how many points the sweep has
+
+        :return: str
+        """
+        return (f'{len(self)} of {self.total} points '
+                f'({self.num_invalid} pruned by constraints, '
+                f'{self.num_duplicates} duplicates)')
+
+
+class Overlay:
+    """
+    An object with some attributes replaced by swept vars
+    """
+
+    def __init__(self, base, attrs):
+        self._base = base
+        self.__dict__.update(attrs)
+
+    def __getattr__(self, name):
+        return getattr(self._base, name)
+
+    def __len__(self):
+        return len(self._base)
+
+
+def as_array(values):
+    """
+    Convert the values of a var to a NumPy array. Values which are not
+    all numbers are kept as Python objects.
+
+    :param values: List of values
+    :return: np.ndarray
+    """
+    np = get_numpy()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+           for value in values):
+        return np.asarray(values)
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
@@ -0,0 +1,117 @@
+"""
+This module stores environment snapshots. A snapshot is stored once in
+ENV_DIR/snapshots, named by the hash of its contents, and shared by every
+pipeline and named environment built from it. A pipeline stores a small
+reference to its snapshot instead of a copy of the environment:
+
+{'snapshot': <hash>, 'set': {<vars changed since>}, 'unset': [<vars removed>]}
+"""
+
+import hashlib
+import json
+import os
+
+
+class EnvStore:
+    """
+    Content-addressed environment snapshots
+    """
+    # Parsed snapshots (hash -> env), shared by every pipeline in this
+    # process. Never modified after they are read.
+    snapshots = {}
+
+    def __init__(self, env_dir):
+        """
+        Initialize the store
+
+        :param env_dir: The jarvis ENV_DIR
+        """
+        self.env_dir = env_dir
+        self.snapshot_dir = os.path.join(env_dir, 'snapshots')
+
+    def snapshot_path(self, digest):
+        return os.path.join(self.snapshot_dir, f'{digest}.json')
+
+    @staticmethod
+    def is_ref(env):
+        """
+        Whether a stored env is a reference to a snapshot, rather than
+        a complete environment (the format used before snapshots).
+
+        :param env: A stored env
+        :return: bool
+        """
+        return (isinstance(env, dict) and
+                set(env.keys()) == {'snapshot', 'set', 'unset'} and
+                isinstance(env['set'], dict) and
+                isinstance(env['unset'], list))
+
+    def put(self, env):
+        """
+        Store a snapshot of an environment, unless it is already stored
+
+        :param env: The environment dict
+        :return: The hash of the snapshot
+        """
+        blob = json.dumps(env, sort_keys=True, separators=(',', ':'))
+        digest = hashlib.sha1(blob.encode('utf-8')).hexdigest()
+        path = self.snapshot_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                fp.write(blob)
+            os.replace(tmp_path, path)
+        if digest not in EnvStore.snapshots:
+            EnvStore.snapshots[digest] = dict(env)
+        return digest
+
+    def get(self, digest):
+        """
+        Get a snapshot. Each snapshot is parsed once per process.
+        The result must not be modified.
+
+        :param digest: The hash of the snapshot
+        :return: The environment dict
+        """
+        if digest not in EnvStore.snapshots:
+            path = self.snapshot_path(digest)
+            if not os.path.exists(path):
+                raise Exception(f'Environment snapshot {digest} was not '
+                                f'found in {self.snapshot_dir}')
+            with open(path, 'r', encoding='utf-8') as fp:
+                EnvStore.snapshots[digest] = json.load(fp)
+        return EnvStore.snapshots[digest]
+
+    def compose(self, env_ref):
+        """
+        Build an environment from a stored env. A complete environment
+        (the older format) is stored as a new snapshot.
+
+        :param env_ref: A reference from delta(), or a complete env
+        :return: A tuple of (the environment dict, the snapshot hash)
+        """
+        if env_ref is None:
+            return {}, None
+        if not self.is_ref(env_ref):
+            return dict(env_ref), self.put(env_ref)
+        digest = env_ref['snapshot']
+        env = dict(self.get(digest)) if digest is not None else {}
+        env.update(env_ref['set'])
+        for key in env_ref['unset']:
+            env.pop(key, None)
+        return env, digest
+
+    def delta(self, env, digest):
+        """
+        Describe an environment relative to a snapshot
+
+        :param env: The environment dict
+        :param digest: The hash of the snapshot, or None
+        :return: A reference which compose() turns back into env
+        """
+        base = self.get(digest) if digest is not None else {}
+        changed = {key: val for key, val in env.items()
+                   if key not in base or base[key] != val}
+        unset = sorted(key for key in base if key not in env)
+        return {'snapshot': digest, 'set': changed, 'unset': unset}
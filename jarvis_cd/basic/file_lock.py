@@ -0,0 +1,75 @@
+"""
+This module contains the file locks and atomic writes used to share
+jarvis state between concurrent jarvis processes.
+"""
+
+import fcntl
+import os
+import time
+
+# How long to wait for a lock before giving up (seconds)
+LOCK_TIMEOUT = float(os.getenv('JARVIS_LOCK_TIMEOUT', 60))
+
+
+class FileLock:
+    """
+    An advisory reader/writer lock (flock) held while in a with block.
+    Many readers (shared=True) may hold the lock at once; a writer holds
+    it alone. Locks are not re-entrant.
+    """
+
+    def __init__(self, path, shared=False, timeout=None):
+        """
+        Initialize the lock
+
+        :param path: The path of the lock file. Created if needed.
+        :param shared: Whether this is a reader (shared) lock
+        :param timeout: Seconds to wait for the lock (default LOCK_TIMEOUT)
+        """
+        self.path = path
+        self.shared = shared
+        self.timeout = LOCK_TIMEOUT if timeout is None else timeout
+        self.fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        deadline = time.monotonic() + self.timeout
+        delay = .001
+        while True:
+            try:
+                fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+                return self
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    os.close(self.fd)
+                    self.fd = None
+                    raise Exception(f'Timed out after {self.timeout}s '
+                                    f'waiting for the lock {self.path}')
+                time.sleep(delay)
+                delay = min(delay * 2, .1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+
+def save_if_changed(path, save):
+    """
+    Atomically replace a file, unless its contents would not change
+
+    :param path: The path of the file
+    :param save: A function which writes the new contents to a given path
+    :return: True if the file was written
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    save(tmp_path)
+    if os.path.exists(path):
+        with open(path, 'rb') as old_fp, open(tmp_path, 'rb') as new_fp:
+            if old_fp.read() == new_fp.read():
+                os.remove(tmp_path)
+                return False
+    os.replace(tmp_path, path)
+    return True
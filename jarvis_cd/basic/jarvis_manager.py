@@ -11,12 +11,17 @@ from jarvis_util.util.import_mod import load_class
 from jarvis_util.util.naming import to_camel_case
 from jarvis_util.util.expand_env import expand_env
 from jarvis_util.util.hostfile import Hostfile
-from jarvis_util.introspect.system_info import ResourceGraph
 from jarvis_util.shell.filesystem import Mkdir
 from jarvis_util.shell.pssh_exec import PsshExecInfo
 from jarvis_util.shell.local_exec import LocalExecInfo
+from jarvis_cd.basic.pkg_index import PkgIndex
+from jarvis_cd.basic.env_store import EnvStore
+from jarvis_cd.basic.file_lock import FileLock, save_if_changed
+from jarvis_cd.basic.state_store import open_state_store
 from pathlib import Path
 import getpass
+import hashlib
+import copy
 import yaml
 import shutil
 
@@ -49,6 +54,8 @@ class JarvisManager:
         self.shared_dir = None
         # The current pipeline (per-user)
         self.cur_pipeline = None
+        # How pipeline state is stored in CONFIG_DIR (snapshot or yaml)
+        self.state_backend = 'snapshot'
         # Path to local jarvis configuration directory
         self.local_config_dir = os.path.join(Path.home(), '.jarvis')
         # Path to local jarvis builtin package directory
@@ -61,15 +68,104 @@ class JarvisManager:
                                               'repos.yaml')
         # The Jarvis configuration (per-user)
         self.jarvis_conf = None
+        # The jarvis config and repos as last read or written
+        self._saved_conf = None
+        self._saved_repos = None
+        # Locks jarvis_config.yaml and repos.yaml
+        self.jarvis_conf_lock_path = os.path.join(self.local_config_dir,
+                                                  'jarvis_config.lock')
         #  The path to the jarvis resource graph (global across users)
         self.resource_graph_path = os.path.join(self.local_config_dir, 
                                                 'resource_graph.yaml')
         # The Jarvis resource graph (global across users)
-        self.resource_graph = None
-        self.hostfile = None
+        self._resource_graph = None
+        # Locks resource_graph.yaml
+        self.resource_graph_lock_path = os.path.join(self.local_config_dir,
+                                                     'resource_graph.lock')
+        # The hostfile of the current job (per-user)
+        self._hostfile = None
+        # Path to the stamps of remote state that was already verified
+        self.verified_state_path = os.path.join(self.local_config_dir,
+                                                'verified_state.yaml')
+        # The index of pkg classes in each repo
+        self.pkg_index_path = os.path.join(self.local_config_dir,
+                                           'pkg_index.yaml')
+        self._pkg_index = None
+        # The environment snapshots in env_dir
+        self._env_store = None
         self.repos = []
+        # The open state stores of a batch of commands (see begin_batch)
+        self.batch_stores = None
+        # State stores kept across commands by the jarvis daemon.
+        # None unless enable_state_cache() was called.
+        self.state_cache = None
         self.load()
 
+    @property
+    def resource_graph(self):
+        """
+        The resource graph is parsed the first time it is needed.
+
+        :return: ResourceGraph
+        """
+        if self._resource_graph is None and self.jarvis_conf is not None:
+            from jarvis_util.introspect.system_info import ResourceGraph
+            if os.path.exists(self.resource_graph_path):
+                with FileLock(self.resource_graph_lock_path, shared=True):
+                    self._resource_graph = ResourceGraph().load(
+                        self.resource_graph_path)
+            else:
+                self._resource_graph = ResourceGraph()
+        return self._resource_graph
+
+    @resource_graph.setter
+    def resource_graph(self, resource_graph):
+        self._resource_graph = resource_graph
+
+    @property
+    def hostfile(self):
+        """
+        The hostfile is opened the first time it is needed.
+
+        :return: Hostfile
+        """
+        if self._hostfile is None and self.jarvis_conf is not None:
+            try:
+                self._hostfile = Hostfile(
+                    hostfile=self.jarvis_conf['HOSTFILE'])
+            except Exception as e:
+                print(f'Failed to open hostfile '
+                      f'{self.jarvis_conf["HOSTFILE"]}')
+                self._hostfile = Hostfile()
+        return self._hostfile
+
+    @hostfile.setter
+    def hostfile(self, hostfile):
+        self._hostfile = hostfile
+
+    @property
+    def pkg_index(self):
+        """
+        The index of pkg classes is read the first time it is needed.
+
+        :return: PkgIndex
+        """
+        if self._pkg_index is None:
+            self._pkg_index = PkgIndex(self.pkg_index_path)
+        return self._pkg_index
+
+    @property
+    def env_store(self):
+        """
+        The store of environment snapshots in env_dir
+
+        :return: EnvStore
+        """
+        if self._env_store is None or \
+                self._env_store.env_dir != self.env_dir:
+            self._env_store = EnvStore(self.env_dir)
+        return self._env_store
+
     def create(self, config_dir, private_dir, shared_dir=None):
         """
         Create a new root jarvis config under config/$USER/jarvis_config.yaml
@@ -91,14 +187,16 @@ class JarvisManager:
             'PRIVATE_DIR': private_dir,
             'SHARED_DIR': shared_dir,
             'REPOS': [],
+            'STATE_BACKEND': 'snapshot',
 
             # Per-user parameters
             'HOSTFILE': None,
             'CUR_PIPELINE': None,
         }
         self.load_repos()
-        self.resource_graph = ResourceGraph()
-        self.hostfile = Hostfile()
+        from jarvis_util.introspect.system_info import ResourceGraph
+        self._resource_graph = ResourceGraph()
+        self._hostfile = Hostfile()
         os.makedirs(self.local_config_dir, exist_ok=True)
         self.save()
 
@@ -116,61 +214,221 @@ class JarvisManager:
 
     def load(self):
         """
-        Load the jarvis config from config/jarvis_config.yaml
+        Load the jarvis config from config/jarvis_config.yaml.
+        The resource graph, hostfile, and remote private directory
+        are not touched here. They are set up the first time a command
+        needs them.
 
         :return: None
         """
+        self._resource_graph = None
+        self._hostfile = None
+        if self.state_cache is not None:
+            self.state_cache = {}
         if not os.path.exists(self.jarvis_conf_path):
             print('No configuration was found. Run jarvis init or bootstrap. '
                   'If you are currently running those commands, please ignore this message.')
             return
         self.jarvis_conf = {}
-        # Read global jarvis conf
-        self.jarvis_conf.update(YamlFile(self.jarvis_conf_path).load())
-        # Read repos files
-        self.load_repos()
+        with FileLock(self.jarvis_conf_lock_path, shared=True):
+            # Read global jarvis conf
+            self.jarvis_conf.update(YamlFile(self.jarvis_conf_path).load())
+            # Read repos files
+            self.load_repos()
+        self._saved_conf = copy.deepcopy(self.jarvis_conf)
+        self._saved_repos = copy.deepcopy(self.repos)
         # Get the various jarvis paths
         self.config_dir = expand_env(self.jarvis_conf['CONFIG_DIR'])
         self.env_dir = os.path.join(self.config_dir, 'env')
         os.makedirs(f'{self.config_dir}', exist_ok=True)
         os.makedirs(f'{self.env_dir}', exist_ok=True)
         self.private_dir = expand_env(self.jarvis_conf['PRIVATE_DIR'])
-        Mkdir(self.private_dir,
-              PsshExecInfo(hostfile=self.hostfile))
         if self.jarvis_conf['SHARED_DIR'] is not None:
             self.shared_dir = expand_env(self.jarvis_conf['SHARED_DIR'])
             os.makedirs(f'{self.shared_dir}', exist_ok=True)
-        # Read global resource graph
-        if os.path.exists(self.resource_graph_path):
-            self.resource_graph = ResourceGraph().load(self.resource_graph_path)
-        else:
-            self.resource_graph = ResourceGraph()
         self.cur_pipeline = self.jarvis_conf['CUR_PIPELINE']
-        try:
-            self.hostfile = Hostfile(hostfile=self.jarvis_conf['HOSTFILE'])
-        except Exception as e:
-            print(f'Failed to open hostfile {self.jarvis_conf["HOSTFILE"]}')
-            self.hostfile = Hostfile()
+        self.state_backend = self.jarvis_conf.get('STATE_BACKEND',
+                                                  'snapshot')
         return self
 
+    def open_state_store(self, pipeline_id):
+        """
+        Open the store holding the state of a pipeline
+
+        :param pipeline_id: The id of the pipeline
+        :return: StateStore
+        """
+        if self.batch_stores is None:
+            return self._open_cached_state_store(pipeline_id)
+        if pipeline_id not in self.batch_stores:
+            self.batch_stores[pipeline_id] = open_state_store(
+                self.state_backend, self.config_dir, pipeline_id).hold()
+        return self.batch_stores[pipeline_id]
+
+    def _open_cached_state_store(self, pipeline_id):
+        if self.state_cache is None:
+            return open_state_store(self.state_backend, self.config_dir,
+                                    pipeline_id)
+        store = self.state_cache.get(pipeline_id)
+        if store is not None and store.loaded and not store.dirty \
+                and not store.removed and not store.env_dirty:
+            stamp = store.file_stamp()
+            if stamp is not None and stamp == store.stamp:
+                return store
+        store = open_state_store(self.state_backend, self.config_dir,
+                                 pipeline_id)
+        self.state_cache[pipeline_id] = store
+        return store
+
+    def enable_state_cache(self):
+        """
+        Keep the state of each pipeline in memory after it is loaded.
+        A cached store is reused until the pipeline changes on disk.
+        Used by long-running processes, such as the jarvis daemon.
+
+        :return: None
+        """
+        if self.state_cache is None:
+            self.state_cache = {}
+
+    def begin_batch(self):
+        """
+        Run the following commands as one batch. Pipeline state is loaded
+        once per pipeline and kept in memory. Nothing is written to
+        CONFIG_DIR or the jarvis config until commit_batch().
+
+        :return: None
+        """
+        if self.batch_stores is not None:
+            raise Exception('A batch is already in progress')
+        self.batch_stores = {}
+
+    def commit_batch(self):
+        """
+        Write the pipelines and the jarvis config changed by the batch
+
+        :return: None
+        """
+        stores = self.batch_stores
+        self.batch_stores = None
+        for store in stores.values():
+            store.release()
+        self.save()
+
+    def abort_batch(self):
+        """
+        Discard the changes made by the batch. Effects outside of jarvis
+        state (e.g., deleted directories or started services) remain.
+
+        :return: None
+        """
+        self.batch_stores = None
+        self.load()
+
+    def _private_dir_stamp(self):
+        """
+        A hash identifying the private directory and the hosts it
+        must exist on.
+
+        :return: str
+        """
+        text = '\n'.join([self.private_dir] + list(self.hostfile.hosts))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _load_verified_state(self):
+        if os.path.exists(self.verified_state_path):
+            state = YamlFile(self.verified_state_path).load()
+            if state is not None:
+                return state
+        return {}
+
+    def setup_private_dir(self):
+        """
+        Create the private directory on every host in the hostfile.
+        This is done once per hostfile. The verified-state stamp records
+        the hostfile contents the directory was last created for.
+
+        :return: None
+        """
+        if self.private_dir is None:
+            return
+        stamp = self._private_dir_stamp()
+        state = self._load_verified_state()
+        if state.get('PRIVATE_DIR') == stamp:
+            return
+        Mkdir(self.private_dir,
+              PsshExecInfo(hostfile=self.hostfile))
+        state['PRIVATE_DIR'] = stamp
+        os.makedirs(self.local_config_dir, exist_ok=True)
+        YamlFile(self.verified_state_path).save(state)
+
+    def clear_verified_state(self):
+        """
+        Forget all verified remote state, e.g., after the private
+        directory was removed.
+
+        :return: None
+        """
+        if os.path.exists(self.verified_state_path):
+            os.remove(self.verified_state_path)
+
     def save(self):
         """
-        Save the jarvis config to config/jarvis_config.yaml
+        Save the jarvis config to config/jarvis_config.yaml.
+        Only files whose contents changed are written. Changes other
+        jarvis processes made to other keys of the config are kept.
+        Deferred while a batch is in progress.
 
         :return: None
         """
+        if self.batch_stores is not None:
+            return
         # Update jarvis conf
         if self.jarvis_conf:
             self.jarvis_conf['CUR_PIPELINE'] = self.cur_pipeline
-            self.jarvis_conf['HOSTFILE'] = self.hostfile.path
-        # Update repos
-        YamlFile(self.jarvis_repos_path).save({'REPOS': self.repos})
-        # Save global resource graph
-        if self.resource_graph:
-            self.resource_graph.save(self.resource_graph_path)
-        # Save global and per-user conf
-        if self.jarvis_conf:
-            YamlFile(self.jarvis_conf_path).save(self.jarvis_conf)
+            if self._hostfile is not None:
+                self.jarvis_conf['HOSTFILE'] = self._hostfile.path
+        with FileLock(self.jarvis_conf_lock_path):
+            # Update repos
+            if self.repos != self._saved_repos:
+                save_if_changed(self.jarvis_repos_path,
+                                lambda path: YamlFile(path).save(
+                                    {'REPOS': self.repos}))
+                self._saved_repos = copy.deepcopy(self.repos)
+            # Save global and per-user conf
+            if self.jarvis_conf and self.jarvis_conf != self._saved_conf:
+                self._merge_conf()
+                save_if_changed(self.jarvis_conf_path,
+                                lambda path: YamlFile(path).save(
+                                    self.jarvis_conf))
+                self._saved_conf = copy.deepcopy(self.jarvis_conf)
+        # Save global resource graph (only if it was ever loaded)
+        if self._resource_graph:
+            with FileLock(self.resource_graph_lock_path):
+                save_if_changed(self.resource_graph_path,
+                                self._resource_graph.save)
+
+    def _merge_conf(self):
+        """
+        Apply the keys of the jarvis config changed by this process to the
+        config on disk, which another process may have changed since it
+        was loaded. Must hold the jarvis config lock.
+
+        :return: None
+        """
+        saved = self._saved_conf
+        conf = {}
+        if saved is not None and os.path.exists(self.jarvis_conf_path):
+            conf = YamlFile(self.jarvis_conf_path).load() or {}
+        else:
+            saved = {}
+        for key, val in self.jarvis_conf.items():
+            if key not in saved or saved[key] != val:
+                conf[key] = val
+        for key in saved:
+            if key not in self.jarvis_conf:
+                conf.pop(key, None)
+        self.jarvis_conf = conf
 
     def set_hostfile(self, path):
         """
@@ -208,6 +466,7 @@ class JarvisManager:
 
         rg_path = f'{self.builtin_dir}/resource_graph/{machine}.yaml'
         if os.path.exists(rg_path):
+            from jarvis_util.introspect.system_info import ResourceGraph
             self.resource_graph = ResourceGraph().load(rg_path)
             new_rg_path = f'{self.local_config_dir}/resource_graph.yaml'
             self.resource_graph.save(new_rg_path)
@@ -231,6 +490,7 @@ class JarvisManager:
         Rm(self.shared_dir, LocalExecInfo())
         Rm(self.private_dir, PsshExecInfo(
             hostfile=self.hostfile))
+        self.clear_verified_state()
 
     def print_config(self):
         print(yaml.dump(self.jarvis_conf))
@@ -255,6 +515,7 @@ class JarvisManager:
 
         :return: None
         """
+        from jarvis_util.introspect.system_info import ResourceGraph
         self.resource_graph = ResourceGraph()
         self.resource_graph.build(
             PsshExecInfo(hostfile=self.hostfile), net_sleep=net_sleep)
@@ -268,13 +529,15 @@ class JarvisManager:
 
     def list_pipelines(self):
         """
-        Get a list of all created pipelines
+        Get a list of all created pipelines. Hidden directories (e.g.,
+        the pipeline locks in .locks) and env are not pipelines.
 
         :return: List of pipelines
         """
-        pipelines = os.listdir(self.config_dir)
+        pipelines = [name for name in os.listdir(self.config_dir)
+                     if not name.startswith('.') and name != 'env' and
+                     os.path.isdir(os.path.join(self.config_dir, name))]
         pipelines.sort()
-        pipelines.remove('env')
         return pipelines
 
     def cd(self, pipeline_id):
@@ -404,20 +667,25 @@ class JarvisManager:
         if not os.path.exists(repo['path']):
             print(f'Repo {repo["path"]} does not exist')
             return
-        pkg_types = os.listdir(os.path.join(repo['path'], repo['name']))
-        pkg_types.sort()
+        pkg_types = self.pkg_index.list_pkgs(repo)
         print(f'{repo["name"]}: {repo["path"]}')
         for pkg_type in pkg_types:
-            if not pkg_type.startswith('_'):
-                print(f'  {pkg_type}')
+            print(f'  {pkg_type}')
 
     def construct_pkg(self, pkg_type):
         """
-        Construct a pkg by searching repos for the pkg type
+        Construct a pkg by looking up the pkg type in the pkg index.
+        Falls back to searching every repo if the index is stale.
 
         :param pkg_type: The type of pkg to load (snake case).
         :return: A object of type "pkg_type"
         """
+        entry = self.pkg_index.find(pkg_type, self.repos)
+        if entry is not None:
+            cls = load_class(entry['module'], entry['path'], entry['class'])
+            if cls is not None:
+                return cls()
+            self.pkg_index.invalidate(entry['repo'])
         for repo in self.repos:
             cls = load_class(f'{repo["name"]}.{pkg_type}.pkg',
                              repo['path'],
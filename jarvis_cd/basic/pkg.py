@@ -5,6 +5,10 @@ pkg types in Jarvis.
 
 from abc import ABC, abstractmethod
 from jarvis_cd.basic.jarvis_manager import JarvisManager
+from jarvis_cd.basic.trace import Tracer, traced
+from jarvis_cd.basic.stats_sink import StatsSink
+from jarvis_cd.basic.design import DesignMatrix
+from jarvis_cd.basic.search import get_strategy, count_changes, relative_ci
 from jarvis_util.util.logging import ColorPrinter, Color
 from jarvis_util.util.naming import to_snake_case
 from jarvis_util.serialize.yaml_file import YamlFile
@@ -14,15 +18,22 @@ from jarvis_util.util.argparse import ArgParse
 from jarvis_util.jutil_manager import JutilManager
 from jarvis_util.shell.filesystem import Mkdir, Rm
 from jarvis_util.shell.pssh_exec import PsshExecInfo
+from jarvis_util.util.hostfile import Hostfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
 from enum import Enum
 import yaml
+import csv
+import sys
 import inspect
+import itertools
+import multiprocessing
 import pathlib
+import queue
 import shutil
 import math
 import os
 import time
-import pandas as pd
 
 
 class PkgArgParse(ArgParse):
@@ -47,22 +58,85 @@ class PipelineZip:
         self.zip.append((pkg, var_name, var_vals))
 
 
+class SweepHostfile:
+    """
+    The hostfile as a sweep parameter. hostfile.nnodes runs each point
+    of a sweep on the first nnodes hosts of the jarvis hostfile.
+    """
+    pkg_id = 'hostfile'
+
+    def __init__(self, iter_out):
+        """
+        Initialize the hostfile parameter
+
+        base: the jarvis hostfile before the sweep
+        nnodes: the number of nodes of the current point
+        applied: the number of nodes of the hostfile jarvis uses now
+        """
+        self.jarvis = JarvisManager.get_instance()
+        self.iter_out = iter_out
+        self.base = None
+        self.nnodes = None
+        self.applied = None
+        self.iter_diff = 0
+
+    def apply(self):
+        """
+        Make jarvis use the hosts of the current point. The subset is
+        saved as a hostfile in the iterator output, so pkgs which pass
+        the hostfile's path to other programs keep working.
+
+        :return: Whether the hosts changed
+        """
+        if self.nnodes == self.applied:
+            return False
+        if self.base is None:
+            self.base = self.jarvis.hostfile
+        path = os.path.join(self.iter_out, f'hostfile_{self.nnodes}')
+        self.base.subset(self.nnodes).save(path)
+        self.jarvis.hostfile = Hostfile(hostfile=path)
+        self.applied = self.nnodes
+        return True
+
+    def restore(self):
+        """
+        Make jarvis use the hostfile from before the sweep
+
+        :return: None
+        """
+        if self.base is not None:
+            self.jarvis.hostfile = self.base
+            self.applied = None
+
+
 class PipelineIterator:
     """
-    Grid searching pipeline parameters
+    Searching pipeline parameters. By default, every point of the grid
+    which satisfies the constraints of the iterator is run (see
+    jarvis_cd.basic.design). The search section of the iterator selects a
+    strategy which runs fewer points (see jarvis_cd.basic.search).
     """
     def __init__(self, ppl):
         """
-        Initialize grid search
+        Initialize the search
 
         fors: A list of lists [(pkg, var_name, var_vals)]
+        strategy: the search strategy, or None for the full grid
+        values: the values of the metrics used by the search and by
+        adaptive repetitions, by config, metric, and repetition
+        warmup: the number of warm-up runs of each config
+        group_order: the loop groups, slowest-changing first, when the
+        grid is run as a Gray code (see plan_order)
+        design: the points of the sweep (see DesignMatrix)
+        row: the row of the current point in the design
+        partitions: the number of disjoint partitions of the hostfile the
+        sweep runs on concurrently (see Pipeline.run_partitions)
         """
         self.ppl = ppl
         self.norerun = set()
         if 'norerun' in ppl.config['iterator']:
             self.norerun = set(ppl.config['iterator']['norerun'])
         self.fors = []
-        self.cur_iters = []
         self.cur_pos = []
         self.cur_pos_diff = []
         self.iter_count = 0
@@ -72,11 +146,33 @@ class PipelineIterator:
         self.iter_vars = ppl.config['iterator']['vars']
         self.iter_loop = ppl.config['iterator']['loop']
         self.repeat = ppl.config['iterator']['repeat']
-        ppl.set_config_env_vars()
-        self.iter_out = os.path.expandvars(ppl.config['iterator']['output'])
+        self.keep_warm = ppl.config['iterator'].get('keep_warm', False)
+        self.search = ppl.config['iterator'].get('search') or {}
+        self.strategy = None
+        self.values = {}
+        self.adaptive = ppl.config['iterator'].get('adaptive') or {}
+        if self.adaptive and 'metric' not in self.adaptive:
+            raise Exception('Adaptive repetitions need a metric')
+        self.warmup = int(self.adaptive.get('warmup', 0))
+        self.order = ppl.config['iterator'].get('order', 'grid')
+        if self.order not in ['grid', 'cost']:
+            raise Exception(f'The iterator order must be grid or cost, '
+                            f'not {self.order}')
+        self.group_order = []
+        self.constraints = ppl.config['iterator'].get('constraints') or []
+        self.design = None
+        self.row = 0
+        self.hostfile = None
+        self.partitions = int(ppl.config['iterator'].get('partitions', 1))
+        self.port_stride = int(ppl.config['iterator'].get('port_stride', 100))
+        self.iter_out = ppl.get_iter_out()
         print(f'ITER OUT: {self.iter_out} (from: {ppl.config["iterator"]["output"]})')
         self.stats_path = f'{self.iter_out}/stats_dict.csv'
-        self.stats = []
+        self.order_path = f'{self.iter_out}/sweep_order.yaml'
+        # The stats of each run, written as soon as the run finishes
+        self.sink = StatsSink(ppl.get_runs_path())
+        # The (config, repetition) of each run recorded in the sink
+        self.done = set()
 
         Mkdir(self.iter_out)
         self.iter_vars = self.iter_vars
@@ -84,7 +180,14 @@ class PipelineIterator:
             self.add_for()
             for zip_name in zip_set:
                 pkg_name, var_name = zip_name.split('.')
-                pkg = ppl.sub_pkgs_dict[pkg_name]
+                if pkg_name == SweepHostfile.pkg_id:
+                    if var_name != 'nnodes':
+                        raise Exception(f'Only hostfile.nnodes can be swept, '
+                                        f'not {zip_name}')
+                    self.hostfile = SweepHostfile(self.iter_out)
+                    pkg = self.hostfile
+                else:
+                    pkg = ppl.get_pkg(pkg_name)
                 self.add_to_for_zip(pkg, var_name, self.iter_vars[zip_name])
 
     def add_for(self):
@@ -93,70 +196,445 @@ class PipelineIterator:
     def add_to_for_zip(self, pkg, var_name, var_vals):
         for_zip = self.fors[-1]
         for_zip.add_param_set(pkg, var_name, var_vals)
-        self.conf_dict[pkg] = {}
+        if pkg is not self.hostfile:
+            self.conf_dict[pkg] = {}
 
     def begin(self):
-        for i in range(len(self.fors)):
-            self.cur_iters.append(iter(range(self.fors[i].zip_len)))
-            self.cur_pos.append(next(self.cur_iters[i]))
+        self.cur_pos = [0] * len(self.fors)
         self.cur_pos_diff = [1] * len(self.cur_pos)
-        self.conf_dict = self.current()
         self.iter_count = 0
-        self.max_iter_count = math.prod([for_zip.zip_len for for_zip in self.fors])
+        self.design = self.get_design()
+        self.strategy = get_strategy(
+            self.search, self.design.dims, self.repeat)
+        if self.strategy is not None:
+            point = self.next_valid()
+            if point is None:
+                return None
+            self.cur_pos = list(point)
+            self.max_iter_count = self.strategy.max_points()
+        else:
+            if self.order == 'cost':
+                self.plan_order()
+            self.design.expand(self.group_order or None,
+                               gray=self.order == 'cost')
+            self.ppl.log(f'[ITER] The sweep has {self.design.summary()}',
+                         Color.BRIGHT_BLUE)
+            self.max_iter_count = len(self.design)
+            self.row = 0
+            if len(self.design) == 0:
+                return None
+            self.cur_pos = list(self.design[0])
+        self.conf_dict = self.current()
         return self.conf_dict
 
+    def get_design(self, hostfile=None):
+        """
+        Get the design of the sweep. Constraints may use the vars of any
+        pkg, the hostfile, and the number of cores of this node.
+
+        :param hostfile: The hostfile the sweep runs on (default: the
+        jarvis hostfile)
+        :return: DesignMatrix
+        """
+        if hostfile is None:
+            hostfile = self.ppl.jarvis.hostfile
+        groups = [[(f'{pkg.pkg_id}.{var_name}', var_vals)
+                   for pkg, var_name, var_vals in for_zip.zip]
+                  for for_zip in self.fors]
+        fixed = {pkg.pkg_id: pkg.config for pkg in self.ppl.sub_pkgs}
+        env = {'hostfile': hostfile, 'cores': os.cpu_count()}
+        constraints = list(self.constraints)
+        if self.hostfile is not None:
+            constraints.append('hostfile.nnodes <= len(hostfile)')
+        return DesignMatrix(groups, constraints, fixed, env)
+
+    def plan_order(self):
+        """
+        Order the loop groups so the groups which are expensive to change
+        change slowest, and run the grid as a reflected Gray code, so
+        exactly one group changes between consecutive points. The cost of
+        changing a group is the restart cost of its pkgs and of every pkg
+        which depends on them (see Pipeline.get_restart_cost). The order
+        and its estimated savings are written to order_path.
+
+        :return: None
+        """
+        costs = []
+        for for_zip in self.fors:
+            pkg_ids = {pkg.pkg_id for pkg, var_name, var_vals in for_zip.zip}
+            if SweepHostfile.pkg_id in pkg_ids:
+                # Every pkg is reconfigured when the hosts change
+                pkg_ids = {pkg.pkg_id for pkg in self.ppl.sub_pkgs}
+            costs.append(sum(self.ppl.get_restart_cost(pkg_id)
+                             for pkg_id in self.ppl.get_restarts(pkg_ids)))
+        self.group_order = sorted(range(len(self.fors)),
+                                  key=lambda i: -costs[i])
+        dims = [for_zip.zip_len for for_zip in self.fors]
+        grid_cost = sum(changes * cost for changes, cost
+                        in zip(count_changes(dims), costs))
+        gray_changes = count_changes([dims[i] for i in self.group_order],
+                                     gray=True)
+        est_cost = sum(changes * costs[i] for changes, i
+                       in zip(gray_changes, self.group_order))
+        groups = [', '.join(f'{pkg.pkg_id}.{var_name}'
+                            for pkg, var_name, var_vals in for_zip.zip)
+                  for for_zip in self.fors]
+        plan = {
+            'order': [groups[i] for i in self.group_order],
+            'restart_costs': {groups[i]: costs[i] for i in self.group_order},
+            'grid_cost': grid_cost,
+            'estimated_cost': est_cost,
+            'estimated_savings': grid_cost - est_cost,
+        }
+        with open(self.order_path, 'w', encoding='utf-8') as fp:
+            yaml.dump(plan, fp, sort_keys=False)
+        self.ppl.log(f'[ITER] Sweep order (slowest first): {plan["order"]}. '
+                     f'Estimated restart time: {est_cost:.1f}s '
+                     f'(saves {grid_cost - est_cost:.1f}s)',
+                     Color.BRIGHT_BLUE)
+
     def current(self):
-        for i in range(len(self.cur_iters)):
+        for i in range(len(self.fors)):
             for pkg, var_name, var_vals in self.fors[i].zip:
-                self.conf_dict[pkg][var_name] = var_vals[self.cur_pos[i]]
                 pkg.iter_diff = self.cur_pos_diff[i]
+                if pkg is self.hostfile:
+                    pkg.nnodes = var_vals[self.cur_pos[i]]
+                    continue
+                self.conf_dict[pkg][var_name] = var_vals[self.cur_pos[i]]
         for pkg, conf in self.conf_dict.items():
             for key, val in conf.items():
                 self.linear_conf_dict[f'{pkg.pkg_id}.{key}'] = val
+        if self.hostfile is not None:
+            self.linear_conf_dict['hostfile.nnodes'] = self.hostfile.nnodes
         return self.conf_dict
 
     def next(self):
-        self.cur_pos_diff = [0] * len(self.cur_pos)
-        for i in range(len(self.cur_iters) - 1, -1, -1):
-            try:
-                self.cur_pos[i] = next(self.cur_iters[i])
-                self.cur_pos_diff[i] = 1
-                break
-            except StopIteration:
-                if i == 0:
-                    return None
-                else:
-                    self.cur_iters[i] = iter(range(self.fors[i].zip_len))
-                    self.cur_pos[i] = next(self.cur_iters[i])
-                    self.cur_pos_diff[i] = 1
+        if self.strategy is not None:
+            self.strategy.report(tuple(self.cur_pos), self.get_score())
+            point = self.next_valid()
+        else:
+            self.row += 1
+            point = self.design[self.row] if self.row < len(self.design) \
+                else None
+        if point is None:
+            return None
+        return self.move(point)
+
+    def next_valid(self):
+        """
+        Get the next point chosen by the search strategy which satisfies
+        the constraints. Invalid points are reported without a score.
+
+        :return: A point, or None if the search is over
+        """
+        point = self.strategy.next()
+        while point is not None and not self.design.is_valid(point):
+            self.strategy.report(point, None)
+            point = self.strategy.next()
+        return point
+
+    def move(self, point):
+        """
+        Move to a point of the sweep
+
+        :param point: The position of each loop group
+        :return: The config of each pkg
+        """
+        self.cur_pos_diff = [int(old != new)
+                             for old, new in zip(self.cur_pos, point)]
+        self.cur_pos = list(point)
         conf_dict = self.current()
         self.iter_count += 1
         return conf_dict
 
+    def get_repeat(self):
+        """
+        The number of repetitions of the current config
+
+        :return: int
+        """
+        if self.strategy is not None:
+            return self.strategy.get_repeat(tuple(self.cur_pos))
+        return self.repeat
+
+    def get_repeat_range(self):
+        """
+        The minimum and maximum number of repetitions of the current
+        config, not counting warm-up runs. They only differ for adaptive
+        repetitions, where max_repeat defaults to 10.
+
+        :return: A tuple of (int, int)
+        """
+        repeat = self.get_repeat()
+        if not self.adaptive:
+            return repeat, repeat
+        min_repeat = int(self.adaptive.get('min_repeat', repeat))
+        max_repeat = int(self.adaptive.get('max_repeat', max(min_repeat, 10)))
+        return min_repeat, max_repeat
+
+    def want_rep(self, rep):
+        """
+        Whether the current config needs a repetition. Warm-up runs come
+        first. With adaptive repetitions, repetitions are added until the
+        confidence interval of the metric, relative to its mean, is at
+        most ci.
+
+        :param rep: The repetition
+        :return: bool
+        """
+        measured = rep - self.warmup
+        min_repeat, max_repeat = self.get_repeat_range()
+        if measured < min_repeat:
+            return True
+        if measured >= max_repeat:
+            return False
+        values = self.get_values(self.adaptive['metric'])
+        confidence = float(self.adaptive.get('confidence', 0.95))
+        target = float(self.adaptive.get('ci', 0.05))
+        return len(values) >= 2 and relative_ci(values, confidence) > target
+
+    def get_reps(self):
+        """
+        The repetitions of the current config which still need to run.
+        Runs recorded by earlier attempts of the sweep are skipped. Each
+        repetition is decided after the ones before it were saved.
+
+        :return: Generator of int
+        """
+        rep = 0
+        while self.want_rep(rep):
+            if not self.is_done(rep):
+                yield rep
+            rep += 1
+
+    def get_values(self, metric):
+        """
+        The values of a metric over the runs of the current config,
+        without the warm-up runs
+
+        :param metric: The metric
+        :return: List of float
+        """
+        runs = self.values.get(self.run_key(0)[0], {}).get(metric, {})
+        return [value for rep, value in sorted(runs.items())
+                if rep >= self.warmup]
+
+    def add_values(self, conf, rep, stat_dict):
+        """
+        Record the values of the metrics used by the search and by
+        adaptive repetitions reported by a run
+
+        :param conf: The JSON of the config of the run
+        :param rep: The repetition of the run
+        :param stat_dict: The stats of the run
+        :return: None
+        """
+        for metric in [self.search.get('metric'), self.adaptive.get('metric')]:
+            if metric is None or stat_dict.get(metric) is None:
+                continue
+            try:
+                value = float(stat_dict[metric])
+            except (TypeError, ValueError):
+                continue
+            runs = self.values.setdefault(conf, {}).setdefault(metric, {})
+            runs[rep] = value
+
+    def get_score(self):
+        """
+        The mean of the search metric over the runs of the current config
+
+        :return: float, or None if no run reported the metric
+        """
+        values = self.get_values(self.search.get('metric'))
+        if len(values) == 0:
+            return None
+        return sum(values) / len(values)
+
+    def get_best(self):
+        """
+        The config with the best score found by the search strategy
+
+        :return: A dict of sweep parameters, or None
+        """
+        if self.strategy is None or self.strategy.best is None:
+            return None
+        best = {}
+        for for_zip, pos in zip(self.fors, self.strategy.best):
+            for pkg, var_name, var_vals in for_zip.zip:
+                best[f'{pkg.pkg_id}.{var_name}'] = var_vals[pos]
+        return best
+
     def config_pkgs(self, conf_dict):
+        """
+        Configure the pkgs for an iteration
+
+        :param conf_dict: The config of each pkg
+        :return: The ids of the pkgs whose config changed
+        """
+        hosts_changed = self.hostfile is not None and self.hostfile.apply()
+        config_hashes = {pkg.pkg_id: pkg.config_hash for pkg in conf_dict}
         for pkg, conf in conf_dict.items():
             pkg.skip_run = False
-            if pkg.pkg_id in self.norerun and pkg.iter_diff == 0:
+            if pkg.pkg_id in self.norerun and pkg.iter_diff == 0 \
+                    and not hosts_changed:
                 pkg.skip_run = True
             pkg.set_config_env_vars()
             pkg.configure(**conf)
-            pkg.save()
+        if hosts_changed:
+            # Pkgs which cache their hosts (e.g., in a hostfile of their
+            # own) are reconfigured for the new hosts
+            for pkg in self.ppl.sub_pkgs:
+                pkg.skip_run = False
+                if pkg not in conf_dict:
+                    pkg.configure()
+        # Only the pkgs whose config changed are written
+        self.ppl.save()
+        if hosts_changed:
+            return {pkg.pkg_id for pkg in self.ppl.sub_pkgs}
+        return {pkg.pkg_id for pkg in conf_dict
+                if pkg.config_hash != config_hashes[pkg.pkg_id]}
+
+    def restore_hosts(self):
+        """
+        Make jarvis use the full hostfile again after sweeping
+        hostfile.nnodes, and reconfigure the pkgs for it
 
-    def save_run(self, conf_dict):
+        :return: None
+        """
+        if self.hostfile is None or self.hostfile.applied is None:
+            return
+        self.hostfile.restore()
+        for pkg in self.ppl.sub_pkgs:
+            pkg.configure()
+
+    def run_key(self, rep):
+        """
+        Identify a run by its config, rather than its position in the
+        sweep, so results stay valid if the sweep is reordered.
+
+        :param rep: The repetition of the current config
+        :return: A hashable key
+        """
+        return StatsSink.conf_key(self.linear_conf_dict), rep
+
+    def is_done(self, rep):
+        """
+        Whether a run of the current config was recorded by an earlier
+        attempt of the sweep
+
+        :param rep: The repetition of the current config
+        :return: bool
+        """
+        return self.run_key(rep) in self.done
+
+    def load_runs(self, resume=False):
+        """
+        Load the runs recorded by earlier attempts of the sweep. When
+        not resuming, the records are discarded.
+
+        :param resume: Whether to resume the sweep
+        :return: The number of runs loaded
+        """
+        if not resume:
+            self.sink.clear()
+            return 0
+        self.merge_partitions()
+        self.sink.repair()
+        for run in self.sink.records():
+            if 'rep' not in run:
+                continue
+            conf = StatsSink.conf_key(run['conf'])
+            self.done.add((conf, run['rep']))
+            self.add_values(conf, run['rep'], run['stats'])
+        return len(self.done)
+
+    def get_partition_out(self, k):
+        """
+        Get the iterator output directory of a partition
+
+        :param k: The index of the partition
+        :return: str
+        """
+        return os.path.join(self.iter_out, f'part{k}')
+
+    def partition_hosts(self):
+        """
+        Split the jarvis hostfile into disjoint hostfiles, one per
+        partition, saved in the iterator output. Every host is used: the
+        first partitions get one more host if they do not divide evenly.
+
+        :return: List of paths
+        """
+        hosts = list(self.ppl.jarvis.hostfile.hosts)
+        if len(hosts) < self.partitions:
+            raise Exception(f'Cannot split {len(hosts)} hosts into '
+                            f'{self.partitions} partitions')
+        size, extra = divmod(len(hosts), self.partitions)
+        paths = []
+        start = 0
+        for k in range(self.partitions):
+            end = start + size + (1 if k < extra else 0)
+            path = os.path.join(self.iter_out, f'hostfile_part{k}')
+            with open(path, 'w', encoding='utf-8') as fp:
+                fp.write('\n'.join(hosts[start:end]) + '\n')
+            paths.append(path)
+            start = end
+        return paths
+
+    def merge_partitions(self):
+        """
+        Move the runs recorded by each partition into the runs of the
+        sweep
+
+        :return: None
+        """
+        for k in range(self.partitions):
+            sink = StatsSink(os.path.join(self.get_partition_out(k),
+                                          'runs.jsonl'))
+            self.sink.merge(sink)
+
+    def save_run(self, conf_dict, rep=0):
         stat_dict = {**self.linear_conf_dict}
         # Get the package-specific stats
         for pkg in self.ppl.sub_pkgs:
-            if hasattr(pkg, '_get_stat'):
-                pkg._get_stat(stat_dict)
-        # Save the stats to the list
-        self.stats.append(stat_dict)
+            pkg.get_stat(stat_dict)
+        # Record the run durably, so the sweep can be resumed
+        self.sink.append(self.linear_conf_dict, rep, stat_dict,
+                         warmup=rep < self.warmup)
+        self.done.add(self.run_key(rep))
+        self.add_values(self.run_key(rep)[0], rep, stat_dict)
+
+    def save_point(self):
+        """
+        Record the number of repetitions of the current config and the
+        relative confidence interval of the metric they achieved. Only
+        done for adaptive repetitions.
+
+        :return: None
+        """
+        if not self.adaptive:
+            return
+        reps = 0
+        while self.is_done(self.warmup + reps):
+            reps += 1
+        values = self.get_values(self.adaptive['metric'])
+        confidence = float(self.adaptive.get('confidence', 0.95))
+        ci = relative_ci(values, confidence) if len(values) >= 2 else None
+        self.sink.append_point(self.linear_conf_dict,
+                               {'point.reps': reps, 'point.ci': ci})
 
     def analysis(self):
+        """
+        Write the stats of every run to stats_path. Pkgs which define
+        _analysis are given the stats of each run as an iterable, which
+        reads them from disk as needed.
+
+        :return: None
+        """
         for pkg in self.ppl.sub_pkgs:
             if hasattr(pkg, '_analysis'):
-                pkg._analysis(self.stats)
-        df = pd.DataFrame(self.stats)
-        df.to_csv(self.stats_path, index=False)
+                pkg._analysis(self.sink)
+        self.sink.to_csv(self.stats_path)
 
 class Pkg(ABC):
     """
@@ -178,18 +656,26 @@ class Pkg(ABC):
         config_dir: the directory where configuration data is stored
         private_dir: the directory where private data is stored
         shared_dir: the directory where shared data is stored
-        config_path: the path to the configuration file
+        config_path: the path to the configuration file (yaml backend)
         config: the configuration data
+        config_hash: the content hash of config when last loaded or saved
+        store: the state store of the pipeline (root only)
         sub_pkgs: the sub-packages of this package (ordered list)
-        sub_pkgs_dict: the sub-packages of this package (dict)
+        sub_pkgs_dict: the sub-packages of this package (dict). Entries
+        may be PkgProxy objects which are constructed on first use.
         env_path: the path to the environment file
         env: the environment data
+        env_base: the hash of the env snapshot env is stored relative to
+        env_hash: the content hash of env when last loaded or saved
         mod_env: the environment data + LD_PRELOAD
         iter_vars: the iteration variables
         iter_loop: the iteration loop
         iter_out: the iteration output
         stats_path: the path to the statistics file
         stats: the statistics list
+        tracer: records the phases of the current command (root only)
+        metrics: the metrics of the last run (name -> (value, unit))
+        open_spans: the names of the spans this pkg is in
         """
         self.jarvis = JarvisManager.get_instance()
         self.jutil = JutilManager.get_instance()
@@ -205,20 +691,136 @@ class Pkg(ABC):
         self.shared_dir = None
         self.config_path = None
         self.config = None
-        self.sub_pkgs = []
+        self.config_hash = None
+        self.store = None
+        self._sub_pkgs = []
         self.sub_pkgs_dict = {}
         self.env_path = None
         self.env = None
+        self.env_base = None
+        self.env_hash = None
         self.mod_env = None
         self.iterator = None
         self.exit_code = 0
         self.start_time = 0
         self.stop_time = 0
+        self.kill_time = 0
+        self.clean_time = 0
+        self.status_time = 0
         self.skip_run = False
+        self.warm = False
+        self.tracer = None
+        self.metrics = {}
+        self.open_spans = []
+
+    @property
+    def sub_pkgs(self):
+        """
+        The sub-pkgs of this pkg. Constructs any sub-pkg which was not
+        used yet. Sub-pkgs which cannot be found are skipped.
+
+        :return: List of pkgs
+        """
+        for sub_pkg in list(self._sub_pkgs):
+            if isinstance(sub_pkg, PkgProxy):
+                sub_pkg.materialize()
+        return self._sub_pkgs
+
+    @sub_pkgs.setter
+    def sub_pkgs(self, sub_pkgs):
+        self._sub_pkgs = sub_pkgs
 
     def log(self, msg, color=None):
         ColorPrinter.print(msg, color)
 
+    def get_tracer(self):
+        """
+        Get the tracer of the pipeline this pkg belongs to
+
+        :return: Tracer or None
+        """
+        if self.root is not None and self.root is not self:
+            return self.root.get_tracer()
+        return self.tracer
+
+    def trace(self, name, cat='phase', **args):
+        """
+        Record the time spent in a with block in the pipeline's trace
+
+        :param name: The name of the span
+        :param cat: The category of the span
+        :param args: Details shown with the span
+        :return: A context manager
+        """
+        tracer = self.get_tracer()
+        if tracer is None:
+            return nullcontext()
+        return tracer.span(name, cat, **args)
+
+    @contextmanager
+    def span(self, name, log=False, **args):
+        """
+        Time a stage of this pkg. Spans may be nested; a nested span is
+        named after the spans it is in (e.g., total.train). The time spent
+        in a span is added to the metric <name>_time, so it appears in the
+        statistics of the pipeline iterator. Spans also appear in the
+        pipeline's trace.
+
+        :param name: The name of the stage
+        :param log: Whether to print the time spent in the stage
+        :param args: Details shown with the span in the trace and log
+        :return: None
+        """
+        self.open_spans.append(name)
+        path = '.'.join(self.open_spans)
+        start = time.monotonic()
+        try:
+            with self.trace(f'{self.pkg_id} {path}', 'span', **args):
+                yield
+        finally:
+            self.open_spans.pop()
+            span_time = time.monotonic() - start
+            key = f'{path}_time'
+            total = self.metrics[key][0] if key in self.metrics else 0
+            self.metrics[key] = (total + span_time, 's')
+            if log:
+                label = ' '.join([self.pkg_id, path] +
+                                 [f'{key}={val}' for key, val in args.items()])
+                self.log(f'{label} TIME: {span_time} seconds',
+                         color=Color.GREEN)
+
+    def metric(self, name, value, unit=None):
+        """
+        Record a metric of the last run, e.g., the throughput reported by
+        a benchmark. Metrics appear in the statistics of the pipeline
+        iterator as <pkg_id>.<name>(<unit>).
+
+        :param name: The name of the metric
+        :param value: The value of the metric
+        :param unit: The unit of the metric (e.g., MB/s)
+        :return: None
+        """
+        self.metrics[name] = (value, unit)
+        tracer = self.get_tracer()
+        if tracer is not None and isinstance(value, (int, float)):
+            tracer.counter(f'{self.pkg_id}.{name}', **{name: value})
+
+    def get_stat(self, stat_dict):
+        """
+        Add the metrics of the last run to the statistics of an iteration,
+        followed by the statistics from _get_stat (if defined).
+
+        :param stat_dict: A dictionary of statistics
+        :return: None
+        """
+        for name, (value, unit) in self.metrics.items():
+            column = f'{self.pkg_id}.{name}'
+            if unit is not None:
+                column = f'{column}({unit})'
+            stat_dict[column] = value
+        if hasattr(self, '_get_stat'):
+            self._get_stat(stat_dict)
+
     def _init_common(self, global_id, root):
         """
         Update paths in this package based on the global_id
@@ -250,6 +852,18 @@ class Pkg(ABC):
             raise Exception('No pipeline currently selected')
         return global_id
 
+    def get_store(self):
+        """
+        Get the state store of the pipeline this pkg belongs to
+
+        :return: StateStore
+        """
+        if self.root is not self:
+            return self.root.get_store()
+        if self.store is None or self.store.pipeline_id != self.global_id:
+            self.store = self.jarvis.open_state_store(self.global_id)
+        return self.store
+
     def create(self, global_id):
         """
         Create a new pkg and its filesystem data
@@ -259,14 +873,14 @@ class Pkg(ABC):
         :return: self
         """
         self._init_common(global_id, self.root)
-        if os.path.exists(self.config_path):
+        if self.get_store().exists(self.global_id):
             self.load(global_id, self.root)
             return self
         self.config = {
             'sub_pkgs': []
         }
+        self.config_hash = None
         self.sub_pkgs = []
-        self.env_path = f'{self.config_dir}/env.yaml'
         if self.env is None:
             self.env = {}
         os.makedirs(self.config_dir, exist_ok=True)
@@ -287,23 +901,27 @@ class Pkg(ABC):
         :return: self
         """
         self._init_common(global_id, root)
-        if self.env_path is not None and os.path.exists(self.env_path):
-            self.env = YamlFile(self.env_path).load()
-        elif self.root is not None:
+        store = self.get_store()
+        if self.env_path is not None and store.get_env() is not None:
+            self.env, self.env_base = self.jarvis.env_store.compose(
+                store.get_env())
+            self.env_hash = store.env_hash()
+        elif self.root is not self:
             self.env = self.root.env
-        if not os.path.exists(self.config_path):
+        config = store.get_config(self.global_id)
+        if config is None:
             return self.create(global_id)
         if not with_config:
             return self
-        self.config = YamlFile(self.config_path).load()
+        self.config = config
+        self.config_hash = store.config_hash(self.global_id)
+        # Sub-pkgs are constructed and loaded on first use
+        self._sub_pkgs = []
+        self.sub_pkgs_dict = {}
         for sub_pkg_type, sub_pkg_id in self.config['sub_pkgs']:
-            sub_pkg = self.jarvis.construct_pkg(sub_pkg_type)
-            if sub_pkg is None:
-                self.log(f'Could not find pkg: {sub_pkg_type}. Skipping.', Color.RED)
-                continue
-            sub_pkg.load(f'{self.global_id}.{sub_pkg_id}', self.root)
-            self.sub_pkgs.append(sub_pkg)
-            self.sub_pkgs_dict[sub_pkg.pkg_id] = sub_pkg
+            sub_pkg = PkgProxy(self, sub_pkg_type, sub_pkg_id)
+            self._sub_pkgs.append(sub_pkg)
+            self.sub_pkgs_dict[sub_pkg_id] = sub_pkg
         self._init()
         return self
 
@@ -312,13 +930,34 @@ class Pkg(ABC):
         Save a pkg and its sub-pkgs
         :return: Self
         """
+        self._stage()
+        self.get_store().commit()
+        return self
+
+    def _stage(self):
+        """
+        Stage a pkg and its sub-pkgs in the state store. Only the config
+        and env which changed since they were loaded or last saved are
+        staged.
+
+        :return: None
+        """
+        store = self.get_store()
         self.config['pkg_type'] = self.pkg_type
-        YamlFile(self.config_path).save(self.config)
+        blob = store.dumps(self.config)
+        config_hash = store.digest(blob)
+        if config_hash != self.config_hash:
+            store.put_config(self.global_id, self.config, blob)
+            self.config_hash = config_hash
         if self.env_path is not None:
-            YamlFile(self.env_path).save(self.env)
-        for pkg in self.sub_pkgs:
-            pkg.save()
-        return self
+            env_ref = self.jarvis.env_store.delta(self.env, self.env_base)
+            blob = store.dumps(env_ref)
+            env_hash = store.digest(blob)
+            if env_hash != self.env_hash:
+                store.put_env(env_ref, blob)
+                self.env_hash = env_hash
+        for pkg in self._sub_pkgs:
+            pkg._stage()
 
     def set_config_env_vars(self, cur_iter_temp=None):
         if cur_iter_temp is not None:
@@ -347,7 +986,11 @@ class Pkg(ABC):
                 path = os.path.join(self.config_dir, dir_name)
                 if os.path.isdir(path):
                     shutil.rmtree(path)
-            os.remove(self.config_path)
+            store = self.get_store()
+            store.remove(self.global_id)
+            store.commit()
+            self.sub_pkgs = []
+            self.sub_pkgs_dict = {}
             self.create(self.global_id)
         except FileNotFoundError:
             pass
@@ -375,6 +1018,10 @@ class Pkg(ABC):
             shutil.rmtree(self.config_dir)
         except FileNotFoundError:
             pass
+        if self.root is self:
+            self.get_store().drop()
+        else:
+            self.get_store().remove(self.global_id)
 
     def insert(self, at_id, pkg_type, pkg_id=None, do_configure=True, **kwargs):
         """
@@ -406,11 +1053,12 @@ class Pkg(ABC):
         if pkg is None:
             raise Exception(f'Could not find pkg: {pkg_type}')
         global_id = f'{self.global_id}.{pkg_id}'
+        pkg.root = self.root
         pkg.create(global_id)
         if do_configure:
             pkg.update_env(self.env)
             pkg.configure(**kwargs)
-        self.sub_pkgs.insert(off, pkg)
+        self._sub_pkgs.insert(off, pkg)
         self.sub_pkgs_dict[pkg.pkg_id] = pkg
         return self
 
@@ -438,13 +1086,16 @@ class Pkg(ABC):
         """
         return self.insert(0, pkg_type, pkg_id, do_configure, **kwargs)
 
+    def _has_pkg(self, pkg_id):
+        return any(pkg.pkg_id == pkg_id for pkg in self._sub_pkgs)
+
     def _make_unique_name(self, pkg_type):
-        if self.get_pkg(pkg_type) is None:
+        if not self._has_pkg(pkg_type):
             return pkg_type
         count = 1
         while True:
             new_name = f'{pkg_type}{count}'
-            if self.get_pkg(new_name) is not None:
+            if self._has_pkg(new_name):
                 count += 1
             return new_name
 
@@ -469,8 +1120,9 @@ class Pkg(ABC):
         :param pkg_id: The name of the pkg to remove
         :return: self
         """
-        self.sub_pkgs = [test_pkg for test_pkg in self.sub_pkgs
+        self._sub_pkgs = [test_pkg for test_pkg in self._sub_pkgs
                           if test_pkg.pkg_id != pkg_id]
+        self.sub_pkgs_dict.pop(pkg_id, None)
         self.config['sub_pkgs'] = [
             [test_pkg_type, test_pkg_id]
             for test_pkg_type, test_pkg_id in self.config['sub_pkgs']
@@ -484,11 +1136,12 @@ class Pkg(ABC):
         :param pkg_id: The pkg id to find
         :return: A pkg
         """
-        matches = [pkg for pkg in self.sub_pkgs if pkg.pkg_id == pkg_id]
+        matches = [pkg for pkg in self._sub_pkgs if pkg.pkg_id == pkg_id]
         if len(matches) == 0:
             return None
-        else:
-            return matches[0]
+        if isinstance(matches[0], PkgProxy):
+            return matches[0].materialize()
+        return matches[0]
 
     def view_pkgs(self):
         print(self.to_string_pretty())
@@ -504,9 +1157,10 @@ class Pkg(ABC):
         :param mod_env: The modified environment dict
         :return:
         """
-        env.update(self.env)
-        self.env = env
-        self.mod_env = mod_env
+        with self.trace(f'{self.pkg_id} env', 'env'):
+            env.update(self.env)
+            self.env = env
+            self.mod_env = mod_env
 
     @staticmethod
     def _track_env(env, env_track_dict=None):
@@ -668,7 +1322,7 @@ class Pkg(ABC):
             if key == 'sub_pkgs':
                 continue
             info.append(f'{space}  {key}={val}')
-        for sub_pkg in self.sub_pkgs:
+        for sub_pkg in self._sub_pkgs:
             info += sub_pkg.to_string_list_pretty(depth + 2)
         return info
 
@@ -683,11 +1337,100 @@ class Pkg(ABC):
         pass
 
 
+class PkgProxy:
+    """
+    A sub-pkg which was not constructed yet. The pkg type, id, and stored
+    config are available without importing the pkg's code. Any other
+    attribute access constructs and loads the pkg, which then replaces
+    the proxy in its parent.
+    """
+
+    def __init__(self, parent, pkg_type, pkg_id):
+        attrs = self.__dict__
+        attrs['parent'] = parent
+        attrs['pkg'] = None
+        attrs['pkg_type'] = pkg_type
+        attrs['pkg_id'] = pkg_id
+        attrs['global_id'] = f'{parent.global_id}.{pkg_id}'
+        attrs['root'] = parent.root
+
+    @property
+    def config(self):
+        if self.pkg is not None:
+            return self.pkg.config
+        return self.root.get_store().get_config(self.global_id)
+
+    def materialize(self):
+        """
+        Construct and load the pkg.
+
+        :return: The pkg, or None if its pkg type could not be found
+        """
+        if self.pkg is not None:
+            return self.pkg
+        parent = self.parent
+        with parent.trace(f'load {self.pkg_id}', 'jarvis',
+                          pkg_type=self.pkg_type):
+            pkg = parent.jarvis.construct_pkg(self.pkg_type)
+            if pkg is not None:
+                pkg.load(self.global_id, self.root)
+        if pkg is None:
+            parent.log(f'Could not find pkg: {self.pkg_type}. Skipping.',
+                       Color.RED)
+            parent._sub_pkgs = [sub_pkg for sub_pkg in parent._sub_pkgs
+                                if sub_pkg is not self]
+            return None
+        self.__dict__['pkg'] = pkg
+        parent._sub_pkgs = [pkg if sub_pkg is self else sub_pkg
+                            for sub_pkg in parent._sub_pkgs]
+        if parent.sub_pkgs_dict.get(self.pkg_id) is self:
+            parent.sub_pkgs_dict[self.pkg_id] = pkg
+        return pkg
+
+    def _stage(self):
+        # An unused sub-pkg has nothing new to save
+        if self.pkg is not None:
+            self.pkg._stage()
+
+    def to_string_list_pretty(self, depth=0):
+        if self.pkg is not None:
+            return self.pkg.to_string_list_pretty(depth)
+        space = ' ' * depth
+        info = [f'{space}{self.pkg_type} with name {self.pkg_id}']
+        config = self.config
+        for key, val in config.items():
+            if key == 'sub_pkgs':
+                continue
+            info.append(f'{space}  {key}={val}')
+        for sub_pkg_type, sub_pkg_id in config['sub_pkgs']:
+            info += PkgProxy(self, sub_pkg_type, sub_pkg_id)\
+                .to_string_list_pretty(depth + 2)
+        return info
+
+    def __getattr__(self, name):
+        pkg = self.materialize()
+        if pkg is None:
+            raise AttributeError(
+                f'Could not find pkg: {self.pkg_type}')
+        return getattr(pkg, name)
+
+    def __setattr__(self, name, val):
+        pkg = self.materialize()
+        if pkg is None:
+            raise AttributeError(
+                f'Could not find pkg: {self.pkg_type}')
+        setattr(pkg, name, val)
+
+
 class SimplePkg(Pkg):
     """
     A SimplePkg represents a single program. A pipeline is not a SimplePkg
     because it represents a combination of multiple programs.
     """
+    # The pkg ids or pkg types which must start before this pkg.
+    # None means every pkg before this one in the pipeline.
+    # Overridden by the depends_on parameter of the pkg.
+    depends_on = None
 
     def configure_menu(self):
         """
@@ -741,9 +1484,42 @@ class SimplePkg(Pkg):
                 'type': bool,
                 'default': False
             },
+            {
+                'name': 'ready_timeout',
+                'msg': 'How long start waits for a service to be ready '
+                       '(seconds). 0 to sleep instead of checking.',
+                'type': int,
+                'default': 60,
+            },
+            {
+                'name': 'depends_on',
+                'msg': 'Comma-separated pkg ids or types which must start '
+                       'before this pkg. [] for none. By default, all pkgs '
+                       'before this one in the pipeline.',
+                'type': str,
+                'default': None
+            },
         ]
         return menu
 
+    def get_depends_on(self):
+        """
+        The pkgs which must start before this pkg
+
+        :return: A list of pkg ids or types, or None for every pkg before
+        this one in the pipeline
+        """
+        depends_on = self.config.get('depends_on')
+        if depends_on is None:
+            return self.depends_on
+        if isinstance(depends_on, str):
+            depends_on = depends_on.strip()
+            if len(depends_on) == 0:
+                return self.depends_on
+            depends_on = depends_on.strip('[]').split(',')
+        depends_on = [str(dep).strip().strip('\'"') for dep in depends_on]
+        return [dep for dep in depends_on if len(dep)]
+
     @abstractmethod
     def _configure_menu(self):
         """
@@ -766,8 +1542,9 @@ class SimplePkg(Pkg):
             kwargs['stdout'] = kwargs['stderr']
         if kwargs['stderr'] == 'stdout':
             kwargs['stderr'] = kwargs['stdout']
-        self.update_config(kwargs, rebuild=kwargs['reinit'])
-        self._configure(**kwargs)
+        with self.trace(f'{self.pkg_id} configure', 'configure'):
+            self.update_config(kwargs, rebuild=kwargs['reinit'])
+            self._configure(**kwargs)
 
     @abstractmethod
     def _configure(self, **kwargs):
@@ -873,6 +1650,62 @@ class Service(SimplePkg):
     """
     A long-running service.
     """
+    def ready_probes(self):
+        """
+        The probes which pass once the service started. By default, there
+        are none and wait_ready sleeps for config['sleep'] seconds.
+
+        :return: List of Probe
+        """
+        return []
+
+    def keeps_warm(self):
+        """
+        Whether the service can be left running between the runs of a
+        sweep (see Pipeline.run_warm). Services opt in by defining
+        warm_reset(), which removes the data of the last run.
+
+        :return: bool
+        """
+        return hasattr(self, 'warm_reset')
+
+    def wait_ready(self, probes=None, timeout=None):
+        """
+        Wait until every probe passes, polling with backoff. If there are
+        no probes, or ready_timeout is 0, sleep for config['sleep'] seconds
+        instead (if it is positive).
+
+        :param probes: The probes to wait for (default: ready_probes())
+        :param timeout: Seconds to wait (default: config['ready_timeout'])
+        :return: None
+        """
+        if probes is None:
+            probes = self.ready_probes()
+        if timeout is None:
+            timeout = self.config.get('ready_timeout', 60)
+        if len(probes) == 0 or not timeout:
+            if self.config['sleep'] > 0:
+                self.log(f'Sleeping for {self.config["sleep"]} seconds',
+                         color=Color.YELLOW)
+                time.sleep(self.config['sleep'])
+            return
+        start = time.time()
+        delay = .1
+        waiting = list(probes)
+        while True:
+            waiting = [probe for probe in waiting if not probe.ready()]
+            if len(waiting) == 0:
+                break
+            elapsed = time.time() - start
+            if elapsed >= timeout:
+                raise Exception(f'{self.pkg_id} was not ready after '
+                                f'{timeout} seconds. Waiting for: '
+                                f'{[probe.describe() for probe in waiting]}')
+            time.sleep(min(delay, timeout - elapsed))
+            delay = min(delay * 2, 2)
+        self.log(f'{self.pkg_id} was ready after '
+                 f'{time.time() - start:.2f} seconds', color=Color.YELLOW)
+
     @abstractmethod
     def start(self):
         """
@@ -923,14 +1756,52 @@ class Application(Service):
     def status(self):
         return True
 
+    def keeps_warm(self):
+        return False
+
 
 class Pipeline(Pkg):
     """
     A pipeline connects the different pkg types together in a chain.
     """
+    def __init__(self):
+        super().__init__()
+        self.tracer = Tracer()
+
     def _init(self):
         pass
 
+    def load(self, global_id=None, root=None, with_config=True):
+        with self.tracer.span('load', 'jarvis'):
+            return super().load(global_id, root, with_config)
+
+    @contextmanager
+    def trace_command(self, name):
+        """
+        Trace a pipeline command, such as start or stop. The Execs it
+        launches are included. When the outermost command finishes (or
+        fails), the trace is saved to tracer.path, or by default to
+        trace_{name}.json in the config directory of the pipeline.
+
+        :param name: The name of the command
+        :return: None
+        """
+        tracer = self.tracer
+        outermost = tracer.depth == 0
+        try:
+            with tracer.activate(), tracer.span(name, 'pipeline',
+                                                pipeline=self.global_id):
+                yield
+        finally:
+            if outermost:
+                path = tracer.path
+                if path is None:
+                    path = os.path.join(self.config_dir,
+                                        f'trace_{name}.json')
+                tracer.save(path)
+                tracer.path = None
+
+    @traced
     def configure(self, pkg_id, **kwargs):
         """
         Configure a pkg in the pipeline
@@ -956,6 +1827,7 @@ class Pipeline(Pkg):
         exec_info = LocalExecInfo()
         self.env = exec_info.basic_env
         self.track_env(env_track_dict)
+        self.env_base = self.jarvis.env_store.put(self.env)
         self.update()
         return self
 
@@ -971,8 +1843,11 @@ class Pipeline(Pkg):
         exec_info = LocalExecInfo()
         self.env = exec_info.basic_env
         self.track_env(env_track_dict)
-        static_env_path = os.path.join(self.jarvis.env_dir, f'{env_name}.yaml')
-        YamlFile(static_env_path).save(self.env)
+        env_store = self.jarvis.env_store
+        self.env_base = env_store.put(self.env)
+        static_env_path = self.get_static_env_path(env_name)
+        YamlFile(static_env_path).save(env_store.delta(self.env,
+                                                       self.env_base))
         return self
 
     def from_yaml(self, path, do_configure=True):
@@ -1004,6 +1879,8 @@ class Pipeline(Pkg):
             self.config['JARVIS_YAML_PATH'] = path
         if 'env' in config:
             self.copy_static_env(config['env'])
+        if 'teardown_workers' in config:
+            self.config['teardown_workers'] = config['teardown_workers']
         for sub_pkg in config['pkgs']:
             pkg_type = sub_pkg['pkg_type']
             pkg_name = sub_pkg['pkg_name']
@@ -1046,8 +1923,98 @@ class Pipeline(Pkg):
         self.config['iterator']['repeat'] = config['repeat']
         if 'norerun' in config:
             self.config['iterator']['norerun'] = config['norerun']
+        if 'keep_warm' in config:
+            self.config['iterator']['keep_warm'] = config['keep_warm']
+        if 'search' in config:
+            self.config['iterator']['search'] = config['search']
+        if 'order' in config:
+            self.config['iterator']['order'] = config['order']
+        if 'adaptive' in config:
+            self.config['iterator']['adaptive'] = config['adaptive']
+        if 'constraints' in config:
+            self.config['iterator']['constraints'] = config['constraints']
+        for key in ['partitions', 'port_stride']:
+            if key in config:
+                self.config['iterator'][key] = config[key]
         return self
 
+    def export_yaml(self, path=None):
+        """
+        Write a human-readable copy of the pipeline. The file uses the
+        same format as the pipeline scripts loaded by from_yaml.
+
+        :param path: Where to write the file. Defaults to export.yaml
+        in the config directory of the pipeline.
+        :return: The path the pipeline was written to
+        """
+        if path is None:
+            path = os.path.join(self.config_dir, 'export.yaml')
+        pkgs = []
+        for pkg in self._sub_pkgs:
+            pkg_info = {
+                'pkg_type': pkg.pkg_type,
+                'pkg_name': pkg.pkg_id,
+            }
+            pkg_info.update({key: val for key, val in pkg.config.items()
+                             if key not in ['sub_pkgs', 'pkg_type']})
+            pkgs.append(pkg_info)
+        config = {
+            'name': self.global_id,
+            'pkgs': pkgs,
+        }
+        if 'teardown_workers' in self.config:
+            config['teardown_workers'] = self.config['teardown_workers']
+        if 'iterator' in self.config:
+            iterator = self.config['iterator']
+            config = {
+                'config': config,
+                **iterator
+            }
+        YamlFile(path).save(config)
+        return path
+
+    def get_iter_out(self):
+        """
+        Get the output directory of the pipeline iterator
+
+        :return: str
+        """
+        self.set_config_env_vars()
+        return os.path.expandvars(self.config['iterator']['output'])
+
+    def get_runs_path(self):
+        """
+        Get the path where the iterator records each run (see StatsSink)
+
+        :return: str
+        """
+        return os.path.join(self.get_iter_out(), 'runs.jsonl')
+
+    def show_stats(self, follow=False):
+        """
+        Print the stats of each run of the sweep as CSV rows. A new header
+        is printed whenever a run adds columns.
+
+        :param follow: Wait for new runs until interrupted
+        :return: None
+        """
+        if 'iterator' not in self.config:
+            raise Exception(f'{self.global_id} is not an iterative pipeline')
+        sink = StatsSink(self.get_runs_path())
+        records = sink.follow() if follow else sink.records()
+        columns = []
+        writer = csv.writer(sys.stdout)
+        for record in records:
+            if not sink.is_run(record):
+                continue
+            stats = record['stats']
+            new_columns = [key for key in stats if key not in columns]
+            if len(new_columns):
+                columns += new_columns
+                writer.writerow(columns)
+            writer.writerow([stats.get(key, '') for key in columns])
+            sys.stdout.flush()
+
     def get_static_env_path(self, env_name):
         """
         Get the path to the static environment
@@ -1067,7 +2034,8 @@ class Pipeline(Pkg):
         :return: self
         """
         static_env_path = self.get_static_env_path(env_name)
-        self.env = YamlFile(static_env_path).load()
+        self.env, self.env_base = self.jarvis.env_store.compose(
+            YamlFile(static_env_path).load())
         self.track_env(env_track_dict)
         self.update()
         return self
@@ -1080,7 +2048,8 @@ class Pipeline(Pkg):
         :return: self
         """
         static_env_path = self.get_static_env_path(env_name)
-        env = YamlFile(static_env_path).load()
+        env, _ = self.jarvis.env_store.compose(
+            YamlFile(static_env_path).load())
         print(yaml.dump(env))
         return self
 
@@ -1103,7 +2072,8 @@ class Pipeline(Pkg):
         """
         envs = os.listdir(self.jarvis.env_dir)
         for env in envs:
-            print(env)
+            if env.endswith('.yaml'):
+                print(env)
         return self
 
     def update_yaml(self):
@@ -1116,6 +2086,7 @@ class Pipeline(Pkg):
             self.update()
         return self
 
+    @traced
     def update(self):
         """
         Re-run configure on all sub-pkgs.
@@ -1127,33 +2098,268 @@ class Pipeline(Pkg):
             pkg.configure()
         return self
 
+    @traced
     def run_iter(self, resume=False):
         """
-        Run the pipeline repeatedly with new configurations
+        Run the pipeline repeatedly with new configurations. If tracing
+        is on, the trace of the sweep is appended to trace.json in the
+        iterator output directory after every point.
+
+        :param resume: Skip the runs recorded by an earlier attempt of
+        this sweep (see PipelineIterator.load_runs)
         """
         self.iterator = PipelineIterator(self)
+        self.tracer.path = os.path.join(self.iterator.iter_out, 'trace.json')
+        num_done = self.iterator.load_runs(resume)
+        if resume:
+            self.log(f'[ITER] Resuming after {num_done} completed runs',
+                     Color.BRIGHT_BLUE)
         conf_dict = self.iterator.begin()
-        while conf_dict is not None:
-            self.clean(with_iter_out=False)
-            for i in range(self.iterator.repeat):
+        if self.iterator.partitions > 1:
+            self.run_partitions()
+        else:
+            # The services left running by the last run (keep_warm)
+            running = set()
+            while conf_dict is not None:
+                running = self.run_point(conf_dict, running)
+                self.tracer.flush(self.tracer.path)
+                conf_dict = self.iterator.next()
+            self.stop_running(running)
+        self.iterator.restore_hosts()
+        self.save()
+        best = self.iterator.get_best()
+        if best is not None:
+            self.log(f'[ITER] Best {self.iterator.strategy.metric} '
+                     f'({self.iterator.strategy.goal}): {best}',
+                     Color.BRIGHT_BLUE)
+        self.log(f'[ITER] Beginning analysis', Color.BRIGHT_BLUE)
+        self.iterator.analysis()
+        self.log(f'[ITER] Finished analysis', Color.BRIGHT_BLUE)
+        self.log(f'[ITER] Stored results in: {self.iterator.stats_path}', Color.BRIGHT_BLUE)
+        self.log(f'[ITER] Pipeline state bytes written: '
+                 f'{self.get_store().bytes_written}', Color.BRIGHT_BLUE)
+        if self.tracer.enabled:
+            self.log(f'[ITER] Stored the trace in: {self.tracer.path}',
+                     Color.BRIGHT_BLUE)
+
+    def run_point(self, conf_dict, running):
+        """
+        Run the repetitions of the current point of the sweep which are
+        still needed
+
+        :param conf_dict: The config of each pkg
+        :param running: The ids of the services left running by the last
+        run (keep_warm)
+        :return: The ids of the services left running
+        """
+        reps = self.iterator.get_reps()
+        first = next(reps, None)
+        if first is None:
+            self.iterator.save_point()
+            return running
+        all_ids = {pkg.pkg_id for pkg in self.sub_pkgs}
+        repeat = self.iterator.warmup + self.iterator.get_repeat_range()[1]
+        with self.tracer.span(f'point {self.iterator.iter_count}', 'sweep',
+                              **self.iterator.linear_conf_dict):
+            self.clean(with_iter_out=False, pkg_ids=all_ids - running)
+            for i in itertools.chain([first], reps):
                 cur_iter_tmp = os.path.join(
                     self.iterator.iter_out,
                     f'{self.iterator.iter_count}-{i}')
                 self.set_config_env_vars(cur_iter_tmp)
                 self.log(f'[ITER] Iteration'
                          f'[(param) {self.iterator.iter_count + 1}/{self.iterator.max_iter_count}]'
-                         f'[(rep) {i + 1}/{self.iterator.repeat}]: '
+                         f'[(rep) {i + 1}/{repeat}]: '
                          f'{self.iterator.linear_conf_dict}', Color.BRIGHT_BLUE)
-                self.iterator.config_pkgs(conf_dict)
-                self.run(kill=True)
-                self.iterator.save_run(conf_dict)
-                self.clean(with_iter_out=False)
-            conf_dict = self.iterator.next()
-        self.log(f'[ITER] Beginning analysis', Color.BRIGHT_BLUE)
-        self.iterator.analysis()
-        self.log(f'[ITER] Finished analysis', Color.BRIGHT_BLUE)
-        self.log(f'[ITER] Stored results in: {self.iterator.stats_path}', Color.BRIGHT_BLUE)
+                with self.tracer.span(f'rep {i}', 'sweep',
+                                      iter_dir=cur_iter_tmp):
+                    changed = self.iterator.config_pkgs(conf_dict)
+                    if self.iterator.keep_warm:
+                        running = self.run_warm(running, changed)
+                    else:
+                        self.run(kill=True)
+                    self.iterator.save_run(conf_dict, i)
+                    self.clean(with_iter_out=False,
+                               pkg_ids=all_ids - running)
+                    self.record_restart_costs()
+            self.iterator.save_point()
+        return running
+
+    def stop_running(self, running):
+        """
+        Kill and clean the services left running at the end of a sweep
+
+        :param running: The ids of the services left running
+        :return: None
+        """
+        if len(running):
+            self.kill(pkg_ids=running)
+            self.clean(with_iter_out=False, pkg_ids=running)
+
+    def run_partitions(self):
+        """
+        Run the points of a sweep concurrently on disjoint partitions of
+        the hostfile. Each partition runs a copy of the pipeline (see
+        make_partition) in a process of its own. When a partition is free,
+        it is sent the next point which is valid on its own hosts (e.g.,
+        hostfile.nnodes is at most its number of hosts). Points which are
+        valid on no partition are skipped. The runs of every partition are
+        merged into the runs of the sweep.
+
+        :return: None
+        """
+        if self.iterator.strategy is not None:
+            raise Exception('Search strategies choose one point at a time '
+                            'and cannot run on partitions')
+        hostfiles = self.iterator.partition_hosts()
+        ppl_ids = [self.make_partition(k, path)
+                   for k, path in enumerate(hostfiles)]
+        self.log(f'[ITER] Running on {len(ppl_ids)} partitions: {ppl_ids}',
+                 Color.BRIGHT_BLUE)
+        design = self.iterator.design
+        checks = [self.iterator.get_design(Hostfile(hostfile=path))
+                  for path in hostfiles]
+        # The partitions each point is valid on
+        pending = {}
+        for row in range(len(design)):
+            parts = {k for k, check in enumerate(checks)
+                     if check.is_valid(design[row])}
+            if len(parts):
+                pending[row] = parts
+        skipped = len(design) - len(pending)
+        if skipped:
+            self.log(f'[ITER] Skipping {skipped} points which do not fit '
+                     f'on any partition', Color.YELLOW)
+        ctx = multiprocessing.get_context('fork')
+        requests = ctx.Queue()
+        points = [ctx.Queue() for _ in ppl_ids]
+        workers = []
+        for k, (ppl_id, path) in enumerate(zip(ppl_ids, hostfiles)):
+            worker = ctx.Process(target=self._run_partition,
+                                 args=(k, ppl_id, path, requests, points[k]),
+                                 name=ppl_id)
+            worker.start()
+            workers.append(worker)
+        active = set(range(len(workers)))
+        while len(active):
+            try:
+                k = requests.get(timeout=1)
+            except queue.Empty:
+                active = {k for k in active if workers[k].is_alive()}
+                continue
+            row = next((row for row, parts in pending.items()
+                        if k in parts), None)
+            if row is None:
+                active.discard(k)
+            else:
+                del pending[row]
+            points[k].put(row)
+        for worker in workers:
+            worker.join()
+        self.iterator.merge_partitions()
+        failed = [worker.name for worker in workers if worker.exitcode != 0]
+        if len(failed):
+            raise Exception(f'The sweep failed on the partitions: {failed}. '
+                            f'Run it again with +resume to retry the '
+                            f'missing runs.')
+
+    def make_partition(self, k, hostfile_path):
+        """
+        Create a copy of this pipeline which runs on a partition of the
+        hostfile. The copy is named <pipeline>_part<k>, so it has its own
+        config, private, and shared directories. Its iterator output is
+        part<k> of the sweep's, and its ports are offset by k * port_stride,
+        so the partitions do not collide.
+
+        :param k: The index of the partition
+        :param hostfile_path: The hostfile of the partition
+        :return: The id of the copy
+        """
+        path = self.export_yaml(
+            os.path.join(self.config_dir, f'partition{k}.yaml'))
+        config = YamlFile(path).load()
+        config['config']['name'] = f'{self.global_id}_part{k}'
+        config['output'] = self.iterator.get_partition_out(k)
+        config.pop('partitions', None)
+        stride = self.iterator.port_stride
+        for pkg_info in config['config']['pkgs']:
+            for key, val in pkg_info.items():
+                if (key == 'port' or key.endswith('_port')) and \
+                        isinstance(val, int) and not isinstance(val, bool):
+                    pkg_info[key] = val + k * stride
+        # The pkgs of the copy are configured for the hosts of the partition
+        hostfile = self.jarvis.hostfile
+        self.jarvis.hostfile = Hostfile(hostfile=hostfile_path)
+        try:
+            Pipeline().from_yaml_iter_dict(config, path).save()
+        finally:
+            self.jarvis.hostfile = hostfile
+        return config['config']['name']
+
+    def _run_partition(self, k, ppl_id, hostfile_path, requests, points):
+        """
+        Run points of the sweep on a partition until there are none left.
+        Runs in a process forked by run_partitions.
+
+        :param k: The index of the partition
+        :param ppl_id: The copy of the pipeline for the partition
+        :param hostfile_path: The hostfile of the partition
+        :param requests: The queue the partition asks for a point on
+        :param points: The queue of rows of the design for this partition
+        (None means there are no more)
+        :return: None
+        """
+        self.jarvis.hostfile = Hostfile(hostfile=hostfile_path)
+        ppl = Pipeline().load(ppl_id)
+        iterator = PipelineIterator(ppl)
+        iterator.load_runs()
+        iterator.done = set(self.iterator.done)
+        iterator.values = self.iterator.values
+        iterator.design = self.iterator.design
+        iterator.max_iter_count = self.iterator.max_iter_count
+        # Every loop group differs from the point before the first one
+        iterator.cur_pos = [-1] * len(iterator.fors)
+        ppl.iterator = iterator
+        ppl.tracer.path = os.path.join(iterator.iter_out, 'trace.json')
+        with ppl.trace_command('run_iter'):
+            running = set()
+            requests.put(k)
+            row = points.get()
+            while row is not None:
+                conf_dict = iterator.move(iterator.design[row])
+                iterator.iter_count = row
+                running = ppl.run_point(conf_dict, running)
+                ppl.tracer.flush(ppl.tracer.path)
+                requests.put(k)
+                row = points.get()
+            ppl.stop_running(running)
+            iterator.restore_hosts()
+            ppl.save()
+
+    @staticmethod
+    def run_queued(job, hostfile_path):
+        """
+        Run a pipeline of the run queue on its subset of the hosts.
+        Runs in a process forked by RunQueue.run.
 
+        :param job: The job of the run queue
+        :param hostfile_path: The hostfile of the job
+        :return: The exit code of the pipeline
+        """
+        jarvis = JarvisManager.get_instance()
+        jarvis.hostfile = Hostfile(hostfile=hostfile_path)
+        if job['path'] is not None:
+            ppl = Pipeline().from_yaml(job['path']).save()
+        else:
+            ppl = Pipeline().load(job['pipeline'])
+            ppl.update().save()
+        if 'iterator' in ppl.config:
+            ppl.run_iter()
+        else:
+            ppl.run()
+        return ppl.exit_code
+
+    @traced
     def run(self, kill=False):
         """
         Start and stop the pipeline
@@ -1167,7 +2373,82 @@ class Pipeline(Pkg):
         else:
             self.stop()
 
-    def start(self):
+    def run_warm(self, running, changed):
+        """
+        Run the pipeline, leaving services running for the next run.
+        A service which is still running is reset instead of restarted,
+        unless its config (or the config of a pkg it depends on) changed.
+        Only services which define warm_reset(), which removes the data of
+        the last run, are left running (see Service.keeps_warm);
+        applications always run again.
+
+        :param running: The ids of the services left running by the last run
+        :param changed: The ids of the pkgs whose config changed since
+        the last run
+        :return: The ids of the services left running
+        """
+        stale = running & self.get_restarts(changed)
+        if len(stale):
+            self.kill(pkg_ids=stale)
+            self.clean(with_iter_out=False, pkg_ids=stale)
+        self.start(warm=running - stale)
+        keep = {pkg.pkg_id for pkg in self.sub_pkgs
+                if isinstance(pkg, Service) and pkg.keeps_warm()}
+        self.kill(pkg_ids={pkg.pkg_id for pkg in self.sub_pkgs} - keep)
+        return keep
+
+    def get_restart_cost(self, pkg_id):
+        """
+        The seconds it takes to restart a pkg, as measured by earlier
+        sweeps (see record_restart_costs). Until a pkg was measured,
+        applications are assumed to cost nothing (they run every time
+        anyway) and other pkgs are assumed to cost 1 second.
+
+        :param pkg_id: The id of the pkg
+        :return: float
+        """
+        costs = self.config.get('restart_costs', {})
+        if pkg_id in costs:
+            return costs[pkg_id]
+        if isinstance(self.get_pkg(pkg_id), Application):
+            return 0
+        return 1
+
+    def record_restart_costs(self):
+        """
+        Measure the restart cost of each pkg started (rather than reset)
+        by the last run: the time it took to start, kill, and clean. The
+        measurement is averaged with the earlier ones.
+
+        :return: None
+        """
+        costs = self.config.setdefault('restart_costs', {})
+        for pkg in self.sub_pkgs:
+            if pkg.warm or pkg.skip_run:
+                continue
+            cost = pkg.start_time + pkg.kill_time + pkg.clean_time
+            if pkg.pkg_id in costs:
+                cost = (costs[pkg.pkg_id] + cost) / 2
+            costs[pkg.pkg_id] = cost
+
+    def get_restarts(self, changed):
+        """
+        Get the pkgs which must be restarted after the config of some pkgs
+        changed: those pkgs and every pkg which depends on them.
+
+        :param changed: The ids of the pkgs whose config changed
+        :return: A set of pkg ids
+        """
+        deps = self.get_dependencies()
+        restarts = set(changed)
+        for wave in self.get_waves():
+            for pkg in wave:
+                if any(dep in restarts for dep in deps[pkg.pkg_id]):
+                    restarts.add(pkg.pkg_id)
+        return restarts
+
+    @traced
+    def start(self, warm=None):
         """
         Start the pipeline.
 
@@ -1178,102 +2459,383 @@ class Pipeline(Pkg):
         used for piping output will be open for as long as the daemon.
         If using start directly, you should launch as background process.
 
+        Pkgs start in waves (see get_waves). The services of a wave are
+        started concurrently.
+
+        :param warm: The ids of services which are still running from the
+        last run. They are reset instead of started (see run_warm).
         :return: None
         """
+        if warm is None:
+            warm = set()
+        self.jarvis.setup_private_dir()
         self.mod_env = self.env.copy()
-        for pkg in self.sub_pkgs:
-            if pkg.skip_run:
-                self.log(f'[RUN] (skipping) {pkg.pkg_id}: Start', color=Color.YELLOW)
-            else:
-                self.log(f'[RUN] {pkg.pkg_id}: Start', color=Color.GREEN)
+        for wave in self.get_waves():
+            for pkg in wave:
+                if pkg.skip_run:
+                    self.log(f'[RUN] (skipping) {pkg.pkg_id}: Start', color=Color.YELLOW)
+                elif pkg.pkg_id in warm:
+                    self.log(f'[RUN] {pkg.pkg_id}: Reset (kept running)', color=Color.GREEN)
+                else:
+                    self.log(f'[RUN] {pkg.pkg_id}: Start', color=Color.GREEN)
+                if isinstance(pkg, (Service, Interceptor)):
+                    pkg.update_env(self.env, self.mod_env)
+            self._run_wave(wave, lambda pkg: self._start_pkg(pkg, pkg.pkg_id in warm))
+            for pkg in wave:
+                self.exit_code += pkg.exit_code
+
+    def _start_pkg(self, pkg, warm=False):
+        pkg.metrics = {}
+        pkg.warm = warm
+        start = time.time()
+        if warm:
+            with pkg.trace(f'{pkg.pkg_id} reset', 'start'):
+                pkg.warm_reset()
+        else:
+            with pkg.trace(f'{pkg.pkg_id} start', 'start'):
+                if isinstance(pkg, Service):
+                    pkg.start()
+                if isinstance(pkg, Interceptor):
+                    pkg.modify_env()
+                    self.mod_env.update(self.env)
+        end = time.time()
+        pkg.start_time = end - start
+        self.log(f'[RUN] {pkg.pkg_id}: '
+                 f'Start finished in {pkg.start_time} seconds',
+                 color=Color.GREEN)
+
+    def get_teardown_workers(self, workers=None):
+        """
+        The number of pkgs stop, kill, clean, and status handle at once.
+        Set per pipeline by teardown_workers. 0 or 1 means one at a time.
+
+        :param workers: Overrides the pipeline's teardown_workers
+        :return: int
+        """
+        if workers is None:
+            workers = self.config.get('teardown_workers', 0)
+        return int(workers or 0)
 
-            start = time.time()
-            if isinstance(pkg, Service):
-                pkg.update_env(self.env, self.mod_env)
-                pkg.start()
-            if isinstance(pkg, Interceptor):
-                pkg.update_env(self.env, self.mod_env)
-                pkg.modify_env()
-                self.mod_env.update(self.env)
-            self.exit_code += pkg.exit_code
-            end = time.time()
-            pkg.start_time = end - start
-            self.log(f'[RUN] {pkg.pkg_id}: '
-                     f'Start finished in {pkg.start_time} seconds',
-                     color=Color.GREEN)
+    @staticmethod
+    def _select(pkgs, pkg_ids=None):
+        """
+        Get the pkgs whose id is in pkg_ids
 
-    def stop(self):
+        :param pkgs: List of pkgs
+        :param pkg_ids: A set of pkg ids. None means every pkg.
+        :return: List of pkgs
         """
-        Stop the pipeline
+        if pkg_ids is None:
+            return pkgs
+        return [pkg for pkg in pkgs if pkg.pkg_id in pkg_ids]
 
-        :return: None
+    def _teardown(self, action, func, workers, pkg_ids=None):
         """
-        for pkg in reversed(self.sub_pkgs):
-            self.log(f'[RUN] {pkg.pkg_id}: Stop', color=Color.GREEN)
-            start = time.time()
+        Call func on every pkg with a bounded pool of workers. A pkg is
+        only handled after the pkgs which declared a dependency on it.
+        Logs the wall time of each pkg and of the whole teardown.
+
+        :param action: The name of the teardown step (for logging)
+        :param func: The function to call on each pkg
+        :param workers: The maximum number of pkgs handled at once
+        :param pkg_ids: Only handle these pkgs (default: all)
+        :return: A dict mapping pkg ids to the return value of func
+        """
+        deps = self.get_dependencies(self.sub_pkgs, declared_only=True)
+        pkgs = self._select(self.sub_pkgs, pkg_ids)
+        after = {pkg.pkg_id: [dep.pkg_id for dep in pkgs
+                              if pkg.pkg_id in deps[dep.pkg_id]]
+                 for pkg in pkgs}
+        for pkg in pkgs:
             if isinstance(pkg, Service):
                 pkg.update_env(self.env, self.mod_env)
-                pkg.stop()
-            end = time.time()
-            pkg.stop_time = end - start
+        start = time.time()
+
+        def timed(pkg):
+            self.log(f'[RUN] {pkg.pkg_id}: {action}', color=Color.GREEN)
+            pkg_start = time.time()
+            ret = func(pkg)
+            pkg_time = time.time() - pkg_start
+            setattr(pkg, f'{action.lower()}_time', pkg_time)
             self.log(f'[RUN] {pkg.pkg_id}: '
-                     f'Stop finished in {pkg.stop_time} seconds',
+                     f'{action} finished in {pkg_time} seconds',
                      color=Color.GREEN)
+            return ret
+        rets = self._run_dag(pkgs, after, timed, workers)
+        self.log(f'[RUN] {action} finished in {time.time() - start} seconds '
+                 f'({workers} workers)', color=Color.GREEN)
+        return rets
+
+    @staticmethod
+    def _run_dag(pkgs, deps, func, workers):
+        """
+        Call func on every pkg once the pkgs in deps[pkg_id] finished,
+        running at most workers at a time. A failed pkg does not stop the
+        others; the first error (in pipeline order) is raised at the end.
+
+        :param pkgs: List of pkgs
+        :param deps: A dict mapping each pkg id to the pkg ids to wait for
+        :param func: The function to call on each pkg
+        :param workers: The maximum number of concurrent calls
+        :return: A dict mapping pkg ids to the return value of func
+        """
+        done = set()
+        rets = {}
+        errors = {}
+        running = {}
+        remaining = list(pkgs)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while len(remaining) or len(running):
+                ready = [pkg for pkg in remaining
+                         if all(dep in done for dep in deps[pkg.pkg_id])]
+                for pkg in ready:
+                    running[pool.submit(func, pkg)] = pkg
+                    remaining.remove(pkg)
+                if len(running) == 0:
+                    raise Exception('The pipeline dependencies form a cycle: '
+                                    f'{[pkg.pkg_id for pkg in remaining]}')
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pkg = running.pop(future)
+                    done.add(pkg.pkg_id)
+                    if future.exception() is not None:
+                        errors[pkg.pkg_id] = future.exception()
+                    else:
+                        rets[pkg.pkg_id] = future.result()
+        for pkg in pkgs:
+            if pkg.pkg_id in errors:
+                raise errors[pkg.pkg_id]
+        return rets
+
+    @traced
+    def stop(self, workers=None, pkg_ids=None):
+        """
+        Stop the pipeline. A pkg is stopped after every pkg which
+        depends on it.
+
+        :param workers: The number of pkgs to stop at once
+        (see get_teardown_workers)
+        :param pkg_ids: Only stop these pkgs (default: all)
+        :return: None
+        """
+        workers = self.get_teardown_workers(workers)
+        if workers > 1:
+            self._teardown('Stop', self._stop_service, workers, pkg_ids)
+            return
+        for wave in reversed(self.get_waves()):
+            wave = self._select(wave, pkg_ids)
+            for pkg in reversed(wave):
+                self.log(f'[RUN] {pkg.pkg_id}: Stop', color=Color.GREEN)
+                if isinstance(pkg, Service):
+                    pkg.update_env(self.env, self.mod_env)
+            self._run_wave(wave, self._stop_pkg)
+
+    def _stop_pkg(self, pkg):
+        start = time.time()
+        self._stop_service(pkg)
+        end = time.time()
+        pkg.stop_time = end - start
+        self.log(f'[RUN] {pkg.pkg_id}: '
+                 f'Stop finished in {pkg.stop_time} seconds',
+                 color=Color.GREEN)
 
-    def kill(self):
+    @staticmethod
+    def _stop_service(pkg):
+        if isinstance(pkg, Service):
+            with pkg.trace(f'{pkg.pkg_id} stop', 'stop'):
+                pkg.stop()
+
+    @traced
+    def kill(self, workers=None, pkg_ids=None):
         """
         Stop the pipeline
 
+        :param workers: The number of pkgs to kill at once
+        (see get_teardown_workers)
+        :param pkg_ids: Only kill these pkgs (default: all)
         :return: None
         """
-        for pkg in reversed(self.sub_pkgs):
-            self.log(f'[RUN] {pkg.pkg_id}: Killing', color=Color.GREEN)
-            if isinstance(pkg, Service):
-                pkg.update_env(self.env, self.mod_env)
+        workers = self.get_teardown_workers(workers)
+        if workers > 1:
+            self._teardown('Kill', self._kill_service, workers, pkg_ids)
+            return
+        for wave in reversed(self.get_waves()):
+            wave = self._select(wave, pkg_ids)
+            for pkg in reversed(wave):
+                self.log(f'[RUN] {pkg.pkg_id}: Killing', color=Color.GREEN)
+                if isinstance(pkg, Service):
+                    pkg.update_env(self.env, self.mod_env)
+            self._run_wave(wave, self._kill_pkg)
+
+    def _kill_pkg(self, pkg):
+        start = time.time()
+        self._kill_service(pkg)
+        end = time.time()
+        pkg.kill_time = end - start
+        self.log(f'[RUN] {pkg.pkg_id}: Finished killing', color=Color.GREEN)
+
+    @staticmethod
+    def _kill_service(pkg):
+        if isinstance(pkg, Service):
+            with pkg.trace(f'{pkg.pkg_id} kill', 'kill'):
                 if hasattr(pkg, 'kill'):
                     pkg.kill()
                 else:
                     pkg.stop()
-            self.log(f'[RUN] {pkg.pkg_id}: Finished killing', color=Color.GREEN)
 
-    def clean(self, with_iter_out=True):
+    def get_dependencies(self, pkgs=None, declared_only=False):
+        """
+        Get the pkgs which must start before each pkg. A pkg depends on
+        the pkgs in its depends_on, or on every pkg before it if it has
+        none. Interceptors depend on every pkg before them, and every pkg
+        after an interceptor depends on it, so that environment
+        modifications happen in pipeline order.
+
+        :param pkgs: The pkgs of the pipeline (default: sub_pkgs)
+        :param declared_only: Only include dependencies declared with
+        depends_on, e.g., for parallel teardown
+        :return: A dict mapping each pkg id to a list of pkg ids
+        """
+        if pkgs is None:
+            pkgs = self.sub_pkgs
+        deps = {}
+        for i, pkg in enumerate(pkgs):
+            earlier = pkgs[:i]
+            depends_on = None
+            if isinstance(pkg, SimplePkg) and not isinstance(pkg, Interceptor):
+                depends_on = pkg.get_depends_on()
+            if declared_only:
+                depends_on = depends_on or []
+                dep_ids = []
+            elif depends_on is None:
+                deps[pkg.pkg_id] = [dep.pkg_id for dep in earlier]
+                continue
+            else:
+                dep_ids = [dep.pkg_id for dep in earlier
+                           if isinstance(dep, Interceptor)]
+            for name in depends_on:
+                matches = [dep for dep in pkgs if dep.pkg_id == name]
+                if len(matches) == 0:
+                    matches = [dep for dep in pkgs if dep.pkg_type == name]
+                if len(matches) == 0:
+                    raise Exception(f'{pkg.pkg_id} depends on {name}, '
+                                    f'which is not in the pipeline')
+                dep_ids += [dep.pkg_id for dep in matches if dep is not pkg]
+            deps[pkg.pkg_id] = list(dict.fromkeys(dep_ids))
+        return deps
+
+    def get_waves(self):
+        """
+        Group the pkgs into waves. Every pkg in a wave only depends on pkgs
+        in earlier waves, so the pkgs of a wave can start concurrently.
+        Within a wave, pkgs keep their pipeline order.
+
+        :return: List of lists of pkgs
+        """
+        pkgs = self.sub_pkgs
+        deps = self.get_dependencies(pkgs)
+        done = set()
+        waves = []
+        remaining = list(pkgs)
+        while len(remaining):
+            wave = [pkg for pkg in remaining
+                    if all(dep in done for dep in deps[pkg.pkg_id])]
+            if len(wave) == 0:
+                raise Exception('The pipeline dependencies form a cycle: '
+                                f'{[pkg.pkg_id for pkg in remaining]}')
+            waves.append(wave)
+            done.update(pkg.pkg_id for pkg in wave)
+            remaining = [pkg for pkg in remaining if pkg.pkg_id not in done]
+        return waves
+
+    @staticmethod
+    def _run_wave(wave, func):
+        """
+        Call func on every pkg of a wave, concurrently if there are several.
+        Waits for all of them; then raises the first error, if any.
+
+        :param wave: List of pkgs
+        :param func: The function to call on each pkg
+        :return: None
+        """
+        if len(wave) == 1:
+            func(wave[0])
+            return
+        with ThreadPoolExecutor(max_workers=len(wave)) as pool:
+            futures = [pool.submit(func, pkg) for pkg in wave]
+        for future in futures:
+            future.result()
+
+    @traced
+    def clean(self, with_iter_out=True, workers=None, pkg_ids=None):
         """
         Clean the pipeline
 
         with_iter_out: Clean the iteration output
+        :param workers: The number of pkgs to clean at once
+        (see get_teardown_workers)
+        :param pkg_ids: Only clean these pkgs (default: all)
         :return: None
         """
-        for pkg in reversed(self.sub_pkgs):
-            if pkg.skip_run:
-                self.log(f'[RUN] (skipping) {pkg.pkg_id}: Cleaning', color=Color.YELLOW)
-            else:
-                self.log(f'[RUN] {pkg.pkg_id}: Cleaning', color=Color.GREEN)
-            if isinstance(pkg, Service):
-                pkg.update_env(self.env, self.mod_env)
-                pkg.clean()
-            self.log(f'[RUN] {pkg.pkg_id}: Finished cleaning', color=Color.GREEN)
+        workers = self.get_teardown_workers(workers)
+        if workers > 1:
+            self._teardown('Clean', self._clean_service, workers, pkg_ids)
+        else:
+            for pkg in reversed(self._select(self.sub_pkgs, pkg_ids)):
+                if pkg.skip_run:
+                    self.log(f'[RUN] (skipping) {pkg.pkg_id}: Cleaning', color=Color.YELLOW)
+                else:
+                    self.log(f'[RUN] {pkg.pkg_id}: Cleaning', color=Color.GREEN)
+                if isinstance(pkg, Service):
+                    pkg.update_env(self.env, self.mod_env)
+                    start = time.time()
+                    self._clean_service(pkg)
+                    end = time.time()
+                    pkg.clean_time = end - start
+                self.log(f'[RUN] {pkg.pkg_id}: Finished cleaning', color=Color.GREEN)
         if with_iter_out and 'iterator' in self.config:
             self.iterator = PipelineIterator(self)
             Rm(self.iterator.iter_out)
 
-    def status(self):
+    @staticmethod
+    def _clean_service(pkg):
+        if isinstance(pkg, Service):
+            with pkg.trace(f'{pkg.pkg_id} clean', 'clean'):
+                pkg.clean()
+
+    @traced
+    def status(self, workers=None):
         """
         Get the status of the pipeline
 
+        :param workers: The number of pkgs to query at once
+        (see get_teardown_workers)
         :return: None
         """
+        workers = self.get_teardown_workers(workers)
+        if workers > 1:
+            rets = self._teardown('Status', self._status_service, workers)
+            statuses = [rets[pkg.pkg_id] for pkg in self.sub_pkgs
+                        if isinstance(pkg, Service)]
+            return math.prod(statuses)
         statuses = []
         for pkg in reversed(self.sub_pkgs):
             self.log(f'[RUN] {pkg.pkg_id}: Getting status', color=Color.GREEN)
             status = None
             if isinstance(pkg, Service):
                 pkg.update_env(self.env, self.mod_env)
-                status = pkg.status()
+                status = self._status_service(pkg)
                 statuses.append(status)
             self.log(f'[RUN] {pkg.pkg_id}: Status was {status}',
                      color=Color.GREEN)
         return math.prod(statuses)
 
+    @staticmethod
+    def _status_service(pkg):
+        if isinstance(pkg, Service):
+            with pkg.trace(f'{pkg.pkg_id} status', 'status'):
+                return pkg.status()
+
 
 class PipelineIndex:
     """
@@ -0,0 +1,176 @@
+"""
+This module contains the on-disk index of pkg classes. The index maps
+each pkg_type to the repo, module, and class which implement it, so that
+constructing a pkg is a dictionary lookup followed by one import.
+"""
+
+from jarvis_util.serialize.yaml_file import YamlFile
+from jarvis_util.util.naming import to_camel_case
+import os
+
+
+class PkgIndex:
+    """
+    A persistent index of the pkgs in each jarvis repo. Each repo is
+    rescanned only when the modification time of its pkg directory
+    changes (e.g., a pkg was added or removed). The module and class of a
+    pkg only depend on its name, so editing a pkg.py needs no rescan.
+
+    YAML format:
+    REPOS:
+      builtin:
+        path: ${HOME}/.jarvis/builtin
+        mtime: 1700000000.0
+        pkgs:
+          ior:
+            module: builtin.ior.pkg
+            class: Ior
+    """
+
+    def __init__(self, index_path):
+        """
+        Initialize the index
+
+        :param index_path: The path to the index file
+        """
+        self.index_path = index_path
+        self.index = {'REPOS': {}}
+        self.loaded = False
+        self.modified = False
+        # Repos which were already validated in this process
+        self.checked = set()
+
+    def load(self):
+        """
+        Read the index from the filesystem
+
+        :return: self
+        """
+        if os.path.exists(self.index_path):
+            index = YamlFile(self.index_path).load()
+            if index is not None and 'REPOS' in index:
+                self.index = index
+        self.loaded = True
+        return self
+
+    def save(self):
+        """
+        Write the index to the filesystem if it changed
+
+        :return: self
+        """
+        if self.modified:
+            YamlFile(self.index_path).save(self.index)
+            self.modified = False
+        return self
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, repos, force=False):
+        """
+        Rescan any repo whose pkg directory changed since it was indexed.
+
+        :param repos: The list of repos (dicts with 'name' and 'path')
+        :param force: Rescan every repo, even if unchanged
+        :return: self
+        """
+        if not self.loaded:
+            self.load()
+        for repo in repos:
+            key = (repo['name'], repo['path'])
+            if key in self.checked and not force:
+                continue
+            self.checked.add(key)
+            self._refresh_repo(repo, force)
+        self.save()
+        return self
+
+    def _refresh_repo(self, repo, force=False):
+        """
+        Rescan a single repo if its pkg directory changed.
+
+        :param repo: A dict with the name and path of the repo
+        :param force: Rescan even if the mtime is unchanged
+        :return: None
+        """
+        repo_name = repo['name']
+        repo_path = repo['path']
+        pkgs_dir = os.path.join(repo_path, repo_name)
+        mtime = self._mtime(pkgs_dir)
+        entry = self.index['REPOS'].get(repo_name)
+        if (entry is not None and not force and
+                entry['path'] == repo_path and entry['mtime'] == mtime):
+            return
+        pkgs = {}
+        if mtime is not None:
+            for pkg_type in os.listdir(pkgs_dir):
+                if pkg_type.startswith('_') or pkg_type.startswith('.'):
+                    continue
+                pkg_py = os.path.join(pkgs_dir, pkg_type, 'pkg.py')
+                if not os.path.exists(pkg_py):
+                    continue
+                pkgs[pkg_type] = {
+                    'module': f'{repo_name}.{pkg_type}.pkg',
+                    'class': to_camel_case(pkg_type),
+                }
+        self.index['REPOS'][repo_name] = {
+            'path': repo_path,
+            'mtime': mtime,
+            'pkgs': pkgs,
+        }
+        self.modified = True
+
+    def find(self, pkg_type, repos):
+        """
+        Find the highest-priority repo which provides a pkg type.
+
+        :param pkg_type: The type of pkg to find (snake case)
+        :param repos: The list of repos in priority order
+        :return: A dict with the repo path, module, and class name, or None
+        """
+        self.refresh(repos)
+        for repo in repos:
+            entry = self.index['REPOS'].get(repo['name'])
+            if entry is None or pkg_type not in entry['pkgs']:
+                continue
+            pkg = entry['pkgs'][pkg_type]
+            return {
+                'repo': repo['name'],
+                'path': entry['path'],
+                'module': pkg['module'],
+                'class': pkg['class'],
+            }
+        return None
+
+    def list_pkgs(self, repo):
+        """
+        List the pkg types in a repo.
+
+        :param repo: A dict with the name and path of the repo
+        :return: A sorted list of pkg types
+        """
+        self.refresh([repo])
+        entry = self.index['REPOS'].get(repo['name'])
+        if entry is None:
+            return []
+        return sorted(entry['pkgs'].keys())
+
+    def invalidate(self, repo_name):
+        """
+        Force a repo to be rescanned on next use
+
+        :param repo_name: The name of the repo
+        :return: None
+        """
+        if not self.loaded:
+            self.load()
+        if repo_name in self.index['REPOS']:
+            del self.index['REPOS'][repo_name]
+            self.modified = True
+        self.checked = {key for key in self.checked if key[0] != repo_name}
+        self.save()
@@ -0,0 +1,138 @@
+"""
+This module contains the probes used by Service.wait_ready to check
+whether a service finished starting.
+"""
+
+from abc import ABC, abstractmethod
+import subprocess
+import socket
+import glob
+import os
+import re
+
+
+class Probe(ABC):
+    """
+    A check which passes once a service is ready
+    """
+
+    @abstractmethod
+    def ready(self):
+        """
+        Check whether the service is ready
+
+        :return: bool
+        """
+        pass
+
+    def describe(self):
+        return self.__class__.__name__
+
+
+class PortProbe(Probe):
+    """
+    Passes once a TCP port accepts connections on every host
+    """
+
+    def __init__(self, hosts, port, connect_timeout=1):
+        """
+        :param hosts: The hosts which should listen on the port
+        :param port: The TCP port
+        :param connect_timeout: Seconds to wait for each connection
+        """
+        self.hosts = list(hosts)
+        self.port = int(port)
+        self.connect_timeout = connect_timeout
+        # Hosts which were already seen listening
+        self.ready_hosts = set()
+
+    def ready(self):
+        for host in self.hosts:
+            if host in self.ready_hosts:
+                continue
+            try:
+                with socket.create_connection((host, self.port),
+                                              self.connect_timeout):
+                    self.ready_hosts.add(host)
+            except OSError:
+                return False
+        return True
+
+    def describe(self):
+        waiting = [host for host in self.hosts
+                   if host not in self.ready_hosts]
+        return f'port {self.port} on {waiting}'
+
+
+class FileProbe(Probe):
+    """
+    Passes once a file exists. The path may be a glob pattern, in which
+    case at least count files must match.
+    """
+
+    def __init__(self, path, count=1):
+        self.path = path
+        self.count = count
+
+    def ready(self):
+        return len(glob.glob(self.path)) >= self.count
+
+    def describe(self):
+        return f'{self.count} file(s) matching {self.path}'
+
+
+class LogProbe(Probe):
+    """
+    Passes once a line of a log file matches a regex
+    """
+
+    def __init__(self, path, pattern):
+        self.path = path
+        self.pattern = re.compile(pattern)
+        # Where the next read starts
+        self.offset = 0
+
+    def ready(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offset)
+            data = fp.read()
+        # Only complete lines are searched. The rest is read again later.
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        text = data[:end].decode('utf-8', errors='replace')
+        return any(self.pattern.search(line) for line in text.splitlines())
+
+    def describe(self):
+        return f'{self.pattern.pattern} in {self.path}'
+
+
+class CmdProbe(Probe):
+    """
+    Passes once a local command returns 0 and, if a pattern is given,
+    its output matches the pattern
+    """
+
+    def __init__(self, cmd, pattern=None, env=None):
+        self.cmd = cmd
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.env = env
+
+    def ready(self):
+        env = None
+        if self.env is not None:
+            env = dict(os.environ)
+            env.update(self.env)
+        proc = subprocess.run(self.cmd, shell=True, env=env,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True,
+                              check=False)
+        if proc.returncode != 0:
+            return False
+        if self.pattern is None:
+            return True
+        return self.pattern.search(proc.stdout) is not None
+
+    def describe(self):
+        return self.cmd
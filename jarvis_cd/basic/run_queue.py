@@ -0,0 +1,368 @@
+"""
+This module contains the run queue of jarvis. Pipelines are queued with
+the number of nodes they need, and run concurrently on disjoint subsets
+of the hostfile, so an allocation stays busy while a batch of small
+pipelines runs. The queue is stored in CONFIG_DIR/.queue/queue.yaml:
+
+next_id: 3
+jobs:
+  - id: 0
+    pipeline: ior_small   # The pipeline id
+    path: null            # The YAML the pipeline is created from, if any
+    nnodes: 2             # The number of nodes the pipeline needs
+    time: 600             # The expected runtime (seconds), if known
+    state: done           # queued, running, done, or failed
+    start: 1700000000.0
+    end: 1700000550.0
+    exit_code: 0
+    hosts: [node0, node1]
+    log: CONFIG_DIR/.queue/logs/0.log
+
+Pipelines start in queue order while enough nodes are free. When the
+first waiting pipeline does not fit, later pipelines may start ahead of
+it (backfill), as long as they do not delay it: they either end before
+enough nodes free up for it, or use nodes it does not need. This needs
+the expected runtimes; pipelines without one are only started in order.
+"""
+
+from contextlib import contextmanager
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+import yaml
+
+from jarvis_cd.basic.file_lock import FileLock, save_if_changed
+
+
+def expected_end(job, now):
+    """
+    The time a job is expected to end
+
+    :param job: A job, which has started at job['start'] or starts now
+    :param now: The current time
+    :return: float (inf if the job has no expected runtime)
+    """
+    if job.get('time') is None:
+        return math.inf
+    start = job.get('start')
+    if start is None:
+        start = now
+    return start + job['time']
+
+
+def backfill(pending, running, num_free, now):
+    """
+    Choose the jobs to start now (EASY backfill). Jobs start in queue
+    order while they fit. The first job which does not fit reserves the
+    earliest time enough nodes are expected to be free for it; later jobs
+    may only start if they end before then, or if they use nodes it does
+    not need. If that time is unknown, only the latter may start.
+
+    :param pending: The queued jobs, in queue order
+    :param running: The running jobs
+    :param num_free: The number of free nodes
+    :param now: The current time
+    :return: List of the jobs to start
+    """
+    pending = list(pending)
+    started = []
+    while len(pending) and pending[0]['nnodes'] <= num_free:
+        job = pending.pop(0)
+        started.append(job)
+        num_free -= job['nnodes']
+    if len(pending) == 0:
+        return started
+    head = pending[0]
+    ends = sorted((expected_end(job, now), job['nnodes'])
+                  for job in list(running) + started)
+    shadow = math.inf
+    avail = num_free
+    for end, nnodes in ends:
+        avail += nnodes
+        if avail >= head['nnodes']:
+            shadow = end
+            break
+    # The nodes which are still free once the first job starts
+    extra = max(avail - head['nnodes'], 0)
+    for job in pending[1:]:
+        if job['nnodes'] > num_free:
+            continue
+        end = expected_end(job, now)
+        if end <= shadow < math.inf:
+            pass
+        elif job['nnodes'] <= extra:
+            extra -= job['nnodes']
+        else:
+            continue
+        started.append(job)
+        num_free -= job['nnodes']
+    return started
+
+
+class RunQueue:
+    """
+    A persistent queue of pipelines, run concurrently on the hostfile
+    """
+
+    def __init__(self, config_dir):
+        """
+        Initialize the queue
+
+        :param config_dir: The jarvis config directory
+        """
+        # Hidden, so it is not mistaken for a pipeline (see list_pipelines)
+        self.queue_dir = os.path.join(config_dir, '.queue')
+        self.path = os.path.join(self.queue_dir, 'queue.yaml')
+        self.lock_path = os.path.join(self.queue_dir, 'queue.lock')
+        self.run_lock_path = os.path.join(self.queue_dir, 'run.lock')
+        self.log_dir = os.path.join(self.queue_dir, 'logs')
+
+    def load(self):
+        """
+        Load the queue
+
+        :return: dict
+        """
+        queue = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                queue = yaml.safe_load(fp)
+        return queue or {'next_id': 0, 'jobs': []}
+
+    @contextmanager
+    def edit(self):
+        """
+        Load the queue for modification while holding its lock. The
+        queue is saved at the end of the with block.
+
+        :return: The queue dict
+        """
+        with FileLock(self.lock_path):
+            queue = self.load()
+            yield queue
+            save_if_changed(self.path, lambda path: self._dump(path, queue))
+
+    @staticmethod
+    def _dump(path, queue):
+        with open(path, 'w', encoding='utf-8') as fp:
+            yaml.dump(queue, fp, sort_keys=False)
+
+    def jobs(self):
+        """
+        The jobs of the queue
+
+        :return: List of job dicts
+        """
+        with FileLock(self.lock_path, shared=True):
+            return self.load()['jobs']
+
+    def add(self, pipeline_id, path=None, nnodes=1, runtime=None):
+        """
+        Queue a pipeline
+
+        :param pipeline_id: The id of the pipeline
+        :param path: The YAML file to create the pipeline from, if any
+        :param nnodes: The number of nodes the pipeline needs
+        :param runtime: The expected runtime of the pipeline (seconds)
+        :return: The job dict
+        """
+        if nnodes < 1:
+            raise Exception(f'A pipeline needs at least 1 node, not {nnodes}')
+        with self.edit() as queue:
+            job = {
+                'id': queue['next_id'],
+                'pipeline': pipeline_id,
+                'path': path,
+                'nnodes': nnodes,
+                'time': runtime,
+                'state': 'queued',
+                'start': None,
+                'end': None,
+                'exit_code': None,
+                'hosts': None,
+                'log': None,
+            }
+            queue['next_id'] += 1
+            queue['jobs'].append(job)
+        return job
+
+    def remove(self, job_id):
+        """
+        Remove a job which is not running
+
+        :param job_id: The id of the job
+        :return: None
+        """
+        with self.edit() as queue:
+            jobs = [job for job in queue['jobs'] if job['id'] == job_id]
+            if len(jobs) == 0:
+                raise Exception(f'There is no job {job_id} in the queue')
+            if jobs[0]['state'] == 'running':
+                raise Exception(f'Job {job_id} is running')
+            queue['jobs'].remove(jobs[0])
+
+    def clear(self, everything=False):
+        """
+        Remove the jobs which finished
+
+        :param everything: Also remove the jobs which are queued
+        :return: None
+        """
+        keep = ['running'] if everything else ['queued', 'running']
+        with self.edit() as queue:
+            queue['jobs'] = [job for job in queue['jobs']
+                             if job['state'] in keep]
+
+    def run(self, hosts, target, poll=1):
+        """
+        Run the queued jobs until none are left. Each job runs in a
+        forked process, with its stdout and stderr in its log, on its own
+        subset of the hosts. A job which fails does not stop the others.
+        Jobs may be added to the queue while it runs.
+
+        :param hosts: The hosts of the allocation
+        :param target: Runs a job in the forked process. Called with the
+        job and the path of its hostfile; returns the exit code.
+        :param poll: Seconds between checks for new jobs
+        :return: A summary of the run (dict)
+        """
+        hosts = list(hosts)
+        os.makedirs(self.log_dir, exist_ok=True)
+        ctx = multiprocessing.get_context('fork')
+        # One runner at a time
+        with FileLock(self.run_lock_path, timeout=0):
+            with self.edit() as queue:
+                # Jobs left running by a runner which died start over
+                for job in queue['jobs']:
+                    if job['state'] == 'running':
+                        job['state'] = 'queued'
+            free = list(range(len(hosts)))
+            running = {}
+            begin = time.time()
+            busy = 0
+            ran = []
+            while True:
+                with self.edit() as queue:
+                    now = time.time()
+                    pending = self._pending(queue['jobs'], running, hosts)
+                    for job in backfill(pending, [job for job, _, _ in
+                                                  running.values()],
+                                        len(free), now):
+                        job_hosts = free[:job['nnodes']]
+                        free = free[job['nnodes']:]
+                        running[job['id']] = (
+                            job, job_hosts,
+                            self._start(ctx, target, job,
+                                        [hosts[i] for i in job_hosts], now))
+                if len(running) == 0:
+                    break
+                multiprocessing.connection.wait(
+                    [proc.sentinel for _, _, proc in running.values()],
+                    timeout=poll)
+                done = [job_id for job_id, (_, _, proc) in running.items()
+                        if not proc.is_alive()]
+                if len(done) == 0:
+                    continue
+                with self.edit() as queue:
+                    now = time.time()
+                    jobs = {job['id']: job for job in queue['jobs']}
+                    for job_id in done:
+                        job, job_hosts, proc = running.pop(job_id)
+                        proc.join()
+                        job['end'] = now
+                        job['exit_code'] = proc.exitcode
+                        job['state'] = 'done' if proc.exitcode == 0 \
+                            else 'failed'
+                        if job_id in jobs:
+                            jobs[job_id].update(job)
+                        free = sorted(free + job_hosts)
+                        busy += job['nnodes'] * (job['end'] - job['start'])
+                        ran.append(job)
+                        print(f'[QUEUE] Job {job_id} ({job["pipeline"]}) '
+                              f'{job["state"]} with exit code '
+                              f'{job["exit_code"]} after '
+                              f'{job["end"] - job["start"]:.1f}s')
+            makespan = time.time() - begin
+            summary = {
+                'jobs': len(ran),
+                'failed': sum(job['state'] == 'failed' for job in ran),
+                'nnodes': len(hosts),
+                'makespan': makespan,
+                'node_seconds': busy,
+                'utilization': (busy / (len(hosts) * makespan)
+                                if len(hosts) and makespan > 0 else 0),
+            }
+            with self.edit() as queue:
+                queue['last_run'] = summary
+            print(self.describe_run(summary))
+            return summary
+
+    def _pending(self, jobs, running, hosts):
+        """
+        The queued jobs which may start: jobs which need more nodes than
+        there are fail, and a pipeline only runs once at a time.
+        """
+        pipelines = {job['pipeline'] for job, _, _ in running.values()}
+        pending = []
+        for job in jobs:
+            if job['state'] != 'queued':
+                continue
+            if job['nnodes'] > len(hosts):
+                job['state'] = 'failed'
+                job['error'] = (f'Needs {job["nnodes"]} nodes, '
+                                f'but there are {len(hosts)}')
+                print(f'[QUEUE] Job {job["id"]} ({job["pipeline"]}) failed: '
+                      f'{job["error"]}')
+                continue
+            if job['pipeline'] in pipelines:
+                continue
+            pending.append(job)
+        return pending
+
+    def _start(self, ctx, target, job, job_hosts, now):
+        """
+        Start a job in a forked process
+
+        :return: multiprocessing.Process
+        """
+        hostfile_path = os.path.join(self.log_dir, f'{job["id"]}.hostfile')
+        with open(hostfile_path, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(job_hosts) + '\n')
+        job['state'] = 'running'
+        job['start'] = now
+        job['end'] = None
+        job['exit_code'] = None
+        job['hosts'] = job_hosts
+        job['log'] = os.path.join(self.log_dir, f'{job["id"]}.log')
+        proc = ctx.Process(target=self._run_job,
+                           args=(target, dict(job), hostfile_path))
+        proc.start()
+        print(f'[QUEUE] Started job {job["id"]} ({job["pipeline"]}) on '
+              f'{len(job_hosts)} nodes: {", ".join(job_hosts)}')
+        return proc
+
+    @staticmethod
+    def _run_job(target, job, hostfile_path):
+        fd = os.open(job['log'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+        sys.exit(target(job, hostfile_path) or 0)
+
+    @staticmethod
+    def describe_run(summary):
+        """
+        Describe how well a run used the allocation
+
+        :param summary: The summary returned by run
+        :return: str
+        """
+        return (f'[QUEUE] Ran {summary["jobs"]} pipelines '
+                f'({summary["failed"]} failed) on {summary["nnodes"]} '
+                f'nodes in {summary["makespan"]:.1f}s. Node utilization: '
+                f'{summary["utilization"]:.1%}')
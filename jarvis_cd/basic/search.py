@@ -0,0 +1,386 @@
+"""
+This module contains the search strategies of the pipeline iterator. A
+strategy chooses which points of a sweep to run. A point is a tuple with
+one position per loop group of the iterator, i.e., an index into the
+values of each group of zipped vars. Strategies which optimize a metric
+are told the score of each point after it runs (see report).
+
+The strategy is selected by the search section of an iterator YAML:
+
+search:
+  strategy: halving   # random, lhs, or halving (default: the full grid)
+  metric: ior.runtime # A column of the stats (e.g., from _get_stat)
+  goal: min           # min or max
+  samples: 16         # The number of points to sample
+  patience: 8         # Stop after this many points without improvement
+  tol: 0.01           # The relative improvement which counts
+  seed: 0
+  eta: 2              # halving: keep 1/eta of the points at each rung
+
+It also contains the statistics used to decide how often to repeat a
+point (see relative_ci).
+"""
+
+from abc import ABC, abstractmethod
+from statistics import NormalDist, mean, stdev
+import math
+import random
+
+
+class SearchStrategy(ABC):
+    """
+    Chooses the points of a sweep. Subclasses implement propose, which
+    is called until it returns None.
+    """
+
+    def __init__(self, dims, config, repeat=1):
+        """
+        Initialize the strategy
+
+        :param dims: The number of values of each loop group
+        :param config: The search section of the iterator
+        :param repeat: The repetitions of each point
+        """
+        self.dims = list(dims)
+        self.metric = config.get('metric')
+        self.goal = config.get('goal', 'min')
+        if self.goal not in ['min', 'max']:
+            raise Exception(f'The search goal must be min or max, '
+                            f'not {self.goal}')
+        self.samples = min(int(config.get('samples', 16)), self.space_size())
+        self.patience = config.get('patience')
+        self.tol = float(config.get('tol', 0))
+        self.repeat = repeat
+        self.rng = random.Random(config.get('seed'))
+        # The score of each point which ran
+        self.scores = {}
+        # The best point so far
+        self.best = None
+        # The number of points reported since the best point was found
+        self.since_best = 0
+
+    def space_size(self):
+        return math.prod(self.dims)
+
+    def is_better(self, score, than):
+        """
+        Whether a score improves on another by more than tol
+
+        :param score: A score
+        :param than: The score to compare with, or None
+        :return: bool
+        """
+        if than is None:
+            return True
+        margin = self.tol * abs(than)
+        if self.goal == 'min':
+            return score < than - margin
+        return score > than + margin
+
+    def report(self, point, score):
+        """
+        Record the score of a point which ran
+
+        :param point: The point
+        :param score: The mean of the metric over its runs, or None
+        :return: None
+        """
+        if score is None:
+            return
+        self.scores[point] = score
+        best_score = self.scores.get(self.best)
+        if self.best is None or self.is_better(score, best_score):
+            self.best = point
+            self.since_best = 0
+        else:
+            self.since_best += 1
+
+    def converged(self):
+        """
+        Whether the search stopped improving
+
+        :return: bool
+        """
+        return self.patience is not None and self.since_best >= self.patience
+
+    def next(self):
+        """
+        Get the next point to run
+
+        :return: A point, or None if the search is over
+        """
+        if self.converged():
+            return None
+        return self.propose()
+
+    @abstractmethod
+    def propose(self):
+        """
+        Choose the next point of the search
+
+        :return: A point, or None if there are no more
+        """
+        pass
+
+    def get_repeat(self, point):
+        """
+        The number of repetitions of a point
+
+        :param point: The point
+        :return: int
+        """
+        return self.repeat
+
+    def max_points(self):
+        """
+        The maximum number of points the search runs
+
+        :return: int
+        """
+        return self.samples
+
+
+class RandomSearch(SearchStrategy):
+    """
+    Run points chosen uniformly at random, without repeating any
+    """
+
+    def __init__(self, dims, config, repeat=1):
+        super().__init__(dims, config, repeat)
+        self.seen = set()
+
+    def propose(self):
+        if len(self.seen) >= self.samples:
+            return None
+        while True:
+            point = tuple(self.rng.randrange(dim) for dim in self.dims)
+            if point not in self.seen:
+                self.seen.add(point)
+                return point
+
+
+def latin_hypercube(dims, samples, rng):
+    """
+    Choose points which cover the range of every loop group evenly: each
+    group is split into samples strata, and each stratum is used once.
+
+    :param dims: The number of values of each loop group
+    :param samples: The number of points
+    :param rng: A random.Random
+    :return: A list of unique points
+    """
+    columns = []
+    for dim in dims:
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        columns.append([int((stratum + rng.random()) * dim / samples)
+                        for stratum in strata])
+    return list(dict.fromkeys(zip(*columns)))
+
+
+class LatinHypercube(SearchStrategy):
+    """
+    Run a Latin hypercube sample of the points
+    """
+
+    def __init__(self, dims, config, repeat=1):
+        super().__init__(dims, config, repeat)
+        self.points = latin_hypercube(self.dims, self.samples, self.rng)
+        self.num_points = len(self.points)
+
+    def propose(self):
+        if len(self.points) == 0:
+            return None
+        return self.points.pop(0)
+
+    def max_points(self):
+        return self.num_points
+
+
+class SuccessiveHalving(SearchStrategy):
+    """
+    Successive halving, with a Latin hypercube sample as the first rung.
+    After each rung, the best 1/eta of the points continue to the next
+    rung, which runs each point eta times more often. Half of the slots
+    of the next rung go to unexplored neighbors of the survivors which a
+    surrogate model (inverse distance weighting of the scores so far)
+    predicts to be best. The search ends after a rung of one point.
+    """
+
+    def __init__(self, dims, config, repeat=1):
+        super().__init__(dims, config, repeat)
+        self.eta = int(config.get('eta', 2))
+        if self.eta < 2:
+            raise Exception('The halving eta must be at least 2')
+        self.rung = latin_hypercube(self.dims, self.samples, self.rng)
+        self.queue = list(self.rung)
+        self.rung_repeat = repeat
+        self.repeats = {}
+        self.num_points = 0
+        size = len(self.rung)
+        while size > 1:
+            self.num_points += size
+            size = math.ceil(size / self.eta)
+        self.num_points += size
+
+    def predict(self, point):
+        """
+        Predict the score of a point from the scores so far
+
+        :param point: The point
+        :return: float
+        """
+        weights = 0
+        total = 0
+        for seen, score in self.scores.items():
+            dist = sum(((a - b) / max(dim - 1, 1)) ** 2
+                       for a, b, dim in zip(point, seen, self.dims))
+            if dist == 0:
+                return score
+            weights += 1 / dist
+            total += score / dist
+        return total / weights
+
+    def neighbors(self, point):
+        for i, dim in enumerate(self.dims):
+            for step in [-1, 1]:
+                pos = point[i] + step
+                if 0 <= pos < dim:
+                    yield point[:i] + (pos,) + point[i + 1:]
+
+    def next_rung(self):
+        """
+        Choose the points of the next rung
+
+        :return: List of points
+        """
+        scored = [point for point in self.rung if point in self.scores]
+        ranked = sorted(scored, key=lambda point: self.scores[point],
+                        reverse=self.goal == 'max')
+        size = math.ceil(len(self.rung) / self.eta)
+        survivors = ranked[:size - size // 2]
+        candidates = {neighbor for point in survivors
+                      for neighbor in self.neighbors(point)
+                      if neighbor not in self.scores}
+        if len(self.scores):
+            candidates = sorted(candidates, key=self.predict,
+                                reverse=self.goal == 'max')
+        else:
+            candidates = sorted(candidates)
+        rung = survivors + candidates[:size // 2]
+        # Fill up with the next best points if there are few neighbors
+        rung += [point for point in ranked if point not in rung]
+        return rung[:size]
+
+    def propose(self):
+        if len(self.queue) == 0:
+            if len(self.rung) <= 1:
+                return None
+            self.rung = self.next_rung()
+            if len(self.rung) == 0:
+                return None
+            self.rung_repeat *= self.eta
+            self.queue = list(self.rung)
+        point = self.queue.pop(0)
+        self.repeats[point] = self.rung_repeat
+        return point
+
+    def get_repeat(self, point):
+        return self.repeats.get(point, self.repeat)
+
+    def max_points(self):
+        return self.num_points
+
+
+def count_changes(dims, gray=False):
+    """
+    The number of times each loop group changes value while the full
+    grid is run, with the first group changing slowest. In the default
+    order, a group changes whenever the groups after it wrap around. In
+    a reflected Gray code, the groups after it reverse direction
+    instead, so exactly one group changes between consecutive points.
+
+    :param dims: The number of values of each loop group
+    :param gray: Whether the grid is run as a reflected Gray code
+    :return: List of int
+    """
+    total = math.prod(dims)
+    changes = []
+    for i, dim in enumerate(dims):
+        if dim <= 1:
+            changes.append(0)
+        elif gray:
+            changes.append(math.prod(dims[:i + 1]) - math.prod(dims[:i]))
+        else:
+            changes.append(total // math.prod(dims[i + 1:]) - 1)
+    return changes
+
+
+def t_quantile(p, df):
+    """
+    The p quantile of Student's t distribution. Exact for 1 and 2
+    degrees of freedom; otherwise, the Cornish-Fisher expansion around
+    the normal distribution, which is within 1% for 3 or more.
+
+    :param p: The probability
+    :param df: The degrees of freedom
+    :return: float
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) +
+            (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2) +
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) /
+            (384 * df ** 3) +
+            (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 -
+             945 * z) / (92160 * df ** 4))
+
+
+def relative_ci(values, confidence=0.95):
+    """
+    The half-width of the confidence interval of the mean of some
+    values, relative to the mean
+
+    :param values: The values (at least 2)
+    :param confidence: The confidence level of the interval
+    :return: float (inf if there are fewer than 2 values)
+    """
+    if len(values) < 2:
+        return math.inf
+    half = (t_quantile(1 - (1 - confidence) / 2, len(values) - 1) *
+            stdev(values) / math.sqrt(len(values)))
+    center = abs(mean(values))
+    if center == 0:
+        return 0 if half == 0 else math.inf
+    return half / center
+
+
+STRATEGIES = {
+    'random': RandomSearch,
+    'lhs': LatinHypercube,
+    'halving': SuccessiveHalving,
+}
+
+
+def get_strategy(config, dims, repeat=1):
+    """
+    Construct the strategy selected by the search section of an iterator
+
+    :param config: The search section of the iterator
+    :param dims: The number of values of each loop group
+    :param repeat: The repetitions of each point
+    :return: SearchStrategy, or None for the full grid
+    """
+    name = config.get('strategy', 'grid')
+    if name == 'grid':
+        return None
+    if name not in STRATEGIES:
+        raise Exception(f'Unknown search strategy: {name}. '
+                        f'Choose from: grid, {", ".join(STRATEGIES)}')
+    strategy = STRATEGIES[name](dims, config, repeat)
+    if strategy.metric is None and name == 'halving':
+        raise Exception('The halving search needs a metric to optimize')
+    return strategy
@@ -0,0 +1,465 @@
+"""
+This module contains the backends which persist the configuration of a
+pipeline and its pkgs. A pipeline is stored through exactly one backend,
+selected by STATE_BACKEND in the jarvis configuration.
+"""
+
+from abc import ABC, abstractmethod
+from jarvis_util.serialize.yaml_file import YamlFile
+from jarvis_cd.basic.file_lock import FileLock
+import hashlib
+import json
+import os
+
+
+class StateStore(ABC):
+    """
+    The state of a single pipeline: the config of every pkg (keyed by
+    global_id) and the environment of the pipeline. Changes are staged
+    in memory and written to the filesystem by commit().
+    """
+    # Bytes written by all stores in this process
+    total_bytes_written = 0
+
+    def __init__(self, base_dir, pipeline_id):
+        """
+        Initialize the store
+
+        :param base_dir: The jarvis CONFIG_DIR
+        :param pipeline_id: The id of the pipeline
+        """
+        self.base_dir = base_dir
+        self.pipeline_id = pipeline_id
+        self.pipeline_dir = os.path.join(base_dir, pipeline_id)
+        self.lock_path = os.path.join(base_dir, '.locks',
+                                      f'{pipeline_id}.lock')
+        self.configs = {}
+        self.env = None
+        # The serialized form of each config and the env, if known
+        self.blobs = {}
+        self.env_blob = None
+        self.dirty = set()
+        self.removed = set()
+        self.env_dirty = False
+        self.loaded = False
+        self.bytes_written = 0
+        # While held, commit() only keeps changes in memory (see release)
+        self.held = False
+        # The file_stamp() of the state when it was last read or written
+        self.stamp = None
+
+    @staticmethod
+    def dumps(data):
+        """
+        Serialize a config or env. The result is used both to detect
+        changes and as the bytes written by the snapshot backend.
+
+        :param data: A config or env dict
+        :return: str
+        """
+        return json.dumps(data, separators=(',', ':'))
+
+    @staticmethod
+    def digest(blob):
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+    def config_hash(self, global_id):
+        """
+        The content hash of the last config staged or read for a pkg
+
+        :param global_id: The global id of the pkg
+        :return: str or None
+        """
+        if global_id not in self.configs:
+            return None
+        if self.blobs.get(global_id) is None:
+            self.blobs[global_id] = self.dumps(self.configs[global_id])
+        return self.digest(self.blobs[global_id])
+
+    def env_hash(self):
+        """
+        The content hash of the last env staged or read
+
+        :return: str or None
+        """
+        if self.env is None:
+            return None
+        if self.env_blob is None:
+            self.env_blob = self.dumps(self.env)
+        return self.digest(self.env_blob)
+
+    def file_stamp(self):
+        """
+        Identify the version of the state on disk, so that a cached store
+        can tell whether another process changed the pipeline.
+
+        :return: A comparable stamp, or None if this backend has none
+        """
+        return None
+
+    def _count_written(self, nbytes):
+        self.bytes_written += nbytes
+        StateStore.total_bytes_written += nbytes
+
+    def load(self):
+        """
+        Read the pipeline state. If this backend has no state for the
+        pipeline, but another backend does, the state is migrated.
+
+        :return: self
+        """
+        if self.loaded:
+            return self
+        self.loaded = True
+        with FileLock(self.lock_path, shared=True):
+            if self._read():
+                return self
+        for backend in STATE_BACKENDS.values():
+            if isinstance(self, backend):
+                continue
+            other = backend(self.base_dir, self.pipeline_id)
+            with FileLock(self.lock_path, shared=True):
+                found = other._read()
+            if not found:
+                continue
+            self.configs = other.configs
+            self.env = other.env
+            self.dirty = set(self.configs)
+            self.env_dirty = self.env is not None
+            self.commit()
+            other._drop()
+            break
+        return self
+
+    def exists(self, global_id):
+        return self.get_config(global_id) is not None
+
+    def get_config(self, global_id):
+        """
+        Get the config of a pkg
+
+        :param global_id: The global id of the pkg
+        :return: dict or None
+        """
+        self.load()
+        return self.configs.get(global_id)
+
+    def put_config(self, global_id, config, blob=None):
+        """
+        Stage the config of a pkg to be written on commit
+
+        :param global_id: The global id of the pkg
+        :param config: The config dict
+        :param blob: The config already serialized with dumps()
+        :return: None
+        """
+        self.load()
+        self.configs[global_id] = config
+        self.blobs[global_id] = blob
+        self.dirty.add(global_id)
+        self.removed.discard(global_id)
+
+    def remove(self, global_id):
+        """
+        Stage the removal of a pkg and all of its sub-pkgs
+
+        :param global_id: The global id of the pkg
+        :return: None
+        """
+        self.load()
+        prefix = f'{global_id}.'
+        for key in list(self.configs.keys()):
+            if key == global_id or key.startswith(prefix):
+                del self.configs[key]
+                self.blobs.pop(key, None)
+                self.dirty.discard(key)
+                self.removed.add(key)
+
+    def get_env(self):
+        self.load()
+        return self.env
+
+    def put_env(self, env, blob=None):
+        """
+        Stage the environment of the pipeline to be written on commit
+
+        :param env: The environment dict
+        :param blob: The env already serialized with dumps()
+        :return: None
+        """
+        self.load()
+        self.env = env
+        self.env_blob = blob
+        self.env_dirty = True
+
+    def commit(self):
+        """
+        Write all staged changes
+
+        :return: None
+        """
+        if self.held:
+            return
+        if not self.dirty and not self.removed and not self.env_dirty:
+            return
+        with FileLock(self.lock_path):
+            stamp = self.file_stamp()
+            if stamp is not None and stamp != self.stamp:
+                self._merge()
+            self._write()
+        self.dirty.clear()
+        self.removed.clear()
+        self.env_dirty = False
+
+    def _merge(self):
+        """
+        Another process committed since this store was read. Take its
+        version of every pkg (and the env) which this store did not
+        change, so that neither process loses its updates. Must hold
+        the lock of the pipeline.
+
+        :return: None
+        """
+        other = type(self)(self.base_dir, self.pipeline_id)
+        other._read()
+        for global_id in list(self.configs.keys()):
+            if global_id not in other.configs and \
+                    global_id not in self.dirty:
+                # Removed by the other process
+                del self.configs[global_id]
+                self.blobs.pop(global_id, None)
+        for global_id, config in other.configs.items():
+            if global_id in self.dirty or global_id in self.removed:
+                continue
+            self.configs[global_id] = config
+            self.blobs[global_id] = other.blobs.get(global_id)
+        if not self.env_dirty:
+            self.env = other.env
+            self.env_blob = other.env_blob
+        self.stamp = other.stamp
+
+    def hold(self):
+        """
+        Defer writes until release(), e.g., while running a batch of
+        commands against the same pipeline.
+
+        :return: self
+        """
+        self.held = True
+        return self
+
+    def release(self):
+        """
+        Stop deferring writes and write everything committed while held
+
+        :return: None
+        """
+        self.held = False
+        self.commit()
+
+    def drop(self):
+        """
+        Forget the in-memory state, e.g., after the pipeline directory
+        was destroyed.
+
+        :return: None
+        """
+        self.configs = {}
+        self.env = None
+        self.blobs = {}
+        self.env_blob = None
+        self.dirty.clear()
+        self.removed.clear()
+        self.env_dirty = False
+        self.loaded = False
+
+    @abstractmethod
+    def _read(self):
+        """
+        Read the state of the pipeline into self.configs and self.env
+
+        :return: True if the pipeline exists in this backend
+        """
+        pass
+
+    @abstractmethod
+    def _write(self):
+        """
+        Persist the staged changes
+
+        :return: None
+        """
+        pass
+
+    @abstractmethod
+    def _drop(self):
+        """
+        Delete the files of this backend, e.g., after a migration
+
+        :return: None
+        """
+        pass
+
+
+class YamlStateStore(StateStore):
+    """
+    The original layout: one YAML file per pkg
+    (CONFIG_DIR/<relpath>/<pkg_id>.yaml) and env.yaml for the pipeline.
+    """
+
+    def config_path(self, global_id):
+        relpath = global_id.replace('.', '/')
+        pkg_id = global_id.split('.')[-1]
+        return os.path.join(self.base_dir, relpath, f'{pkg_id}.yaml')
+
+    @property
+    def env_path(self):
+        return os.path.join(self.pipeline_dir, 'env.yaml')
+
+    def _read_pkg(self, global_id):
+        path = self.config_path(global_id)
+        if not os.path.exists(path):
+            return None
+        config = YamlFile(path).load()
+        self.configs[global_id] = config
+        for sub_pkg_type, sub_pkg_id in config.get('sub_pkgs', []):
+            self._read_pkg(f'{global_id}.{sub_pkg_id}')
+        return config
+
+    def get_config(self, global_id):
+        config = super().get_config(global_id)
+        if config is None and global_id not in self.removed:
+            # Unlinked pkgs are not reachable from the pipeline
+            config = self._read_pkg(global_id)
+        return config
+
+    def _read(self):
+        if os.path.exists(self.env_path):
+            self.env = YamlFile(self.env_path).load()
+        return self._read_pkg(self.pipeline_id) is not None
+
+    def _write(self):
+        for global_id in self.removed:
+            path = self.config_path(global_id)
+            if os.path.exists(path):
+                os.remove(path)
+        for global_id in self.dirty:
+            path = self.config_path(global_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            YamlFile(path).save(self.configs[global_id])
+            self._count_written(os.path.getsize(path))
+        if self.env_dirty:
+            os.makedirs(self.pipeline_dir, exist_ok=True)
+            YamlFile(self.env_path).save(self.env)
+            self._count_written(os.path.getsize(self.env_path))
+
+    def _drop(self):
+        for global_id in self.configs:
+            path = self.config_path(global_id)
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.env_path):
+            os.remove(self.env_path)
+
+
+class SnapshotStateStore(StateStore):
+    """
+    The whole pipeline in a single file
+    (CONFIG_DIR/<pipeline_id>/pipeline.json). Each line is a JSON array:
+    ["version", 1], then ["env", env], then one ["pkg", global_id, config]
+    per pkg. Lines of unchanged pkgs are reused verbatim on commit.
+
+    Commits write a temporary file, fsync it, and rename it over the
+    snapshot, so a reader sees either the old or the new pipeline,
+    never a mix.
+    """
+    VERSION = 1
+
+    @property
+    def path(self):
+        return os.path.join(self.pipeline_dir, 'pipeline.json')
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # Every commit replaces the file, so the inode changes too
+        return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+    def _read(self):
+        self.stamp = self.file_stamp()
+        if self.stamp is None:
+            return False
+        with open(self.path, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                line = line.rstrip('\n')
+                entry = json.loads(line)
+                if entry[0] == 'env':
+                    self.env = entry[1]
+                    self.env_blob = self._raw_blob(line, '["env",')
+                elif entry[0] == 'pkg':
+                    prefix = f'["pkg",{json.dumps(entry[1])},'
+                    self.configs[entry[1]] = entry[2]
+                    self.blobs[entry[1]] = self._raw_blob(line, prefix)
+        return True
+
+    @staticmethod
+    def _raw_blob(line, prefix):
+        """
+        Recover the serialized value from a line this backend wrote,
+        so that unchanged values are never serialized again.
+
+        :return: str or None
+        """
+        if line.startswith(prefix) and line.endswith(']'):
+            return line[len(prefix):-1]
+        return None
+
+    def _blob(self, global_id):
+        if self.blobs.get(global_id) is None:
+            self.blobs[global_id] = self.dumps(self.configs[global_id])
+        return self.blobs[global_id]
+
+    def _write(self):
+        os.makedirs(self.pipeline_dir, exist_ok=True)
+        if self.env_blob is None:
+            self.env_blob = self.dumps(self.env)
+        lines = [f'["version",{self.VERSION}]',
+                 f'["env",{self.env_blob}]']
+        for global_id in self.configs:
+            lines.append(f'["pkg",{json.dumps(global_id)},'
+                         f'{self._blob(global_id)}]')
+        text = '\n'.join(lines) + '\n'
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(text)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.path)
+        self.stamp = self.file_stamp()
+        self._count_written(len(text))
+
+    def _drop(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+STATE_BACKENDS = {
+    'snapshot': SnapshotStateStore,
+    'yaml': YamlStateStore,
+}
+
+
+def open_state_store(backend, base_dir, pipeline_id):
+    """
+    Construct the state store of a pipeline
+
+    :param backend: The name of the backend (see STATE_BACKENDS)
+    :param base_dir: The jarvis CONFIG_DIR
+    :param pipeline_id: The id of the pipeline
+    :return: StateStore
+    """
+    if backend not in STATE_BACKENDS:
+        raise Exception(f'Unknown state backend: {backend}')
+    return STATE_BACKENDS[backend](base_dir, pipeline_id)
@@ -0,0 +1,238 @@
+"""
+This module contains the stats sink of the pipeline iterator. Each run of
+a sweep is appended to a JSON lines file as soon as it finishes, so the
+results survive crashes, memory use does not grow with the sweep, and
+progress can be followed while the sweep runs. Each line is:
+
+{"conf": {<sweep parameters>}, "rep": <repetition>, "stats": {<stat_dict>}}
+
+Warm-up runs are marked with "warmup": true, and are left out of the
+stats. Sweeps with adaptive repetitions also record a summary of each
+point once its repetitions are done, which is added to the stats of each
+run of the point:
+
+{"conf": {<sweep parameters>}, "point": {<summary>}}
+"""
+
+import csv
+import json
+import os
+import shutil
+import time
+
+
+class StatsSink:
+    """
+    An append-only record of the runs of a sweep
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the sink
+
+        :param path: The path of the JSON lines file
+        """
+        self.path = path
+
+    @staticmethod
+    def conf_key(conf):
+        """
+        Identify a point by its sweep parameters
+
+        :param conf: The sweep parameters
+        :return: str
+        """
+        return json.dumps(conf, sort_keys=True, default=str)
+
+    @staticmethod
+    def is_run(record):
+        """
+        Whether a record is a run which counts in the stats, rather than
+        a warm-up run or the summary of a point
+
+        :param record: A record
+        :return: bool
+        """
+        return 'stats' in record and not record.get('warmup', False)
+
+    def append(self, conf, rep, stats, warmup=False):
+        """
+        Durably record a run
+
+        :param conf: The sweep parameters of the run
+        :param rep: The repetition of the run
+        :param stats: The stat_dict of the run
+        :param warmup: Whether the run is a warm-up run
+        :return: None
+        """
+        record = {'conf': conf, 'rep': rep, 'stats': stats}
+        if warmup:
+            record['warmup'] = True
+        self._write(record)
+
+    def append_point(self, conf, summary):
+        """
+        Durably record the summary of a point (e.g., its repetitions)
+
+        :param conf: The sweep parameters of the point
+        :param summary: A dict of stats
+        :return: None
+        """
+        self._write({'conf': conf, 'point': summary})
+
+    def _write(self, record):
+        line = json.dumps(record, default=str)
+        with open(self.path, 'a', encoding='utf-8') as fp:
+            fp.write(line + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def merge(self, other):
+        """
+        Move the records of another sink to the end of this one
+
+        :param other: A StatsSink
+        :return: None
+        """
+        if not os.path.exists(other.path):
+            return
+        other.repair()
+        self.repair()
+        with open(other.path, 'rb') as src, open(self.path, 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        other.clear()
+
+    def clear(self):
+        """
+        Remove every record
+
+        :return: None
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def repair(self):
+        """
+        Remove the last line if it is partial, which happens if jarvis
+        died while writing it. Otherwise, the next record would be
+        appended to the partial line.
+
+        :return: None
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as fp:
+            end = fp.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(pos - 4096, 0)
+                fp.seek(start)
+                chunk = fp.read(pos - start)
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos != end:
+                fp.truncate(pos)
+
+    def read(self, offset=0):
+        """
+        Read the complete records after an offset
+
+        :param offset: The byte offset to start reading at
+        :return: A tuple of (list of records, the offset after them)
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records, offset
+        with open(self.path, 'rb') as fp:
+            fp.seek(offset)
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                records.append(json.loads(line))
+        return records, offset
+
+    def records(self):
+        """
+        Iterate over the records without loading the whole file
+
+        :return: Generator of dicts
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as fp:
+            for line in fp:
+                if not line.endswith(b'\n'):
+                    return
+                yield json.loads(line)
+
+    def points(self):
+        """
+        The latest summary of each point
+
+        :return: A dict of summaries, keyed by conf_key
+        """
+        return {self.conf_key(record['conf']): record['point']
+                for record in self.records() if 'point' in record}
+
+    def __iter__(self):
+        """
+        Iterate over the stat_dict of each run, with the summary of its
+        point
+
+        :return: Generator of dicts
+        """
+        points = self.points()
+        for record in self.records():
+            if self.is_run(record):
+                yield {**record['stats'],
+                       **points.get(self.conf_key(record['conf']), {})}
+
+    def columns(self):
+        """
+        The columns of the stats, in the order they first appeared
+
+        :return: List of str
+        """
+        columns = {}
+        for stats in self:
+            for key in stats:
+                columns.setdefault(key, None)
+        return list(columns)
+
+    def to_csv(self, path):
+        """
+        Write the stats as a CSV file, one row at a time
+
+        :param path: The path of the CSV file
+        :return: None
+        """
+        columns = self.columns()
+        with open(path, 'w', encoding='utf-8', newline='') as fp:
+            writer = csv.DictWriter(fp, fieldnames=columns)
+            writer.writeheader()
+            for stats in self:
+                writer.writerow(stats)
+
+    def follow(self, poll=1):
+        """
+        Iterate over the records, waiting for new records once every
+        record was read. Stops on KeyboardInterrupt.
+
+        :param poll: Seconds to wait before checking for new records
+        :return: Generator of dicts
+        """
+        offset = 0
+        try:
+            while True:
+                records, offset = self.read(offset)
+                yield from records
+                if len(records) == 0:
+                    time.sleep(poll)
+        except KeyboardInterrupt:
+            return
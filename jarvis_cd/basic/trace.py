@@ -0,0 +1,271 @@
+"""
+This module records where a pipeline spends its time. Every phase of
+every pkg, every Exec, and every point of a sweep is recorded as a span.
+Traces are saved in the Chrome Trace Event format, which can be opened
+in Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+
+Tracing is off unless JARVIS_TRACE=1 is set, since it writes a file for
+every command.
+"""
+
+from contextlib import contextmanager
+import functools
+import json
+import os
+import threading
+import time
+
+# Whether pipeline commands are traced
+TRACE = os.getenv('JARVIS_TRACE', '0') not in ['', '0']
+# The most events kept in memory until they are written (see flush)
+MAX_EVENTS = int(os.getenv('JARVIS_TRACE_MAX_EVENTS', 100000))
+
+
+class Tracer:
+    """
+    Records spans in the Chrome Trace Event format. Timestamps come from
+    the monotonic clock, so they are not affected by changes to the
+    system time.
+    """
+    # The tracers which record the Execs of this process (innermost last)
+    active = []
+    # Exec.__init__ before hook_execs replaced it
+    exec_init = None
+
+    def __init__(self, enabled=None):
+        """
+        Initialize the tracer
+
+        :param enabled: Whether to record anything (default: JARVIS_TRACE)
+        """
+        self.enabled = TRACE if enabled is None else enabled
+        self.events = []
+        # Events not recorded because MAX_EVENTS were in memory
+        self.dropped = 0
+        self.pid = os.getpid()
+        # Threads which were already given a name in the trace
+        self.tids = set()
+        self.lock = threading.Lock()
+        # The number of activate() blocks this tracer is in
+        self.depth = 0
+        # Where the trace is saved. None means the default of the caller.
+        self.path = None
+        # The file flush appends to
+        self.flush_path = None
+
+    @staticmethod
+    def now():
+        """
+        The current time in microseconds (the unit of the trace format)
+
+        :return: float
+        """
+        return time.monotonic_ns() / 1000
+
+    def _add(self, event):
+        if not self.enabled:
+            return
+        tid = threading.get_ident()
+        event['pid'] = self.pid
+        event['tid'] = tid
+        with self.lock:
+            if len(self.events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+            if tid not in self.tids:
+                self.tids.add(tid)
+                self.events.append({
+                    'ph': 'M', 'name': 'thread_name',
+                    'pid': self.pid, 'tid': tid,
+                    'args': {'name': threading.current_thread().name}
+                })
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat='phase', **args):
+        """
+        Record the time spent in a with block
+
+        :param name: The name of the span
+        :param cat: The category of the span (e.g., start, exec, sweep)
+        :param args: Details shown with the span
+        :return: None
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self.now()
+        try:
+            yield
+        except BaseException as e:
+            args['error'] = repr(e)
+            raise
+        finally:
+            self._add({'ph': 'X', 'name': name, 'cat': cat,
+                       'ts': start, 'dur': self.now() - start,
+                       'args': args})
+
+    def instant(self, name, cat='phase', **args):
+        """
+        Record an event without a duration
+
+        :param name: The name of the event
+        :param cat: The category of the event
+        :param args: Details shown with the event
+        :return: None
+        """
+        self._add({'ph': 'i', 's': 't', 'name': name, 'cat': cat,
+                   'ts': self.now(), 'args': args})
+
+    def counter(self, name, cat='metric', **values):
+        """
+        Record the value of one or more numeric metrics
+
+        :param name: The name of the counter
+        :param cat: The category of the counter
+        :param values: The values of the counter
+        :return: None
+        """
+        self._add({'ph': 'C', 'name': name, 'cat': cat,
+                   'ts': self.now(), 'args': values})
+
+    @contextmanager
+    def activate(self):
+        """
+        Record the Execs started in a with block in this tracer. Exec is
+        only hooked while a tracer is active.
+
+        :return: None
+        """
+        if self.enabled and len(Tracer.active) == 0:
+            self.hook_execs()
+        if self.enabled:
+            Tracer.active.append(self)
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.enabled:
+                Tracer.active.remove(self)
+                if len(Tracer.active) == 0:
+                    self.unhook_execs()
+
+    def flush(self, path):
+        """
+        Append the events recorded since the last flush to a trace file,
+        and stop keeping them in memory. The file is in the JSON Array
+        Format, which trace viewers open without its closing bracket, so
+        it can be read while a sweep runs, or after it crashed. Flushing
+        to a different path starts a new file.
+
+        :param path: The path of the trace file
+        :return: None
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            events = self.events
+            dropped = self.dropped
+            self.events = []
+            self.dropped = 0
+        if dropped:
+            events.append({'ph': 'i', 's': 'g', 'name': 'dropped events',
+                           'pid': self.pid, 'tid': 0, 'ts': self.now(),
+                           'args': {'count': dropped}})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        start = path != self.flush_path
+        with open(path, 'w' if start else 'a', encoding='utf-8') as fp:
+            if start:
+                fp.write('[' + json.dumps({
+                    'ph': 'M', 'name': 'process_name', 'pid': self.pid,
+                    'args': {'name': 'jarvis'}}))
+                self.flush_path = path
+            for event in events:
+                fp.write(',\n' + json.dumps(event))
+
+    def save(self, path):
+        """
+        Write the rest of the trace and close the file (see flush)
+
+        :param path: The path of the trace file
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self.flush(path)
+        with open(path, 'a', encoding='utf-8') as fp:
+            fp.write('\n]\n')
+        self.flush_path = None
+
+    @staticmethod
+    def exec_args(cmd, exec_info):
+        """
+        The details of an Exec shown in the trace
+
+        :param cmd: The command (a string or a list of strings)
+        :param exec_info: The ExecInfo of the command
+        :return: A tuple of (span name, dict)
+        """
+        if isinstance(cmd, (list, tuple)):
+            cmd = '; '.join(str(part) for part in cmd)
+        cmd = str(cmd)
+        words = cmd.split()
+        name = os.path.basename(words[0]) if len(words) else 'exec'
+        args = {'cmd': cmd}
+        if exec_info is not None:
+            args['exec_type'] = type(exec_info).__name__
+            args['async'] = bool(getattr(exec_info, 'exec_async', False))
+            hosts = getattr(getattr(exec_info, 'hostfile', None),
+                            'hosts', None)
+            if hosts:
+                args['hosts'] = list(hosts)
+        return name, args
+
+    @staticmethod
+    def hook_execs():
+        """
+        Make every Exec record a span in the innermost active tracer.
+        Asynchronous Execs only record the time spent launching them.
+
+        :return: None
+        """
+        from jarvis_util.shell.exec import Exec
+        init = Exec.__init__
+        if getattr(init, 'traced', False):
+            return
+        Tracer.exec_init = init
+
+        @functools.wraps(init)
+        def traced_init(exec_self, cmd, exec_info=None, *args, **kwargs):
+            if not Tracer.active:
+                return init(exec_self, cmd, exec_info, *args, **kwargs)
+            name, span_args = Tracer.exec_args(cmd, exec_info)
+            with Tracer.active[-1].span(name, 'exec', **span_args):
+                return init(exec_self, cmd, exec_info, *args, **kwargs)
+        traced_init.traced = True
+        Exec.__init__ = traced_init
+
+    @staticmethod
+    def unhook_execs():
+        """
+        Restore the Exec.__init__ replaced by hook_execs
+
+        :return: None
+        """
+        if Tracer.exec_init is None:
+            return
+        from jarvis_util.shell.exec import Exec
+        Exec.__init__ = Tracer.exec_init
+        Tracer.exec_init = None
+
+
+def traced(func):
+    """
+    Trace a pipeline command (see Pipeline.trace_command)
+    """
+    @functools.wraps(func)
+    def wrapper(ppl, *args, **kwargs):
+        with ppl.trace_command(func.__name__):
+            return func(ppl, *args, **kwargs)
+    return wrapper
@@ -51,7 +51,7 @@ class TestCli(TestCase):
         self.assertTrue(os.path.exists(
             f'{self.jarvis.config_dir}/test_pipeline'))
         self.assertTrue(os.path.exists(
-            f'{self.jarvis.config_dir}/test_pipeline/test_pipeline.yaml'))
+            f'{self.jarvis.config_dir}/test_pipeline/pipeline.json'))
         self.jarvis.load()
 
         # Cd into test_pipeline
@@ -0,0 +1,94 @@
+"""
+Test the jarvis daemon protocol
+"""
+from jarvis_cd.basic import daemon
+from unittest import TestCase
+import shutil
+import signal
+import tempfile
+import time
+import sys
+import os
+
+
+class EchoArgs:
+    """
+    Stands in for the jarvis CLI
+    """
+    def __init__(self, argv):
+        self.argv = argv
+
+    def process_args(self):
+        # Write to fd 1 itself: under pytest, sys.stdout is a capture
+        # buffer rather than the stdout the client sent
+        line = f"{' '.join(self.argv)} {os.getenv('JARVIS_TEST_VAR')}\n"
+        os.write(1, line.encode())
+        if self.argv[0] == 'fail':
+            sys.exit(3)
+
+
+class EchoDaemon(daemon.JarvisDaemon):
+    def __init__(self):
+        self.args_cls = EchoArgs
+        self.sock = None
+
+    def refresh(self):
+        pass
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = {
+            'LOCAL_CONFIG_DIR': self.tmp_dir,
+            'DAEMON_SOCK_PATH': os.path.join(self.tmp_dir, 'daemon.sock'),
+            'DAEMON_PID_PATH': os.path.join(self.tmp_dir, 'daemon.pid'),
+        }
+        self.orig_paths = {key: getattr(daemon, key) for key in self.paths}
+        for key, val in self.paths.items():
+            setattr(daemon, key, val)
+
+    def tearDown(self):
+        for key, val in self.orig_paths.items():
+            setattr(daemon, key, val)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fallback(self):
+        self.assertIsNone(daemon.forward(['ppl', 'list']))
+        self.assertIsNone(daemon.daemon_pid())
+
+    def test_forward(self):
+        pid = os.fork()
+        if pid == 0:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            try:
+                EchoDaemon().serve()
+            finally:
+                os._exit(0)
+        try:
+            for _ in range(100):
+                if daemon.daemon_pid() is not None:
+                    break
+                time.sleep(.05)
+            self.assertEqual(daemon.daemon_pid(), pid)
+            read_fd, write_fd = os.pipe()
+            stdout = os.dup(1)
+            os.dup2(write_fd, 1)
+            os.environ['JARVIS_TEST_VAR'] = 'forwarded'
+            try:
+                self.assertEqual(daemon.forward(['ppl', 'list']), 0)
+                self.assertEqual(daemon.forward(['fail']), 3)
+            finally:
+                del os.environ['JARVIS_TEST_VAR']
+                os.dup2(stdout, 1)
+                os.close(stdout)
+                os.close(write_fd)
+            with os.fdopen(read_fd) as fp:
+                lines = fp.read().splitlines()
+            self.assertEqual(lines, ['ppl list forwarded', 'fail forwarded'])
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        self.assertFalse(os.path.exists(self.paths['DAEMON_SOCK_PATH']))
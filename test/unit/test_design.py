@@ -0,0 +1,63 @@
+"""
+Test the design matrix of the pipeline iterator
+"""
+from jarvis_cd.basic.design import DesignMatrix
+from unittest import TestCase
+
+
+class TestDesign(TestCase):
+    def setUp(self):
+        self.groups = [
+            [('ior.nprocs', [1, 2, 4, 8])],
+            [('ior.xfer', ['1m', '4m']), ('ior.block', ['1g', '4g'])],
+        ]
+
+    def points(self, design):
+        return [design[i] for i in range(len(design))]
+
+    def test_grid(self):
+        design = DesignMatrix(self.groups).expand()
+        self.assertEqual(len(design), 8)
+        self.assertEqual(self.points(design)[:3], [(0, 0), (0, 1), (1, 0)])
+        self.assertEqual(design.summary(), '8 of 8 points '
+                         '(0 pruned by constraints, 0 duplicates)')
+
+    def test_gray(self):
+        design = DesignMatrix(self.groups).expand(order=[1, 0], gray=True)
+        points = self.points(design)
+        self.assertEqual(points[:5], [(0, 0), (1, 0), (2, 0), (3, 0), (3, 1)])
+        for prev, cur in zip(points, points[1:]):
+            self.assertEqual(sum(a != b for a, b in zip(prev, cur)), 1)
+
+    def test_constraints(self):
+        design = DesignMatrix(
+            self.groups, ['ior.nprocs <= ior.ppn * len(hostfile)'],
+            fixed={'ior': {'ppn': 2}}, env={'hostfile': ['a', 'b']})
+        design.expand()
+        self.assertEqual(len(design), 6)
+        self.assertEqual(design.num_invalid, 2)
+        self.assertTrue(design.is_valid((2, 1)))
+        self.assertFalse(design.is_valid((3, 1)))
+        # Expressions which do not work on arrays are still evaluated
+        design = DesignMatrix(
+            self.groups, ["ior.nprocs > 1 and ior.xfer == '4m'"]).expand()
+        self.assertEqual(self.points(design), [(1, 1), (2, 1), (3, 1)])
+
+    def test_nnodes(self):
+        groups = [[('hostfile.nnodes', [1, 2, 4, 8])]]
+        design = DesignMatrix(
+            groups, ['hostfile.nnodes <= len(hostfile)'],
+            env={'hostfile': ['a', 'b', 'c', 'd']}).expand()
+        self.assertEqual(self.points(design), [(0,), (1,), (2,)])
+
+    def test_dedup(self):
+        groups = [[('ior.nprocs', [1, 2, 1])], [('ior.xfer', ['1m', '4m'])]]
+        design = DesignMatrix(groups).expand()
+        self.assertEqual(len(design), 4)
+        self.assertEqual(design.num_duplicates, 2)
+        self.assertEqual(design.total, 6)
+
+    def test_errors(self):
+        design = DesignMatrix(self.groups, ['ior.missing > 1'])
+        with self.assertRaises(Exception):
+            design.expand()
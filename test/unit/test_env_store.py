@@ -0,0 +1,48 @@
+"""
+Test the environment snapshot store
+"""
+from jarvis_cd.basic.env_store import EnvStore
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+
+
+class TestEnvStore(TestCase):
+    def setUp(self):
+        self.env_dir = tempfile.mkdtemp()
+        self.store = EnvStore(self.env_dir)
+        self.base = {'PATH': '/usr/bin', 'HOME': '/home/jarvis',
+                     'LD_LIBRARY_PATH': '/usr/lib'}
+
+    def tearDown(self):
+        shutil.rmtree(self.env_dir)
+
+    def test_dedup(self):
+        digest = self.store.put(self.base)
+        self.assertEqual(self.store.put(dict(self.base)), digest)
+        self.assertEqual(os.listdir(self.store.snapshot_dir),
+                         [f'{digest}.json'])
+
+    def test_delta_round_trip(self):
+        digest = self.store.put(self.base)
+        env = dict(self.base)
+        env['PATH'] = '/opt/bin:/usr/bin'
+        env['HERMES_CONF'] = '/tmp/hermes.yaml'
+        del env['HOME']
+        env_ref = self.store.delta(env, digest)
+        self.assertEqual(env_ref['set'], {'PATH': '/opt/bin:/usr/bin',
+                                          'HERMES_CONF': '/tmp/hermes.yaml'})
+        self.assertEqual(env_ref['unset'], ['HOME'])
+        # Parse the snapshot from disk, not the memo
+        EnvStore.snapshots.pop(digest)
+        new_env, new_digest = self.store.compose(env_ref)
+        self.assertEqual(new_env, env)
+        self.assertEqual(new_digest, digest)
+        # The memoized snapshot is not modified by compose
+        self.assertEqual(self.store.get(digest), self.base)
+
+    def test_compose_full_env(self):
+        env, digest = self.store.compose(dict(self.base))
+        self.assertEqual(env, self.base)
+        self.assertEqual(self.store.delta(env, digest)['set'], {})
@@ -0,0 +1,43 @@
+"""
+Test the locks which protect jarvis state
+"""
+from jarvis_cd.basic.file_lock import FileLock, save_if_changed
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+
+
+class TestFileLock(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lock_path = os.path.join(self.tmp_dir, 'locks', 'test.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_shared(self):
+        with FileLock(self.lock_path, shared=True):
+            with FileLock(self.lock_path, shared=True, timeout=0):
+                pass
+
+    def test_exclusive(self):
+        with FileLock(self.lock_path, shared=True):
+            with self.assertRaises(Exception):
+                with FileLock(self.lock_path, timeout=.05):
+                    pass
+        with FileLock(self.lock_path, timeout=0):
+            pass
+
+    def test_save_if_changed(self):
+        path = os.path.join(self.tmp_dir, 'conf.yaml')
+
+        def save(text):
+            def write(tmp_path):
+                with open(tmp_path, 'w', encoding='utf-8') as fp:
+                    fp.write(text)
+            return write
+        self.assertTrue(save_if_changed(path, save('a: 1\n')))
+        self.assertFalse(save_if_changed(path, save('a: 1\n')))
+        self.assertTrue(save_if_changed(path, save('a: 2\n')))
+        self.assertEqual(os.listdir(self.tmp_dir), ['conf.yaml'])
@@ -0,0 +1,68 @@
+"""
+Benchmark the import time of the jarvis CLI
+"""
+from unittest import TestCase
+import pathlib
+import subprocess
+import sys
+import os
+
+# Modules which only specific subcommands may import
+DEFERRED_MODULES = [
+    'pandas',
+    'numpy',
+    'jarvis_util.shell.slurm_exec',
+    'jarvis_util.shell.pbs_exec',
+]
+# The import-time budget in microseconds
+IMPORT_BUDGET_US = int(os.getenv('JARVIS_IMPORT_BUDGET_US', 500000))
+
+
+def import_times(code):
+    """
+    Run python -X importtime and parse its report
+
+    :param code: The python code to run
+    :return: A tuple of (dict mapping module name to cumulative import
+    time in us, total import time in us)
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True, check=True)
+    times = {}
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+        # Top-level imports are indented by a single space
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return times, total
+
+
+class TestImportTime(TestCase):
+    """
+    Catch regressions in jarvis startup time
+    """
+    def test_pkg_import(self):
+        times, _ = import_times('import jarvis_cd.basic.pkg')
+        for mod in DEFERRED_MODULES:
+            self.assertNotIn(mod, times)
+        self.assertLess(times['jarvis_cd.basic.pkg'], IMPORT_BUDGET_US)
+
+    def test_cli_import(self):
+        bin_path = os.path.join(
+            pathlib.Path(__file__).parent.parent.parent.resolve(),
+            'bin', 'jarvis')
+        # Load bin/jarvis as a module without running a subcommand
+        code = ('import importlib.machinery, importlib.util\n'
+                f'loader = importlib.machinery.SourceFileLoader('
+                f'"jarvis_cli", "{bin_path}")\n'
+                'spec = importlib.util.spec_from_loader("jarvis_cli", loader)\n'
+                'loader.exec_module(importlib.util.module_from_spec(spec))\n')
+        times, total = import_times(code)
+        for mod in DEFERRED_MODULES:
+            self.assertNotIn(mod, times)
+        self.assertLess(total, IMPORT_BUDGET_US)
@@ -0,0 +1,67 @@
+"""
+Test how sweeps restart services between runs
+"""
+from jarvis_cd.basic.jarvis_manager import JarvisManager
+from jarvis_cd.basic.pkg import Pipeline
+from unittest import TestCase
+import contextlib
+import io
+import time
+
+
+class TestKeepWarm(TestCase):
+    def setUp(self):
+        self.jarvis = JarvisManager.get_instance()
+        self.jarvis.add_repo(
+            f'{self.jarvis.jarvis_root}/test/unit/test_repo', True)
+        self.pipeline = Pipeline().from_yaml_dict({
+            'name': 'test_keep_warm',
+            'pkgs': [
+                {'pkg_type': 'first', 'pkg_name': 'first'},
+                {'pkg_type': 'warm', 'pkg_name': 'warm'},
+                {'pkg_type': 'third', 'pkg_name': 'third'},
+            ]
+        }).save()
+
+    def tearDown(self):
+        self.pipeline.destroy()
+        self.jarvis.remove_repo('test_repo')
+
+    def run_warm(self, running):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            running = self.pipeline.run_warm(running, set())
+        return running, stdout.getvalue().splitlines()
+
+    def test_run_warm(self):
+        running, lines = self.run_warm(set())
+        self.assertEqual(running, {'warm'})
+        running, lines = self.run_warm(running)
+        self.assertEqual(running, {'warm'})
+        # Only the service which defines warm_reset is kept running
+        self.assertIn('warm warm_reset', lines)
+        self.assertNotIn('warm start', lines)
+        # The others are stopped and started again, keeping their config
+        self.assertIn('first start', lines)
+        self.assertIn('first stop', lines)
+        self.assertIn('third start', lines)
+        self.pipeline.save()
+        pipeline = Pipeline().load('test_keep_warm')
+        self.assertIsNotNone(pipeline.get_pkg('first'))
+        self.pipeline.stop_running(running)
+
+    def test_restart_cost(self):
+        first = self.pipeline.get_pkg('first')
+        # first has no kill, so it is stopped instead
+        first.stop = lambda: time.sleep(.1)
+        first.clean = lambda: time.sleep(.1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.pipeline.run(kill=True)
+            self.pipeline.clean(with_iter_out=False)
+        self.assertGreaterEqual(first.kill_time, .1)
+        self.assertGreaterEqual(first.clean_time, .1)
+        self.pipeline.record_restart_costs()
+        costs = self.pipeline.config['restart_costs']
+        self.assertAlmostEqual(costs['first'], first.start_time +
+                               first.kill_time + first.clean_time)
+        self.assertGreaterEqual(costs['first'], .2)
@@ -0,0 +1,95 @@
+"""
+Test running the points of a sweep on partitions of the hostfile
+"""
+from jarvis_util.util.hostfile import Hostfile
+from jarvis_cd.basic.jarvis_manager import JarvisManager
+from jarvis_cd.basic.pkg import Pipeline
+from jarvis_cd.basic.stats_sink import StatsSink
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+
+class TestPartitions(TestCase):
+    def setUp(self):
+        self.jarvis = JarvisManager.get_instance()
+        self.jarvis.add_repo(
+            f'{self.jarvis.jarvis_root}/test/unit/test_repo', True)
+        self.tmp_dir = tempfile.mkdtemp()
+        hostfile_path = os.path.join(self.tmp_dir, 'hostfile')
+        with open(hostfile_path, 'w', encoding='utf-8') as fp:
+            fp.write('localhost\n127.0.0.1\n')
+        self.hostfile = self.jarvis.hostfile
+        self.jarvis.hostfile = Hostfile(hostfile=hostfile_path)
+        self.output = os.path.join(self.tmp_dir, 'output')
+        self.pipeline = Pipeline().from_yaml_iter_dict({
+            'config': {
+                'name': 'test_partitions',
+                'pkgs': [
+                    {'pkg_type': 'first', 'pkg_name': 'first'},
+                    {'pkg_type': 'third', 'pkg_name': 'third'},
+                ],
+            },
+            'vars': {'third.port': [7, 8, 9]},
+            'loop': [['third.port']],
+            'repeat': 2,
+            'output': self.output,
+            'partitions': 2,
+        }).save()
+
+    def tearDown(self):
+        for k in range(2):
+            Pipeline().load(f'test_partitions_part{k}').destroy()
+        self.pipeline.destroy()
+        self.jarvis.hostfile = self.hostfile
+        self.jarvis.remove_repo('test_repo')
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run_partitions(self):
+        self.pipeline.run_iter()
+        sink = StatsSink(os.path.join(self.output, 'runs.jsonl'))
+        runs = [record for record in sink.records() if sink.is_run(record)]
+        self.assertEqual(sorted((run['conf']['third.port'], run['rep'])
+                                for run in runs),
+                         [(port, rep) for port in [7, 8, 9]
+                          for rep in range(2)])
+        # Each partition ran a saved copy of the pipeline on one host
+        for k in range(2):
+            pipeline = Pipeline().load(f'test_partitions_part{k}')
+            self.assertIn('iterator', pipeline.config)
+            path = os.path.join(self.output, f'hostfile_part{k}')
+            with open(path, encoding='utf-8') as fp:
+                self.assertEqual(len(fp.read().split()), 1)
+
+    def test_uneven_partitions(self):
+        hostfile_path = os.path.join(self.tmp_dir, 'hostfile3')
+        with open(hostfile_path, 'w', encoding='utf-8') as fp:
+            fp.write('node0\nnode1\nnode2\n')
+        self.jarvis.hostfile = Hostfile(hostfile=hostfile_path)
+        output = os.path.join(self.tmp_dir, 'uneven')
+        pipeline = Pipeline().from_yaml_iter_dict({
+            'config': {
+                'name': 'test_partitions_uneven',
+                'pkgs': [{'pkg_type': 'first', 'pkg_name': 'first'}],
+            },
+            'vars': {'hostfile.nnodes': [1, 2, 3]},
+            'loop': [['hostfile.nnodes']],
+            'repeat': 1,
+            'output': output,
+            'partitions': 2,
+        }).save()
+        pipeline.run_iter()
+        # The leftover host goes to the first partition
+        for k, nnodes in enumerate([2, 1]):
+            path = os.path.join(output, f'hostfile_part{k}')
+            with open(path, encoding='utf-8') as fp:
+                self.assertEqual(len(fp.read().split()), nnodes)
+        # 3 nodes fit on no partition, and 2 nodes only on the first
+        sink = StatsSink(os.path.join(output, 'runs.jsonl'))
+        runs = [record for record in sink.records() if sink.is_run(record)]
+        self.assertEqual(sorted(run['conf']['hostfile.nnodes']
+                                for run in runs), [1, 2])
+        for k in range(2):
+            Pipeline().load(f'test_partitions_uneven_part{k}').destroy()
+        pipeline.destroy()
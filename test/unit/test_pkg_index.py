@@ -0,0 +1,52 @@
+"""
+Test the pkg class index
+"""
+from jarvis_cd.basic.pkg_index import PkgIndex
+from unittest import TestCase
+import pathlib
+import shutil
+import tempfile
+import os
+
+
+class TestPkgIndex(TestCase):
+    """
+    Test the on-disk pkg index
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        test_repo = os.path.join(
+            pathlib.Path(__file__).parent.resolve(), 'test_repo')
+        self.repo_path = os.path.join(self.tmp_dir, 'test_repo')
+        shutil.copytree(test_repo, self.repo_path)
+        self.repos = [{'name': 'test_repo', 'path': self.repo_path}]
+        self.index_path = os.path.join(self.tmp_dir, 'pkg_index.yaml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find(self):
+        index = PkgIndex(self.index_path)
+        entry = index.find('second', self.repos)
+        self.assertEqual(entry['module'], 'test_repo.second.pkg')
+        self.assertEqual(entry['class'], 'Second')
+        self.assertEqual(entry['path'], self.repo_path)
+        self.assertIsNone(index.find('fourth', self.repos))
+        self.assertEqual(index.list_pkgs(self.repos[0]),
+                         ['first', 'second', 'third', 'warm'])
+        self.assertTrue(os.path.exists(self.index_path))
+
+    def test_incremental_refresh(self):
+        PkgIndex(self.index_path).refresh(self.repos)
+        # An unchanged repo is not rescanned
+        index = PkgIndex(self.index_path).refresh(self.repos)
+        self.assertFalse(index.modified)
+        # A new pkg is picked up once the repo directory changes
+        pkg_dir = os.path.join(self.repo_path, 'test_repo', 'fourth')
+        os.makedirs(pkg_dir)
+        with open(os.path.join(pkg_dir, 'pkg.py'), 'w',
+                  encoding='utf-8') as fp:
+            fp.write('')
+        index = PkgIndex(self.index_path)
+        entry = index.find('fourth', self.repos)
+        self.assertEqual(entry['class'], 'Fourth')
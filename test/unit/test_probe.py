@@ -0,0 +1,52 @@
+"""
+Test the service readiness probes
+"""
+from jarvis_cd.basic.probe import PortProbe, FileProbe, LogProbe, CmdProbe
+from unittest import TestCase
+import tempfile
+import shutil
+import socket
+import os
+
+
+class TestProbe(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_port(self):
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            port = server.getsockname()[1]
+            probe = PortProbe(['127.0.0.1'], port)
+            self.assertFalse(probe.ready())
+            server.listen()
+            self.assertTrue(probe.ready())
+
+    def test_file(self):
+        probe = FileProbe(os.path.join(self.tmp_dir, '*.log'), count=2)
+        for name in ['a.log', 'b.log']:
+            self.assertFalse(probe.ready())
+            open(os.path.join(self.tmp_dir, name), 'w').close()
+        self.assertTrue(probe.ready())
+
+    def test_log(self):
+        path = os.path.join(self.tmp_dir, 'server.log')
+        probe = LogProbe(path, r'listening on \d+')
+        self.assertFalse(probe.ready())
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.write('starting\nlistening on 8')
+            fp.flush()
+            # The line is not complete yet
+            self.assertFalse(probe.ready())
+            fp.write('080\n')
+        self.assertTrue(probe.ready())
+
+    def test_cmd(self):
+        self.assertTrue(CmdProbe('true').ready())
+        self.assertFalse(CmdProbe('false').ready())
+        self.assertTrue(CmdProbe('echo state:ok', pattern='state:ok').ready())
+        self.assertFalse(CmdProbe('echo state:fail',
+                                  pattern='state:ok').ready())
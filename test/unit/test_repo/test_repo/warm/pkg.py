@@ -0,0 +1,47 @@
+"""
+Warm pkg example
+"""
+from jarvis_cd.basic.pkg import Service
+from jarvis_util import *
+
+
+class Warm(Service):
+    """
+    Service example which can be kept running during sweeps
+    """
+    def _init(self):
+        pass
+
+    def _configure_menu(self):
+        """
+        Create a CLI menu for the configurator method.
+        For thorough documentation of these parameters, view:
+        https://github.com/scs-lab/jarvis-util/wiki/3.-Argument-Parsing
+
+        :return: List(dict)
+        """
+        return []
+
+    def _configure(self, **kwargs):
+        pass
+
+    def start(self):
+        print('warm start')
+
+    def stop(self):
+        print('warm stop')
+
+    def warm_reset(self):
+        """
+        Remove the data of the last run, so the service can be kept
+        running for the next run of a sweep.
+
+        :return: None
+        """
+        print('warm warm_reset')
+
+    def clean(self):
+        print('warm clean')
+
+    def status(self):
+        return True
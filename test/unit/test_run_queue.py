@@ -0,0 +1,74 @@
+"""
+Test the run queue of jarvis
+"""
+from jarvis_cd.basic.run_queue import RunQueue, backfill
+from unittest import TestCase
+import contextlib
+import io
+import tempfile
+import time
+
+
+def job(job_id, nnodes, runtime=None, start=None):
+    return {'id': job_id, 'nnodes': nnodes, 'time': runtime, 'start': start}
+
+
+def run_job(job, hostfile_path):
+    with open(hostfile_path) as fp:
+        hosts = fp.read().split()
+    assert len(hosts) == job['nnodes']
+    time.sleep(.1)
+    return 3 if job['pipeline'] == 'bad' else 0
+
+
+class TestRunQueue(TestCase):
+    def ids(self, jobs):
+        return [job['id'] for job in jobs]
+
+    def test_in_order(self):
+        pending = [job(0, 2), job(1, 1), job(2, 2)]
+        self.assertEqual(self.ids(backfill(pending, [], 3, 0)), [0, 1])
+
+    def test_backfill(self):
+        # Job 0 waits for the 4 nodes of the running job, which ends at 100
+        running = [job(9, 4, 100, 0)]
+        pending = [job(0, 7), job(1, 2, 50), job(2, 2, 500), job(3, 1)]
+        # Job 1 ends before job 0 can start, and job 3 uses the node job 0
+        # leaves over; job 2 would delay job 0
+        self.assertEqual(self.ids(backfill(pending, running, 4, 10)), [1, 3])
+        # With 5 free nodes, 3 are left over once job 0 starts
+        pending = [job(0, 6), job(2, 2, 500), job(3, 1), job(4, 1)]
+        self.assertEqual(self.ids(backfill(pending, running, 5, 10)), [2, 3])
+
+    def test_unknown_runtime(self):
+        # It is unknown when job 0 can start, so even job 1, which has a
+        # runtime, may delay it
+        running = [job(9, 4, None, 0)]
+        pending = [job(0, 6), job(1, 2, 50), job(2, 2)]
+        self.assertEqual(self.ids(backfill(pending, running, 2, 10)), [])
+        # Jobs may still use the nodes job 0 leaves over
+        pending = [job(0, 5), job(1, 2, 50), job(2, 1)]
+        self.assertEqual(self.ids(backfill(pending, running, 2, 10)), [2])
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as config_dir:
+            queue = RunQueue(config_dir)
+            queue.add('a', nnodes=2)
+            queue.add('bad', nnodes=1)
+            queue.add('a', nnodes=1)
+            queue.add('huge', nnodes=8)
+            with contextlib.redirect_stdout(io.StringIO()):
+                summary = queue.run(['n0', 'n1', 'n2'], run_job, poll=.01)
+            jobs = queue.jobs()
+            self.assertEqual([job['state'] for job in jobs],
+                             ['done', 'failed', 'done', 'failed'])
+            self.assertEqual(jobs[1]['exit_code'], 3)
+            self.assertEqual(len(jobs[0]['hosts']), 2)
+            # The second run of a waits for the first one
+            self.assertGreaterEqual(jobs[2]['start'], jobs[0]['end'])
+            self.assertEqual(summary['jobs'], 3)
+            self.assertEqual(summary['failed'], 1)
+            self.assertGreater(summary['utilization'], 0)
+            self.assertLessEqual(summary['utilization'], 1)
+            queue.clear()
+            self.assertEqual(queue.jobs(), [])
@@ -0,0 +1,86 @@
+"""
+Test the search strategies of the pipeline iterator
+"""
+from jarvis_cd.basic.search import get_strategy, latin_hypercube, \
+    count_changes, relative_ci
+from unittest import TestCase
+import random
+import math
+
+
+def run(strategy, score):
+    points = []
+    point = strategy.next()
+    while point is not None:
+        points.append(point)
+        strategy.report(point, score(point))
+        point = strategy.next()
+    return points
+
+
+class TestSearch(TestCase):
+    def test_grid(self):
+        self.assertIsNone(get_strategy({}, [3, 4]))
+
+    def test_random(self):
+        strategy = get_strategy({'strategy': 'random', 'samples': 5,
+                                 'seed': 1}, [3, 4])
+        points = run(strategy, lambda point: None)
+        self.assertEqual(len(points), 5)
+        self.assertEqual(len(set(points)), 5)
+        # Asking for more samples than points runs each point once
+        strategy = get_strategy({'strategy': 'random', 'samples': 100}, [2, 2])
+        self.assertEqual(len(set(run(strategy, lambda point: None))), 4)
+
+    def test_latin_hypercube(self):
+        points = latin_hypercube([8, 8], 8, random.Random(0))
+        self.assertEqual(len(points), 8)
+        # Every value of every loop group is used once
+        self.assertEqual(sorted(point[0] for point in points), list(range(8)))
+        self.assertEqual(sorted(point[1] for point in points), list(range(8)))
+
+    def test_patience(self):
+        strategy = get_strategy({'strategy': 'lhs', 'samples': 10,
+                                 'patience': 3, 'metric': 'ior.runtime',
+                                 'seed': 0}, [10])
+        points = run(strategy, lambda point: 1)
+        self.assertEqual(len(points), 4)
+        self.assertTrue(strategy.converged())
+
+    def test_halving(self):
+        strategy = get_strategy({'strategy': 'halving', 'samples': 8,
+                                 'metric': 'ior.runtime', 'seed': 0},
+                                [16, 16])
+        points = run(strategy, lambda point: (point[0] - 12) ** 2 +
+                     (point[1] - 3) ** 2)
+        self.assertLessEqual(len(points), strategy.max_points())
+        self.assertEqual(strategy.get_repeat(points[-1]), 8)
+        best = strategy.scores[strategy.best]
+        self.assertEqual(best, min(strategy.scores.values()))
+        self.assertLessEqual(best, min(strategy.scores[point]
+                                       for point in points[:8]))
+
+    def test_halving_metric(self):
+        with self.assertRaises(Exception):
+            get_strategy({'strategy': 'halving'}, [4])
+        with self.assertRaises(Exception):
+            get_strategy({'strategy': 'anneal'}, [4])
+
+    def test_count_changes(self):
+        # A 3x4 grid: the inner group changes every step but 2 in the
+        # default order, and the outer group changes twice
+        self.assertEqual(count_changes([3, 4]), [2, 11])
+        # In a Gray code, exactly one group changes per step
+        self.assertEqual(count_changes([3, 4], gray=True), [2, 9])
+        self.assertEqual(sum(count_changes([2, 3, 4], gray=True)), 23)
+        self.assertEqual(count_changes([1, 4]), [0, 3])
+
+    def test_relative_ci(self):
+        self.assertEqual(relative_ci([1]), math.inf)
+        self.assertEqual(relative_ci([2, 2, 2]), 0)
+        # mean 10, stdev 2 / sqrt(3), t(0.975, 3) = 3.182
+        self.assertAlmostEqual(relative_ci([9, 11, 9, 11]),
+                               3.182 * (2 / math.sqrt(3)) / 2 / 10, places=3)
+        # More repetitions tighten the interval
+        self.assertLess(relative_ci([9, 11] * 4), relative_ci([9, 11] * 2))
+        self.assertLess(relative_ci([9, 11], 0.9), relative_ci([9, 11], 0.99))
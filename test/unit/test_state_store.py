@@ -0,0 +1,93 @@
+"""
+Test the pipeline state backends
+"""
+from jarvis_cd.basic.state_store import (SnapshotStateStore, YamlStateStore,
+                                         open_state_store)
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+
+
+class TestStateStore(TestCase):
+    """
+    Test the snapshot and yaml state stores
+    """
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def fill(self, store):
+        store.put_config('ppl', {'sub_pkgs': [['first', 'first'],
+                                              ['second', 'second']],
+                                 'pkg_type': 'pipeline'})
+        store.put_config('ppl.first', {'sub_pkgs': [], 'port': 22})
+        store.put_config('ppl.second', {'sub_pkgs': [], 'port': 23})
+        store.put_env({'PATH': '/usr/bin'})
+        store.commit()
+
+    def test_snapshot_round_trip(self):
+        self.fill(open_state_store('snapshot', self.base_dir, 'ppl'))
+        path = os.path.join(self.base_dir, 'ppl', 'pipeline.json')
+        self.assertTrue(os.path.exists(path))
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertEqual(store.get_config('ppl.first')['port'], 22)
+        self.assertEqual(store.get_env(), {'PATH': '/usr/bin'})
+        # Removing a pkg removes its sub-pkgs
+        store.remove('ppl')
+        store.commit()
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertFalse(store.exists('ppl.second'))
+
+    def test_migrate_from_yaml(self):
+        self.fill(YamlStateStore(self.base_dir, 'ppl'))
+        yaml_path = os.path.join(self.base_dir, 'ppl', 'first', 'first.yaml')
+        self.assertTrue(os.path.exists(yaml_path))
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertEqual(store.get_config('ppl.second')['port'], 23)
+        self.assertEqual(store.get_env(), {'PATH': '/usr/bin'})
+        self.assertTrue(os.path.exists(store.path))
+        self.assertFalse(os.path.exists(yaml_path))
+
+    def test_unchanged_commit(self):
+        self.fill(SnapshotStateStore(self.base_dir, 'ppl'))
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        config = store.get_config('ppl.first')
+        self.assertEqual(store.config_hash('ppl.first'),
+                         store.digest(store.dumps(config)))
+        # Nothing staged, nothing written
+        store.commit()
+        self.assertEqual(store.bytes_written, 0)
+        # Only a changed config is serialized again
+        config['port'] = 24
+        store.put_config('ppl.first', config)
+        store.commit()
+        self.assertGreater(store.bytes_written, 0)
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertEqual(store.get_config('ppl.first')['port'], 24)
+        self.assertEqual(store.get_config('ppl.second')['port'], 23)
+
+    def test_hold_release(self):
+        store = SnapshotStateStore(self.base_dir, 'ppl').hold()
+        self.fill(store)
+        self.assertFalse(os.path.exists(store.path))
+        store.release()
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertEqual(store.get_config('ppl.first')['port'], 22)
+
+    def test_concurrent_commits(self):
+        self.fill(SnapshotStateStore(self.base_dir, 'ppl'))
+        first = SnapshotStateStore(self.base_dir, 'ppl').load()
+        second = SnapshotStateStore(self.base_dir, 'ppl').load()
+        config = dict(first.get_config('ppl.first'), port=30)
+        first.put_config('ppl.first', config)
+        first.commit()
+        # The second store was read before the first committed
+        config = dict(second.get_config('ppl.second'), port=31)
+        second.put_config('ppl.second', config)
+        second.commit()
+        store = SnapshotStateStore(self.base_dir, 'ppl')
+        self.assertEqual(store.get_config('ppl.first')['port'], 30)
+        self.assertEqual(store.get_config('ppl.second')['port'], 31)
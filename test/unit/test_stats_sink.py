@@ -0,0 +1,75 @@
+"""
+Test the stats sink of the pipeline iterator
+"""
+from jarvis_cd.basic.stats_sink import StatsSink
+from unittest import TestCase
+import shutil
+import tempfile
+import csv
+import os
+
+
+class TestStatsSink(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sink = StatsSink(os.path.join(self.tmp_dir, 'runs.jsonl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_csv(self):
+        self.sink.append({'ior.xfer': 1}, 0, {'ior.xfer': 1, 'ior.runtime': 2})
+        self.sink.append({'ior.xfer': 2}, 0, {'ior.xfer': 2,
+                                              'ior.runtime': 3,
+                                              'ior.train_time(s)': 4})
+        csv_path = os.path.join(self.tmp_dir, 'stats_dict.csv')
+        self.sink.to_csv(csv_path)
+        with open(csv_path, 'r', encoding='utf-8') as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows, [
+            ['ior.xfer', 'ior.runtime', 'ior.train_time(s)'],
+            ['1', '2', ''],
+            ['2', '3', '4'],
+        ])
+
+    def test_repair(self):
+        self.sink.append({'a': 1}, 0, {'a': 1})
+        with open(self.sink.path, 'a', encoding='utf-8') as fp:
+            fp.write('{"conf": {"a": 2}, "re')
+        self.assertEqual(len(list(self.sink.records())), 1)
+        self.sink.repair()
+        self.sink.append({'a': 2}, 0, {'a': 2})
+        self.assertEqual(list(self.sink), [{'a': 1}, {'a': 2}])
+
+    def test_read(self):
+        records, offset = self.sink.read()
+        self.assertEqual((records, offset), ([], 0))
+        self.sink.append({'a': 1}, 0, {'a': 1})
+        records, offset = self.sink.read(offset)
+        self.assertEqual(len(records), 1)
+        self.sink.append({'a': 1}, 1, {'a': 1})
+        records, offset = self.sink.read(offset)
+        self.assertEqual([record['rep'] for record in records], [1])
+        self.assertEqual(offset, os.path.getsize(self.sink.path))
+
+    def test_points(self):
+        self.sink.append({'a': 1}, 0, {'a': 1, 'b': 5}, warmup=True)
+        self.sink.append({'a': 1}, 1, {'a': 1, 'b': 2})
+        self.sink.append({'a': 1}, 2, {'a': 1, 'b': 3})
+        self.sink.append_point({'a': 1}, {'point.reps': 2, 'point.ci': 0.5})
+        self.assertEqual(list(self.sink), [
+            {'a': 1, 'b': 2, 'point.reps': 2, 'point.ci': 0.5},
+            {'a': 1, 'b': 3, 'point.reps': 2, 'point.ci': 0.5},
+        ])
+        self.assertEqual(len(list(self.sink.records())), 4)
+
+    def test_merge(self):
+        part = StatsSink(os.path.join(self.tmp_dir, 'part0.jsonl'))
+        self.sink.append({'a': 1}, 0, {'a': 1})
+        part.append({'a': 2}, 0, {'a': 2})
+        self.sink.merge(part)
+        self.assertEqual(list(self.sink), [{'a': 1}, {'a': 2}])
+        self.assertFalse(os.path.exists(part.path))
+        # Merging an empty sink does nothing
+        self.sink.merge(part)
+        self.assertEqual(len(list(self.sink)), 2)
@@ -0,0 +1,126 @@
+"""
+Test the Chrome Trace output of pipeline commands
+"""
+from jarvis_cd.basic import trace
+from jarvis_cd.basic.trace import Tracer
+from unittest import TestCase
+import threading
+import shutil
+import tempfile
+import json
+import os
+
+
+class TestTrace(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def spans(self, tracer):
+        return self.spans_of(tracer.events)
+
+    def spans_of(self, events):
+        return [event for event in events if event['ph'] == 'X']
+
+    def test_nested_spans(self):
+        tracer = Tracer(enabled=True)
+        with tracer.span('start', 'pipeline'):
+            with tracer.span('hermes_run start', 'start', hosts=2):
+                pass
+        inner, outer = self.spans(tracer)
+        self.assertEqual(inner['name'], 'hermes_run start')
+        self.assertEqual(inner['args'], {'hosts': 2})
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'],
+                                inner['ts'] + inner['dur'])
+
+    def test_error(self):
+        tracer = Tracer(enabled=True)
+        with self.assertRaises(ValueError):
+            with tracer.span('stop'):
+                raise ValueError('bad')
+        span, = self.spans(tracer)
+        self.assertIn('bad', span['args']['error'])
+
+    def test_threads(self):
+        tracer = Tracer(enabled=True)
+        # Keep every thread alive, so thread ids are not reused
+        barrier = threading.Barrier(4)
+
+        def work():
+            with tracer.span('work'):
+                barrier.wait()
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        names = [event for event in tracer.events
+                 if event['name'] == 'thread_name']
+        self.assertEqual(len(names), 4)
+        self.assertEqual(len(self.spans(tracer)), 4)
+
+    def test_save(self):
+        tracer = Tracer(enabled=True)
+        with tracer.span('start'):
+            tracer.instant('ready')
+        path = os.path.join(self.tmp_dir, 'iter', 'trace.json')
+        tracer.save(path)
+        with open(path, 'r', encoding='utf-8') as fp:
+            events = json.load(fp)
+        phases = [event['ph'] for event in events]
+        self.assertEqual(phases, ['M', 'M', 'i', 'X'])
+
+    def test_flush(self):
+        tracer = Tracer(enabled=True)
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        with tracer.span('point 0'):
+            pass
+        tracer.flush(path)
+        self.assertEqual(tracer.events, [])
+        # The file is readable before it is closed
+        with open(path, 'r', encoding='utf-8') as fp:
+            events = json.loads(fp.read() + ']')
+        self.assertEqual([event['ph'] for event in events], ['M', 'M', 'X'])
+        with tracer.span('point 1'):
+            pass
+        tracer.save(path)
+        with open(path, 'r', encoding='utf-8') as fp:
+            events = json.load(fp)
+        self.assertEqual([event['name'] for event in self.spans_of(events)],
+                         ['point 0', 'point 1'])
+
+    def test_max_events(self):
+        max_events = trace.MAX_EVENTS
+        trace.MAX_EVENTS = 3
+        try:
+            tracer = Tracer(enabled=True)
+            for i in range(5):
+                tracer.instant(f'event {i}')
+        finally:
+            trace.MAX_EVENTS = max_events
+        # The thread name and 2 events
+        self.assertEqual(len(tracer.events), 3)
+        self.assertEqual(tracer.dropped, 3)
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        tracer.save(path)
+        with open(path, 'r', encoding='utf-8') as fp:
+            dropped = json.load(fp)[-1]
+        self.assertEqual(dropped['args'], {'count': 3})
+
+    def test_disabled(self):
+        tracer = Tracer(enabled=False)
+        with tracer.activate(), tracer.span('start'):
+            tracer.instant('ready')
+        self.assertEqual(tracer.events, [])
+        self.assertEqual(Tracer.active, [])
+        path = os.path.join(self.tmp_dir, 'trace.json')
+        tracer.save(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_exec_args(self):
+        name, args = Tracer.exec_args(['/usr/bin/rm -rf /tmp/a', 'ls'], None)
+        self.assertEqual(name, 'rm')
+        self.assertEqual(args, {'cmd': '/usr/bin/rm -rf /tmp/a; ls'})